@@ -0,0 +1,279 @@
+import asyncio
+import random
+from dlg import *
+from dlg_channels import get_aio_channel
+from dlg_audio import read_stream_outputs_async, stream_inputs_async
+from dlg_runner import build_steps
+from dlg_throttle import UNTHROTTLED_RPCS, session_pause
+
+'''
+asyncio counterpart of session_start built on grpc.aio.
+It reads the same config.json through get_setup_data, builds the same requests and checks
+responses with the same assert_dlg, but every RPC is awaitable so a single event loop can
+drive thousands of dialog sessions for load testing without a thread per session.
+
+    async with async_session_start(config) as session:
+        await session.execute(None, "Hello and welcome")
+        await session.execute("order coffee", "What size coffee would you like")
+        await session.execute_stream("order_coffee.wav", {"recognized": "order coffee", "tts": "true"})
+'''
+
+
+# Stop requests of exited sessions still running in the background, and the per loop bound on them
+_stop_tasks = set()
+_stop_limits = {}
+
+
+class async_session_start(session_start):
+    def __init__(self, config, overrides=None):
+        super().__init__(config, overrides)
+        self.stub = None
+
+    async def __aenter__(self):
+        self.get_setup_data()
+        if self.got_init_data:
+            await self.get_token_async()
+            if self.got_token == True:
+                self.connect()
+                self.stub = replay_stub() if self.record_mode == "replay" else DialogServiceStub(self.channel)
+                await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        'like session_start the Stop runs in the background, drain_stops_async waits for them'
+        if not self.session_started:
+            return
+        if int(self.project_data["teardown_workers"]) > 0:
+            task = asyncio.ensure_future(self._stop_in_background())
+            _stop_tasks.add(task)
+            task.add_done_callback(_stop_tasks.discard)
+        else:
+            await self.stop()
+
+    async def _stop_in_background(self):
+        loop = asyncio.get_running_loop()
+        if loop not in _stop_limits:
+            _stop_limits[loop] = asyncio.Semaphore(int(self.project_data["teardown_workers"]))
+        async with _stop_limits[loop]:
+            await self.stop()
+
+    async def get_token_async(self):
+        # the token cache is blocking, only the first session per credentials actually waits on the auth server
+        await asyncio.get_running_loop().run_in_executor(None, self.get_token)
+
+    def connect(self):
+        self.response = "connect"
+        if self.record_mode == "replay":
+            return
+        started = time.perf_counter()
+        try:
+            self.channel = get_aio_channel(self.project_data)
+        except grpc.RpcError as e:
+            self.response = {"errorMessage": "gRPC error at connect",
+                             "RpcError": str(e)}
+        self.record_timing("connect", started)
+
+    def record_attempt(self, rpc, code, elapsed):
+        'called with the status and time in seconds of every attempt, without throttling and retry backoff'
+        pass
+
+    async def throttle_async(self, rpc):
+        pause = session_pause(self.project_data, rpc)
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if rpc in UNTHROTTLED_RPCS:
+            return 0
+        return await self.rate_limiter.acquire_async()
+
+    async def call_rpc_async(self, method, rpc_request, idempotent=False):
+        rpc = RPC_NAMES.get(type(rpc_request).__name__)
+        path = self.conversation_path(rpc, rpc_request) if self.record_mode != "off" else None
+        if self.record_mode == "replay":
+            return self.replay_rpc(rpc, path), StatusCode.OK
+        wait = await self.throttle_async(rpc)
+        started = time.perf_counter()
+        attempt = 0
+        hedged = False
+        code = None
+        try:
+            while True:
+                attempt_started = time.perf_counter()
+                try:
+                    rpc_response, code, hedged = await self.policy.invoke_async(method, rpc_request, rpc, idempotent)
+                    self.record_attempt(rpc, code, time.perf_counter() - attempt_started)
+                    break
+                except grpc.RpcError as e:
+                    code = e.code()
+                    self.record_attempt(rpc, code, time.perf_counter() - attempt_started)
+                    self.rate_limiter.report(e.code())
+                    if not self.policy.should_retry(rpc, e.code(), attempt, idempotent):
+                        raise
+                    attempt += 1
+                    await asyncio.sleep(self.policy.backoff(attempt))
+                    retry_wait = await self.rate_limiter.acquire_async()
+                    wait += retry_wait
+                    started += retry_wait
+        finally:
+            self.record_timing(rpc, started, wait, attempt, hedged, code)
+        self.rate_limiter.report(code)
+        if self.record_mode == "record":
+            self.recordings.record(self.project_data, rpc, path, rpc_request, rpc_response)
+        return rpc_response, code
+
+    async def start(self):
+        requestName = "start_request"
+        try:
+            start_req = self.build_start_request()
+            start_response, code = await self.call_rpc_async(self.stub.Start, start_req)
+            assert code == StatusCode.OK
+            response = dialog_response(start_response)
+            self.session_id = response.session_id
+            self.response = response
+            self.session_opened()
+        except grpc.RpcError as e:
+            self.response = {"errorMessage": "gRPC error at start_request:",
+                             "RpcError": str(e)}
+        self.write_log(requestName)
+        return self.response
+
+    async def update(self, data):
+        requestName = "update_request"
+        try:
+            update_req = self.build_update_request(data)
+            update_response, code = await self.call_rpc_async(self.stub.Update, update_req)
+            assert code == StatusCode.OK
+            self.response = dialog_response(update_response)
+        except grpc.RpcError as e:
+            self.response = {"errorMessage": "gRPC error at update_request",
+                             "RpcError": str(e)}
+        self.write_log(requestName)
+        return self.response
+
+    async def execute(self, text=None, expected="", idempotent=False):
+        requestName = "execute_request"
+        if not self.got_init_data or self.got_token == False:
+            return
+        execute_request = self.build_execute_request(text)
+        if not is_error(self.response):
+            try:
+                execute_response, code = await self.call_rpc_async(self.stub.Execute, execute_request, idempotent)
+                assert code == StatusCode.OK
+                self.response = dialog_response(execute_response)
+            except grpc.RpcError as e:
+                self.response = {"errorMessage": "gRPC error at execute_request",
+                                 "RpcError": str(e)}
+        self.write_log(requestName)
+        assert_dlg(expected, self.response, self.match_mode)
+        return self.response
+
+    async def call_stream_rpc_async(self, execute_request, source):
+        if self.record_mode == "replay":
+            raise replay_miss("ExecuteStream", list(self.conversation))
+        tts_sample_rate = int(self.project_data["tts_sample_rate"])
+        wait = await self.throttle_async("ExecuteStream")
+        started = time.perf_counter()
+        code = None
+        try:
+            call = self.stub.ExecuteStream(stream_inputs_async(execute_request, source,
+                                                               float(self.project_data["realtime_factor"]),
+                                                               tts_sample_rate),
+                                           timeout=self.policy.deadline("ExecuteStream"))
+            collector = await read_stream_outputs_async(call)
+            code = await call.code()
+            self.record_attempt("ExecuteStream", code, time.perf_counter() - started)
+        except grpc.RpcError as e:
+            code = e.code()
+            self.record_attempt("ExecuteStream", code, time.perf_counter() - started)
+            self.rate_limiter.report(e.code())
+            raise
+        finally:
+            self.record_timing("ExecuteStream", started, wait, code=code)
+        self.rate_limiter.report(code)
+        last_response = collector.responses[-1] if collector.responses else ExecuteResponse()
+        return stream_response(last_response, collector.recognized_text, collector.audio_bytes,
+                               tts_sample_rate), code
+
+    async def execute_stream(self, audio, expected=""):
+        requestName = "execute_stream_request"
+        if not self.got_init_data or self.got_token == False:
+            return
+        execute_request = self.build_stream_request(audio)
+        if not is_error(self.response):
+            try:
+                self.response, code = await self.call_stream_rpc_async(execute_request, self.audio_source(audio))
+                assert code == StatusCode.OK
+            except grpc.RpcError as e:
+                self.response = {"errorMessage": "gRPC error at execute_stream_request",
+                                 "RpcError": str(e)}
+            except (OSError, ValueError) as e:
+                self.response = {"errorMessage": f"audio file {audio} could not be read: {e}"}
+        self.write_log(requestName)
+        assert_dlg(expected, self.response, self.match_mode)
+        return self.response
+
+    async def stop(self):
+        requestName = "stop_request"
+        stop_req = self.build_stop_request()
+        try:
+            stop_response, code = await self.call_rpc_async(self.stub.Stop, stop_req)
+            assert code == StatusCode.OK
+            self.response = dialog_response(stop_response)
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.NOT_FOUND:
+                self.response = {"errorMessage": "Session ended: NOT_FOUND error"}
+            else:
+                self.response = {"errorMessage": "gRPC error at stop_request",
+                                 "RpcError": str(e)}
+        self.session_closed()
+        self.write_log(requestName)
+        return self.response
+
+    async def status(self):
+        status_request = StatusRequest(session_id=self.session_id)
+        try:
+            status_response, code = await self.call_rpc_async(self.stub.Status, status_request)
+            assert code == StatusCode.OK
+            self.response = dialog_response(status_response)
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.NOT_FOUND:
+                self.response = {"errorMessage": "Session ended: NOT_FOUND error"}
+            else:
+                self.response = {"errorMessage": "gRPC error at status_request",
+                                 "RpcError": str(e)}
+        return self.response
+
+
+async def drain_stops_async():
+    'waits for the background Stop requests of the sessions of the running event loop'
+    loop = asyncio.get_running_loop()
+    while True:
+        tasks = [task for task in _stop_tasks if task.get_loop() is loop]
+        if not tasks:
+            break
+        await asyncio.gather(*tasks, return_exceptions=True)
+    _stop_limits.pop(loop, None)
+
+
+async def run_test_case_async(session, test_case, think_time=0):
+    '''
+    Same step semantics as dlg_runner.run_test_case for an async_session_start.
+    think_time optionally pauses (randomised around the given seconds) between user turns.
+    '''
+    for item, value in test_case.items():
+        if item == "userData":
+            await session.update({"userData": value})
+        if item == "steps":
+            first_turn = True
+            for action, text in build_steps(value):
+                if action != "empty_combine_with_next_step":
+                    if think_time and not first_turn:
+                        await asyncio.sleep(random.uniform(0.5, 1.5) * think_time)
+                    first_turn = False
+                    if isinstance(action, dict) and "audio" in action:
+                        await session.execute_stream(action["audio"], text)
+                    elif isinstance(action, dict):
+                        await session.execute(action["input"], text, idempotent=True)
+                    else:
+                        await session.execute(action, text)
+                else:
+                    assert_dlg(text, session.response, session.match_mode)
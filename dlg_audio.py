@@ -0,0 +1,205 @@
+import asyncio
+import mmap
+import os
+import struct
+import threading
+import time
+from nuance.dlg.v1.dlg_messages_pb2 import *
+from nuance.dlg.v1.dlg_interface_pb2 import *
+
+'''
+Streaming audio for ExecuteStream.
+Audio files are memory mapped and sent as memoryview slices, so a long utterance is never copied in full
+and the same file can be shared by many concurrent sessions. WAV headers are parsed to get the real
+sample rate, encoding and data range; headerless files are treated as 16 kHz 16 bit mono PCM.
+Packets are sized to packet_ms of audio and can be paced at real time (realtime_factor 1), faster
+(e.g. 4) or sent as fast as possible (0). Returned TTS audio is written to a sink as it arrives and
+the recognized text of the final ASR result is kept for the test assertions.
+'''
+
+DEFAULT_SAMPLE_RATE = 16000
+DEFAULT_PACKET_MS = 100
+# WAV format tags
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_ALAW = 6
+WAVE_FORMAT_MULAW = 7
+
+
+class audio_source:
+    def __init__(self, path, packet_ms=DEFAULT_PACKET_MS):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        self.encoding = "pcm"
+        self.sample_rate = DEFAULT_SAMPLE_RATE
+        self.channels = 1
+        self.sample_width = 2
+        self.data_start = 0
+        self.data_end = len(self.map)
+        if self.map[:4] == b"RIFF" and self.map[8:12] == b"WAVE":
+            self._parse_wav()
+        frame_size = self.sample_width * self.channels
+        self.bytes_per_second = self.sample_rate * frame_size
+        self.packet_size = max(int(self.bytes_per_second * packet_ms / 1000) // frame_size, 1) * frame_size
+
+    def _parse_wav(self):
+        offset = 12
+        while offset + 8 <= len(self.map):
+            chunk_id = self.map[offset:offset + 4]
+            chunk_size = struct.unpack_from("<I", self.map, offset + 4)[0]
+            body = offset + 8
+            if chunk_id == b"fmt ":
+                format_tag, self.channels, self.sample_rate = struct.unpack_from("<HHI", self.map, body)
+                bits = struct.unpack_from("<H", self.map, body + 14)[0]
+                self.sample_width = max(bits // 8, 1)
+                self.encoding = {WAVE_FORMAT_ALAW: "alaw", WAVE_FORMAT_MULAW: "ulaw"}.get(format_tag, "pcm")
+            elif chunk_id == b"data":
+                self.data_start = body
+                self.data_end = min(body + chunk_size, len(self.map))
+                break
+            # chunks are word aligned
+            offset = body + chunk_size + (chunk_size & 1)
+
+    @property
+    def duration(self):
+        return (self.data_end - self.data_start) / self.bytes_per_second
+
+    def audio_format(self):
+        if self.encoding == "pcm":
+            return {"pcm": {"sample_rate_hz": self.sample_rate}}
+        return {self.encoding: {}}
+
+    def _slices(self):
+        'yields (position in seconds, packet bytes)'
+        for offset in range(self.data_start, self.data_end, self.packet_size):
+            packet = self.view[offset:min(offset + self.packet_size, self.data_end)]
+            yield (offset - self.data_start) / self.bytes_per_second, packet.tobytes()
+
+    def packets(self, realtime_factor=0):
+        started = time.monotonic()
+        for position, packet in self._slices():
+            if realtime_factor:
+                delay = started + position / realtime_factor - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            yield packet
+
+    async def packets_async(self, realtime_factor=0):
+        started = time.monotonic()
+        for position, packet in self._slices():
+            if realtime_factor:
+                delay = started + position / realtime_factor - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield packet
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def resolve_audio_path(path, audio_folder=None):
+    'YAML steps name audio files relative to the audio_folder config value'
+    if audio_folder and not os.path.isabs(path) and not os.path.exists(path):
+        return os.path.join(audio_folder, path)
+    return path
+
+
+def get_audio_source(path, packet_ms=DEFAULT_PACKET_MS):
+    'audio files are mapped once and shared by every session that streams them'
+    with _sources_lock:
+        key = (path, packet_ms)
+        if key not in _sources:
+            _sources[key] = audio_source(path, packet_ms)
+        return _sources[key]
+
+
+def close_audio_sources():
+    with _sources_lock:
+        for source in _sources.values():
+            source.close()
+        _sources.clear()
+
+
+def tts_control(tts_sample_rate=DEFAULT_SAMPLE_RATE):
+    return {'audio_params': {'audio_format': {'pcm': {'sample_rate_hz': int(tts_sample_rate)}}}}
+
+
+def first_stream_input(execute_request, source, packet, tts_sample_rate):
+    'the request header goes with the first packet only, a text request is a single input without audio'
+    if source is None:
+        return StreamInput(request=execute_request, tts_control_v1=tts_control(tts_sample_rate), audio=b'')
+    return StreamInput(request=execute_request,
+                       asr_control_v1={'audio_format': source.audio_format()},
+                       tts_control_v1=tts_control(tts_sample_rate),
+                       audio=packet)
+
+
+def stream_inputs(execute_request, source=None, realtime_factor=0, tts_sample_rate=DEFAULT_SAMPLE_RATE):
+    if source is None:
+        yield first_stream_input(execute_request, None, None, tts_sample_rate)
+        return
+    first_packet = True
+    for packet in source.packets(realtime_factor):
+        if first_packet:
+            first_packet = False
+            yield first_stream_input(execute_request, source, packet, tts_sample_rate)
+        else:
+            yield StreamInput(audio=packet)
+
+
+async def stream_inputs_async(execute_request, source=None, realtime_factor=0, tts_sample_rate=DEFAULT_SAMPLE_RATE):
+    'same as stream_inputs, pacing with asyncio.sleep so it does not block the event loop'
+    if source is None:
+        yield first_stream_input(execute_request, None, None, tts_sample_rate)
+        return
+    first_packet = True
+    async for packet in source.packets_async(realtime_factor):
+        if first_packet:
+            first_packet = False
+            yield first_stream_input(execute_request, source, packet, tts_sample_rate)
+        else:
+            yield StreamInput(audio=packet)
+
+
+class stream_collector:
+    '''
+    Collects the outputs of an ExecuteStream call: the execute responses, the recognized text of the
+    final ASR result and the TTS audio, which is written to sink (any object with write()) as it arrives.
+    '''
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.responses = []
+        self.audio_bytes = 0
+        self.recognized_text = None
+
+    def add(self, stream_output):
+        if stream_output.HasField("response"):
+            self.responses.append(stream_output.response)
+        if stream_output.HasField("asr_result") and stream_output.asr_result.hypotheses:
+            self.recognized_text = stream_output.asr_result.hypotheses[0].formatted_text
+        audio = stream_output.audio.audio
+        if audio:
+            self.audio_bytes += len(audio)
+            if self.sink is not None:
+                self.sink.write(audio)
+
+
+def read_stream_outputs(stream_outputs, sink=None):
+    collector = stream_collector(sink)
+    for stream_output in stream_outputs:
+        collector.add(stream_output)
+    return collector
+
+
+async def read_stream_outputs_async(stream_outputs, sink=None):
+    collector = stream_collector(sink)
+    async for stream_output in stream_outputs:
+        collector.add(stream_output)
+    return collector
@@ -0,0 +1,143 @@
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from dlg_metrics import get_metrics
+
+'''
+Process wide cache of client_credentials access tokens.
+Tokens are keyed by (auth_url, client_id, scope) and shared by every session_start
+and the sample client, so a suite of hundreds of test cases only asks the auth server
+for a token once per expiry window. Each cached token is refreshed on a background timer
+shortly before it expires.
+'''
+
+# refresh when this fraction of the token lifetime is left (bounded by the min/max margins below)
+REFRESH_RATIO = 0.1
+REFRESH_MIN_MARGIN = 5
+REFRESH_MAX_MARGIN = 300
+# used when the auth server does not return expires_in
+DEFAULT_EXPIRES_IN = 900
+# wait before retrying a failed background refresh
+REFRESH_RETRY = 10
+
+
+def _build_http_session():
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    return http
+
+
+class token_cache:
+    def __init__(self, http=None):
+        self.http = http or _build_http_session()
+        self.tokens = {}
+        self.secrets = {}
+        self.timers = {}
+        self.key_locks = {}
+        self.lock = threading.Lock()
+        self.refresh_count = 0
+        self.closed = False
+
+    def _key_lock(self, key):
+        with self.lock:
+            if key not in self.key_locks:
+                self.key_locks[key] = threading.Lock()
+            return self.key_locks[key]
+
+    def get(self, auth_url, client_id, secret, scope):
+        key = (auth_url, client_id, scope)
+        entry = self.tokens.get(key)
+        if entry and entry["expires_at"] > time.monotonic():
+            return entry["access_token"]
+        with self._key_lock(key):
+            # another thread may have fetched it while we were waiting
+            entry = self.tokens.get(key)
+            if entry and entry["expires_at"] > time.monotonic():
+                return entry["access_token"]
+            self.secrets[key] = secret
+            return self._fetch(key)["access_token"]
+
+    def _fetch(self, key):
+        auth_url, client_id, scope = key
+        payload = {"grant_type": "client_credentials", "scope": scope}
+        response = self.http.post(auth_url, auth=(client_id, self.secrets[key]), data=payload)
+        response_json = response.json()
+        access_token = response_json["access_token"]
+        expires_in = float(response_json.get("expires_in") or DEFAULT_EXPIRES_IN)
+        now = time.monotonic()
+        margin = min(max(expires_in * REFRESH_RATIO, REFRESH_MIN_MARGIN), REFRESH_MAX_MARGIN)
+        entry = {"access_token": access_token,
+                 "expires_at": now + expires_in,
+                 "refresh_at": now + max(expires_in - margin, 0)}
+        self.tokens[key] = entry
+        self.refresh_count += 1
+        get_metrics().token_refreshed()
+        self._schedule_refresh(key, entry["refresh_at"] - now)
+        return entry
+
+    def _schedule_refresh(self, key, delay):
+        with self.lock:
+            if self.closed:
+                return
+            timer = self.timers.get(key)
+            if timer:
+                timer.cancel()
+            timer = threading.Timer(delay, self._refresh, args=(key,))
+            timer.daemon = True
+            self.timers[key] = timer
+            timer.start()
+
+    def _refresh(self, key):
+        with self._key_lock(key):
+            try:
+                self._fetch(key)
+            except Exception:
+                # keep serving the current token until it expires, then get() fetches inline
+                entry = self.tokens.get(key)
+                if entry and entry["expires_at"] - time.monotonic() > REFRESH_RETRY:
+                    self._schedule_refresh(key, REFRESH_RETRY)
+
+    def invalidate(self, auth_url, client_id, scope):
+        key = (auth_url, client_id, scope)
+        with self.lock:
+            self.tokens.pop(key, None)
+            timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            timers = list(self.timers.values())
+            self.timers.clear()
+        for timer in timers:
+            timer.cancel()
+        self.http.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None or _default_cache.closed:
+            _default_cache = token_cache()
+        return _default_cache
+
+
+def get_token(project_data):
+    return get_token_cache().get(project_data["auth_url"], project_data["client_id"],
+                                 project_data["secret"], project_data["scope"])
+
+
+def close_token_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is not None:
+            _default_cache.close()
+            _default_cache = None
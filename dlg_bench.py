@@ -0,0 +1,261 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+from google.protobuf.json_format import MessageToDict, ParseDict
+from dlg import *
+from dlg_cases import test_case_repository
+from dlg_channels import close_channel_pool
+from dlg_logger import structured_logger, get_logger, close_logger
+from dlg_matcher import compile_expectation, compile_steps, matches
+from dlg_metrics import metrics_registry
+from dlg_mock_server import mock_dialog_service, serve
+from dlg_teardown import close_teardown_manager
+from dlg_runner import build_steps, run_parallel
+
+'''
+Benchmarks of the client side cost of a dialog turn.
+Every hot path of dlg.py is timed on its own with realistic, large responses: building the Selector and
+ExecuteRequest protobufs, MessageToDict, reading prompts, assert_dlg in both match modes, compiling and
+matching expectations (dlg_matcher) and write_to_log. Suites of generated YAML cases (1k and 10k by default) measure parsing, the test case cache
+and step compilation, and a suite is run end to end against dlg_mock_server in process, so the numbers
+do not depend on the network or on a Mix project.
+
+Results are written as JSON (median/min/max per operation plus the commit and Python version) and can be
+compared with a previous run; --baseline exits with status 1 when an operation got slower than --threshold.
+
+    python dlg_bench.py --output bench.json
+    python dlg_bench.py --baseline bench.json --threshold 0.2
+'''
+
+PROMPT = "Hello and welcome to the coffee app, what can I get for you today? {}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="dlg_bench.py",
+        usage="%(prog)s [-options]",
+        add_help=False,
+        formatter_class=lambda prog: argparse.HelpFormatter(
+            prog, max_help_position=45, width=100)
+    )
+
+    options = parser.add_argument_group("options")
+    options.add_argument("-h", "--help", action="help",
+                         help="Show this help message and exit")
+    options.add_argument("--cases", default="1000,10000", help="comma separated sizes of the generated YAML suites")
+    options.add_argument("--e2e-cases", type=int, default=1000,
+                         help="test cases run end to end against the mock server, 0 to skip")
+    options.add_argument("--workers", type=int, default=16, help="concurrent sessions of the end to end run")
+    options.add_argument("--prompts", type=int, default=50, help="prompts per message of the large responses")
+    options.add_argument("--repeat", type=int, default=5, help="timed repetitions of every benchmark")
+    options.add_argument("--output", help="write the results as JSON to this file")
+    options.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    options.add_argument("--threshold", type=float, default=0.2,
+                         help="relative slowdown of the median that counts as a regression")
+    return parser.parse_args()
+
+
+def large_response(prompts, text="What size coffee would you like?"):
+    'an ExecuteResponse in the camelCase form of the logs, with verbose nlg/visual/audio prompts and action data'
+    message = {"nlg": [{"text": PROMPT.format(i)} for i in range(prompts)],
+               "visual": [{"text": PROMPT.format(i)} for i in range(prompts)] + [{"text": text}],
+               "audio": [{"text": PROMPT.format(i)} for i in range(prompts)]}
+    data = {f"field{i}": {"value": PROMPT.format(i), "items": list(range(10))} for i in range(prompts)}
+    return {"payload": {"messages": [message],
+                        "qaAction": {"message": message, "data": data}}}
+
+
+def bench_script(prompts):
+    return {"initial": large_response(prompts, "Hello and welcome to the coffee app?"),
+            "responses": {"order coffee": large_response(prompts, "What size coffee would you like?"),
+                          "large": large_response(prompts, "Perfect, a large coffee coming right up?")}}
+
+
+def bench_test_case(index):
+    return {"name": f"order large coffee {index}",
+            "description": "generated benchmark case",
+            "steps": [{"Hello and welcome to the coffee app?": "order coffee"},
+                      {"What size coffee would you like?": "large"},
+                      "Perfect, a large coffee coming right up?"]}
+
+
+def write_suite(folder, size, per_file=100):
+    os.makedirs(folder, exist_ok=True)
+    for start in range(0, size, per_file):
+        test_cases = [bench_test_case(index) for index in range(start, min(start + per_file, size))]
+        with open(os.path.join(folder, f"bench_{start:06d}.yml"), "w") as f:
+            yaml.safe_dump({"test_cases": test_cases}, f, sort_keys=False)
+
+
+def measure(name, func, number, repeat, ops=1):
+    'runs func number times per repetition, the result is in microseconds per operation'
+    func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) * 1e6 / (number * ops))
+    samples.sort()
+    result = {"name": name, "unit": "us/op", "median": samples[len(samples) // 2], "min": samples[0],
+              "max": samples[-1], "number": number * ops, "repeat": repeat}
+    print(f'{name:<36}{result["median"]:>14.2f} us/op  (min {result["min"]:.2f})')
+    return result
+
+
+def bench_hot_paths(args, workdir):
+    session = session_start(None)
+    session.get_setup_data()
+    session.session_id = "bench"
+    message = ParseDict(large_response(args.prompts), ExecuteResponse(), ignore_unknown_fields=True)
+    response = dialog_response(message)
+    expected = "What size coffee would you like?"
+    results = [
+        measure("build_execute_request", lambda: session.build_execute_request("order coffee"), 2000, args.repeat),
+        measure("message_to_dict_large", lambda: MessageToDict(message), 20, args.repeat),
+        measure("dialog_response_prompts", lambda: dialog_response(message).prompt_texts(), 200, args.repeat),
+        measure("assert_dlg_fields", lambda: assert_dlg(expected, dialog_response(message), "fields"),
+                200, args.repeat),
+        measure("assert_dlg_compat", lambda: assert_dlg(expected, dialog_response(message), "compat"),
+                20, args.repeat),
+        measure("assert_dlg_dict", lambda: assert_dlg({"visual": expected, "action": "qaAction"}, response),
+                200, args.repeat),
+        measure("compile_expectation", lambda: compile_expectation.__wrapped__(PROMPT.format("{*}")),
+                2000, args.repeat),
+        measure("matches_fields", lambda: matches(expected, response), 200, args.repeat),
+    ]
+    registry = metrics_registry()
+    results.append(measure("metrics_observe", lambda: registry.observe("Execute", 42.0, StatusCode.OK),
+                           20000, args.repeat))
+
+    number = 2000
+    for level in ("payload", "meta"):
+        logger = structured_logger(os.path.join(workdir, f"logs_{level}"), level=level)
+        request = {"selector_dict": session.selector_dict, "payload_dict": session.payload_dict}
+        results.append(measure(f"write_to_log_{level}",
+                               lambda: logger.log("bench", "execute_request", request, response, 1,
+                                                  {"step": 1, "rpc": "Execute", "ms": 1.0, "wait_ms": 0}),
+                               number, args.repeat))
+        # the writer thread has to keep up, time until everything is on disk
+        started = time.perf_counter()
+        logger.close()
+        print(f'{"  drained in":<36}{time.perf_counter() - started:>14.3f} s')
+    return results
+
+
+def bench_suites(args, workdir):
+    results = []
+    for size in [int(size) for size in args.cases.split(",") if size.strip()]:
+        folder = os.path.join(workdir, f"cases_{size}")
+        write_suite(folder, size)
+        cache_folder = os.path.join(workdir, f"cache_{size}")
+        results.append(measure(f"yaml_parse_cold_{size}",
+                               lambda: test_case_repository(folder, cache_folder=None).test_cases(),
+                               1, args.repeat, size))
+        test_case_repository(folder, cache_folder).test_cases()
+        results.append(measure(f"yaml_load_cached_{size}",
+                               lambda: test_case_repository(folder, cache_folder).test_cases(),
+                               1, args.repeat, size))
+        test_cases = test_case_repository(folder, cache_folder).test_cases()
+
+        def compile_suite():
+            compile_expectation.cache_clear()
+            for test_case in test_cases:
+                build_steps(test_case["steps"])
+                compile_steps(test_case["steps"])
+
+        results.append(measure(f"build_compile_steps_{size}", compile_suite, 1, args.repeat, size))
+    return results
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def bench_end_to_end(args, workdir):
+    'runs a generated suite against the mock server, the time per turn is then the client plus loopback'
+    port = free_port()
+    server, servicer = serve(port, mock_dialog_service(bench_script(args.prompts)), max(args.workers, 4))
+    config = os.path.join(workdir, "config.json")
+    with open(config, "w") as f:
+        json.dump({"serverUrl": f"localhost:{port}", "insecure": True, "modelUrn": "urn:bench",
+                   "rate_limit": "0"}, f)
+    test_cases = [bench_test_case(index) for index in range(args.e2e_cases)]
+    get_logger(os.path.join(workdir, "logs_e2e"))
+    try:
+        started = time.perf_counter()
+        case_results = run_parallel(config, test_cases, args.workers)
+        elapsed = time.perf_counter() - started
+    finally:
+        close_teardown_manager()
+        close_logger()
+        close_channel_pool()
+        server.stop(0)
+    errors = [str(result["error"]) for result in case_results if result["error"] is not None]
+    rpcs = timing_summary([timing for result in case_results for timing in result["timings"]])
+    turns = rpcs.get("Execute", {}).get("count", 0)
+    result = {"name": f"end_to_end_{args.e2e_cases}", "unit": "us/op",
+              "median": elapsed * 1e6 / max(turns, 1), "min": None, "max": None,
+              "number": turns, "repeat": 1, "cases_per_s": len(test_cases) / elapsed,
+              "errors": len(errors), "rpcs": rpcs}
+    print(f'{result["name"]:<36}{result["median"]:>14.2f} us/turn  '
+          f'({result["cases_per_s"]:.1f} cases/s, {len(errors)} errors)')
+    if errors:
+        print(f'  first error: {errors[0]}')
+    return [result]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = {result["name"]: result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["name"])
+        if not previous or not previous.get("median"):
+            continue
+        change = result["median"] / previous["median"] - 1
+        flag = "REGRESSION" if change > threshold else ""
+        print(f'{result["name"]:<36}{previous["median"]:>12.2f} -> {result["median"]:<12.2f}{change:>+8.1%}  {flag}')
+        if flag:
+            regressions.append(result["name"])
+    return regressions
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory(prefix="dlg_bench_") as workdir:
+        results = bench_hot_paths(args, workdir)
+        results += bench_suites(args, workdir)
+        if args.e2e_cases:
+            results += bench_end_to_end(args, workdir)
+    report = {"commit": git_commit(), "python": sys.version.split()[0], "platform": platform.platform(),
+              "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "prompts": args.prompts, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import threading
+import jsonschema
+import yaml
+
+'''
+Test case repository.
+Every YAML file in the test case folder is read and parsed once per run (with the libyaml
+CSafeLoader when PyYAML was built with it) and validated against a precompiled JSON schema.
+Parsed and validated files are cached on disk as JSON in .dlg_cache/, one file per test case folder,
+keyed by path, mtime, size and content hash, so unchanged files are not parsed again on the next run.
+Collection, the setup check and the load mode all read from the same repository.
+'''
+
+CACHE_FOLDER = ".dlg_cache"
+CACHE_FILE = "test_cases-{}.json"
+# bump when the cached structure or the loader changes
+CACHE_VERSION = 1
+
+# Test Case format JSON schema
+TEST_CASES_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "test_cases": {
+            "type": "array",
+            "minItems": 1,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "name": {"type": "string"},
+                    "description": {"type": "string"},
+                    "steps": {"type": "array", "minItems": 1}
+                },
+                "required": ["name", "description", "steps"]
+            }
+        }
+    },
+    "required": ["test_cases"]
+}
+TEST_CASES_VALIDATOR = jsonschema.Draft7Validator(TEST_CASES_SCHEMA)
+
+_base_loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class test_case_loader(_base_loader):
+    pass
+
+
+'''
+Fucntion is required to process safe_load() without converting certain string values like "true", "false", "yes", "no", etc. to boolean type
+This custom constructor function removes the conversion of "true", "false", "yes", "no" to boolean and returns the actual string
+'''
+def boolean_as_string_constructor(loader, node):
+    value = loader.construct_scalar(node)
+    return value
+
+
+test_case_loader.add_constructor('tag:yaml.org,2002:bool', boolean_as_string_constructor)
+
+
+def is_test_case_file(file_name):
+    return file_name.lower().endswith(".yaml") or file_name.lower().endswith(".yml")
+
+
+def parse_test_case_file(content):
+    '''
+    Returns (data, error) for the YAML content of one test case file, error is None when it is valid.
+    '''
+    try:
+        data = yaml.load(content, Loader=test_case_loader)
+    except yaml.YAMLError as e:
+        return None, str(e)
+    error = next(TEST_CASES_VALIDATOR.iter_errors(data), None)
+    if error is not None:
+        return data, error.message
+    return data, None
+
+
+def cache_file_name(folder):
+    'each test case folder has its own cache file, so runs on another folder do not replace its entries'
+    return CACHE_FILE.format(hashlib.sha256(os.path.abspath(folder).encode()).hexdigest()[:16])
+
+
+class test_case_repository:
+    def __init__(self, folder, cache_folder=CACHE_FOLDER):
+        self.folder = folder
+        self.cache_path = os.path.join(cache_folder, cache_file_name(folder)) if cache_folder else None
+        self.files = None
+        self.lock = threading.Lock()
+
+    def _read_cache(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(cache, dict) or cache.get("version") != CACHE_VERSION:
+            return {}
+        return cache.get("files") or {}
+
+    def _write_cache(self, files):
+        cached = {}
+        for path, entry in files.items():
+            # YAML can give values JSON does not keep as they are (dates, non string keys), those files are parsed again
+            try:
+                encoded = json.dumps(entry)
+            except (TypeError, ValueError):
+                continue
+            if json.loads(encoded) == entry:
+                cached[path] = entry
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            temp_path = self.cache_path + f".{os.getpid()}"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": CACHE_VERSION, "folder": os.path.abspath(self.folder), "files": cached}, f)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            pass
+
+    def load(self):
+        '''
+        Returns one entry per test case file: {"path", "mtime_ns", "size", "sha256", "data", "error"}.
+        '''
+        with self.lock:
+            if self.files is not None:
+                return self.files
+            cached = self._read_cache()
+            files = {}
+            changed = False
+            for file_name in sorted(os.listdir(self.folder)):
+                if not is_test_case_file(file_name):
+                    continue
+                path = os.path.join(self.folder, file_name)
+                stat = os.stat(path)
+                entry = cached.get(path)
+                if entry and entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                    files[path] = entry
+                    continue
+                with open(path, "rb") as f:
+                    content = f.read()
+                sha256 = hashlib.sha256(content).hexdigest()
+                if entry and entry["sha256"] == sha256:
+                    entry = dict(entry, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                else:
+                    data, error = parse_test_case_file(content)
+                    entry = {"path": path, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size,
+                             "sha256": sha256, "data": data, "error": error}
+                files[path] = entry
+                changed = True
+            if self.cache_path and (changed or len(files) != len(cached)):
+                self._write_cache(files)
+            self.files = list(files.values())
+            return self.files
+
+    def test_cases(self):
+        test_cases = []
+        for entry in self.load():
+            if isinstance(entry["data"], dict) and isinstance(entry["data"].get("test_cases"), list):
+                test_cases.extend(entry["data"]["test_cases"])
+        return test_cases
+
+    def errors(self):
+        return [(entry["path"], entry["error"]) for entry in self.load() if entry["error"] is not None]
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def get_test_case_repository(folder):
+    folder = os.path.abspath(folder)
+    with _repositories_lock:
+        if folder not in _repositories:
+            _repositories[folder] = test_case_repository(folder)
+        return _repositories[folder]
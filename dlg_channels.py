@@ -0,0 +1,126 @@
+import asyncio
+import itertools
+import threading
+import grpc
+from grpc import aio
+from dlg_auth import get_token as get_cached_token
+
+'''
+Pool of long lived gRPC channels shared by every session_start.
+Channels are keyed by serverUrl and credentials, and calls are spread round robin over
+channel_pool_size channels so many sessions multiplex over a few HTTP/2 connections instead
+of paying a TLS handshake per test. The access token is attached per call from the token cache,
+so a pooled channel keeps working after the token is refreshed. With "insecure": true (local stand-in
+server) channels are plain text and carry no token.
+'''
+
+
+class token_auth_plugin(grpc.AuthMetadataPlugin):
+    def __init__(self, project_data):
+        self.project_data = dict(project_data)
+
+    def __call__(self, context, callback):
+        try:
+            token = get_cached_token(self.project_data)
+        except Exception as e:
+            callback((), e)
+            return
+        callback((("authorization", "Bearer " + token),), None)
+
+
+def channel_options(project_data):
+    return [
+        ("grpc.keepalive_time_ms", int(project_data.get("keepalive_time_ms"))),
+        ("grpc.keepalive_timeout_ms", int(project_data.get("keepalive_timeout_ms"))),
+        ("grpc.keepalive_permit_without_calls", 1),
+        ("grpc.http2.max_pings_without_data", 0),
+        # keep each pooled channel on its own connection instead of the process wide subchannel pool
+        ("grpc.use_local_subchannel_pool", 1),
+    ]
+
+
+def create_channel(project_data):
+    if project_data.get("insecure"):
+        return grpc.insecure_channel(project_data["serverUrl"], options=channel_options(project_data))
+    call_credentials = grpc.metadata_call_credentials(token_auth_plugin(project_data))
+    channel_credentials = grpc.ssl_channel_credentials()
+    channel_credentials = grpc.composite_channel_credentials(channel_credentials, call_credentials)
+    return grpc.secure_channel(project_data["serverUrl"], credentials=channel_credentials,
+                               options=channel_options(project_data))
+
+
+def create_aio_channel(project_data):
+    if project_data.get("insecure"):
+        return aio.insecure_channel(project_data["serverUrl"], options=channel_options(project_data))
+    call_credentials = grpc.metadata_call_credentials(token_auth_plugin(project_data))
+    channel_credentials = grpc.ssl_channel_credentials()
+    channel_credentials = grpc.composite_channel_credentials(channel_credentials, call_credentials)
+    return aio.secure_channel(project_data["serverUrl"], credentials=channel_credentials,
+                              options=channel_options(project_data))
+
+
+class channel_pool:
+    def __init__(self, factory=create_channel):
+        self.factory = factory
+        self.channels = {}
+        self.cycles = {}
+        self.lock = threading.Lock()
+
+    def get_channel(self, project_data):
+        key = (project_data["serverUrl"], project_data["auth_url"], project_data["client_id"], project_data["scope"])
+        with self.lock:
+            if key not in self.channels:
+                size = max(int(project_data.get("channel_pool_size")), 1)
+                self.channels[key] = [self.factory(project_data) for _ in range(size)]
+                self.cycles[key] = itertools.cycle(self.channels[key])
+            return next(self.cycles[key])
+
+    def close(self):
+        with self.lock:
+            channels = [channel for pooled in self.channels.values() for channel in pooled]
+            self.channels.clear()
+            self.cycles.clear()
+        for channel in channels:
+            channel.close()
+
+    async def close_async(self):
+        with self.lock:
+            channels = [channel for pooled in self.channels.values() for channel in pooled]
+            self.channels.clear()
+            self.cycles.clear()
+        for channel in channels:
+            await channel.close()
+
+
+_default_pool = channel_pool()
+
+
+def get_channel(project_data):
+    return _default_pool.get_channel(project_data)
+
+
+def close_channel_pool():
+    _default_pool.close()
+
+
+'''
+grpc.aio channels are bound to the event loop that created them, so each loop gets its own pool.
+Pools of loops that have been closed without close_aio_channel_pool are dropped when a new loop asks
+for a channel, their channels cannot be used or awaited any more.
+'''
+_aio_pools = {}
+
+
+def get_aio_channel(project_data):
+    loop = asyncio.get_running_loop()
+    if loop not in _aio_pools:
+        for closed in [other for other in _aio_pools if other.is_closed()]:
+            del _aio_pools[closed]
+        _aio_pools[loop] = channel_pool(create_aio_channel)
+    return _aio_pools[loop].get_channel(project_data)
+
+
+async def close_aio_channel_pool():
+    pool = _aio_pools.pop(asyncio.get_running_loop(), None)
+    if pool:
+        await pool.close_async()
@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import json
+import time
+from dlg_aio import *
+from dlg_channels import close_aio_channel_pool
+from dlg_logger import close_logger
+from dlg_metrics import close_metrics, start_metrics
+from dlg_recorder import close_recording_stores
+from dlg_audio import close_audio_sources
+from dlg_cases import get_test_case_repository
+
+'''
+Load generation mode.
+Replays the YAML flows from tests/test_cases/ as virtual users, either at a target number of
+new sessions per second (--rate) or with a fixed number of concurrent users (--concurrency),
+with ramp-up, a fixed duration and think-time between turns. Steps are run with the same
+semantics as run_test.py. At the end it reports per-RPC throughput, errors by gRPC status
+and p50/p95/p99 latency.
+
+    python dlg_load.py --config tests/config.json --concurrency 50 --ramp-up 30 --duration 300 --think-time 1
+'''
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="dlg_load.py",
+        usage="%(prog)s [-options]",
+        add_help=False,
+        formatter_class=lambda prog: argparse.HelpFormatter(
+            prog, max_help_position=45, width=100)
+    )
+
+    options = parser.add_argument_group("options")
+    options.add_argument("-h", "--help", action="help",
+                         help="Show this help message and exit")
+    options.add_argument("--config", nargs="?", default="tests/config.json", help="configure your mix project")
+    options.add_argument("--test-cases", default="tests/test_cases", help="folder with the YAML flows to replay")
+    options.add_argument("--rate", type=float, default=0, help="new sessions per second (open model)")
+    options.add_argument("--concurrency", type=int, default=1, help="concurrent virtual users (closed model)")
+    options.add_argument("--ramp-up", type=float, default=0, help="seconds to reach the target rate or concurrency")
+    options.add_argument("--duration", type=float, default=60, help="seconds to generate load for")
+    options.add_argument("--think-time", type=float, default=0, help="seconds a virtual user waits between turns")
+    options.add_argument("--output", help="write the summary as JSON to this file")
+    return parser.parse_args()
+
+
+def load_flows(test_folder):
+    return get_test_case_repository(test_folder).test_cases()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class load_stats:
+    def __init__(self):
+        self.latencies = {}
+        self.status_counts = {}
+        self.flows_passed = 0
+        self.flows_failed = 0
+        self.flow_errors = {}
+        self.started = time.monotonic()
+        self.finished = None
+
+    def record_rpc(self, rpc, code, elapsed):
+        self.latencies.setdefault(rpc, []).append(elapsed)
+        codes = self.status_counts.setdefault(rpc, {})
+        codes[code.name] = codes.get(code.name, 0) + 1
+
+    def record_flow(self, error=None):
+        if error is None:
+            self.flows_passed += 1
+        else:
+            self.flows_failed += 1
+            name = type(error).__name__
+            self.flow_errors[name] = self.flow_errors.get(name, 0) + 1
+
+    def summary(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        rpcs = {}
+        for rpc, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            codes = self.status_counts[rpc]
+            errors = sum(count for code, count in codes.items() if code != "OK")
+            rpcs[rpc] = {"count": len(latencies),
+                         "throughput": len(latencies) / elapsed if elapsed else 0,
+                         "error_rate": errors / len(latencies),
+                         "status": codes,
+                         "p50_ms": percentile(latencies, 50) * 1000,
+                         "p95_ms": percentile(latencies, 95) * 1000,
+                         "p99_ms": percentile(latencies, 99) * 1000}
+        return {"duration_s": elapsed,
+                "flows_passed": self.flows_passed,
+                "flows_failed": self.flows_failed,
+                "flow_errors": self.flow_errors,
+                "rpcs": rpcs}
+
+
+class load_session(async_session_start):
+    '''
+    Session of a virtual user. Every attempt of an RPC is recorded with its own status and time, so the
+    percentiles measure the service and not the rate limiter or the retry backoff. The legacy sleep pacing
+    is ignored, only an explicit rate_limit in the config throttles a load run.
+    '''
+    def __init__(self, config, stats):
+        super().__init__(config, {"sleep": "0"})
+        self.stats = stats
+
+    def record_attempt(self, rpc, code, elapsed):
+        self.stats.record_rpc(rpc, code, elapsed)
+
+
+async def run_flow(config, flow, stats, think_time):
+    try:
+        async with load_session(config, stats) as session:
+            if not session.session_started:
+                raise RuntimeError(f"Failed to start Mix session: {session.response}")
+            await run_test_case_async(session, flow, think_time)
+    except Exception as e:
+        stats.record_flow(e)
+        return
+    stats.record_flow()
+
+
+async def run_closed_model(args, flows, stats, deadline):
+    async def virtual_user(index):
+        if args.ramp_up and args.concurrency > 1:
+            await asyncio.sleep(args.ramp_up * index / args.concurrency)
+        iteration = index
+        while time.monotonic() < deadline:
+            await run_flow(args.config, flows[iteration % len(flows)], stats, args.think_time)
+            iteration += args.concurrency
+
+    await asyncio.gather(*(virtual_user(index) for index in range(args.concurrency)))
+
+
+async def run_open_model(args, flows, stats, deadline):
+    tasks = set()
+    started = time.monotonic()
+    iteration = 0
+    next_launch = started
+    while next_launch < deadline:
+        await asyncio.sleep(max(next_launch - time.monotonic(), 0))
+        task = asyncio.ensure_future(run_flow(args.config, flows[iteration % len(flows)], stats, args.think_time))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        iteration += 1
+        elapsed = time.monotonic() - started
+        rate = args.rate
+        if args.ramp_up and elapsed < args.ramp_up:
+            rate = max(args.rate * elapsed / args.ramp_up, args.rate / 100)
+        next_launch += 1 / rate
+    if tasks:
+        await asyncio.gather(*tasks)
+
+
+async def run_load(args):
+    flows = load_flows(args.test_cases)
+    if not flows:
+        raise SystemExit(f"No test cases found in {args.test_cases}")
+    stats = load_stats()
+    deadline = time.monotonic() + args.duration
+    try:
+        if args.rate > 0:
+            await run_open_model(args, flows, stats, deadline)
+        else:
+            await run_closed_model(args, flows, stats, deadline)
+    finally:
+        stats.finished = time.monotonic()
+        await drain_stops_async()
+        await close_aio_channel_pool()
+    return stats.summary()
+
+
+def print_summary(summary):
+    print(f'duration: {summary["duration_s"]:.1f}s  flows passed: {summary["flows_passed"]}  '
+          f'flows failed: {summary["flows_failed"]} {summary["flow_errors"] or ""}')
+    print(f'{"rpc":<10}{"count":>8}{"rps":>9}{"errors":>9}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}  status')
+    for rpc, row in summary["rpcs"].items():
+        print(f'{rpc:<10}{row["count"]:>8}{row["throughput"]:>9.2f}{row["error_rate"]:>9.2%}'
+              f'{row["p50_ms"]:>10.1f}{row["p95_ms"]:>10.1f}{row["p99_ms"]:>10.1f}  {row["status"]}')
+
+
+def metrics_config(config):
+    '''
+    The metrics settings of the config file. They are read directly rather than through a session_start,
+    whose get_setup_data would create the shared rate limiter with the config of a test run before the
+    first load_session.
+    '''
+    try:
+        with open(config) as f:
+            config_json = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {key: config_json.get(key) for key in ("metrics_port", "metrics_file", "metrics_interval_s")}
+
+
+def main():
+    args = parse_args()
+    dlg_payload_log()
+    start_metrics(metrics_config(args.config))
+    try:
+        summary = asyncio.run(run_load(args))
+    finally:
+        close_recording_stores()
+        close_audio_sources()
+        close_metrics()
+        close_logger()
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+'''
+Background structured logger for the dialog request/response logs.
+Callers only put a record on a bounded queue; a single writer thread serializes records as
+compact JSON Lines (session_id, rpc, step, timing, request, response), writes them in batches,
+rotates the file once it grows past log_max_bytes and optionally compresses rotated files
+with gzip or zstd. log_level controls what is captured:
+- payload: everything (default)
+- meta: session_id, rpc, step and timing only, no request/response payloads, for load runs
+- off: nothing is logged
+'''
+
+LOG_LEVELS = ("payload", "meta", "off")
+LOG_FILE_NAME = "dlg.jsonl"
+QUEUE_SIZE = 10000
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 0.5
+_STOP = object()
+
+
+class structured_logger:
+    def __init__(self, logs_folder="logs", level="payload", max_bytes=100 * 1024 * 1024, compression=None):
+        if level not in LOG_LEVELS:
+            raise ValueError(f"log_level must be one of {LOG_LEVELS}, got {level}")
+        if compression not in (None, "gzip", "zstd"):
+            raise ValueError(f"log_compression must be gzip or zstd, got {compression}")
+        self.logs_folder = logs_folder
+        self.level = level
+        self.max_bytes = int(max_bytes)
+        self.compression = compression
+        self.path = os.path.join(logs_folder, LOG_FILE_NAME)
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.file = None
+        self.thread = None
+        if level != "off":
+            self.thread = threading.Thread(target=self._run, name="dlg-logger", daemon=True)
+            self.thread.start()
+
+    def log(self, session_id, rpc, request, response, step=None, timing=None):
+        if self.level == "off":
+            return
+        record = {"ts": time.time(), "session_id": session_id, "rpc": rpc, "step": step, "timing": timing}
+        if self.level == "payload":
+            record["request"] = request
+            record["response"] = response
+        self.queue.put(record)
+
+    def _run(self):
+        os.makedirs(self.logs_folder, exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        running = True
+        while running:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=FLUSH_INTERVAL))
+                while len(batch) < BATCH_SIZE:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if _STOP in batch:
+                batch.remove(_STOP)
+                running = False
+            if batch:
+                self._write(batch)
+        self.file.close()
+
+    def _write(self, batch):
+        lines = []
+        for record in batch:
+            lines.append(json.dumps(record, separators=(",", ":"), default=serialize))
+        self.file.write("\n".join(lines) + "\n")
+        self.file.flush()
+        if self.max_bytes and self.file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self.file.close()
+        rotated = os.path.join(self.logs_folder, f"dlg-{time.strftime('%Y%m%d-%H%M%S')}-{time.monotonic_ns()}.jsonl")
+        os.replace(self.path, rotated)
+        if self.compression:
+            compress_file(rotated, self.compression)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        if self.thread:
+            self.queue.put(_STOP)
+            self.thread.join()
+            self.thread = None
+
+
+def serialize(value):
+    # dialog_response payloads are only converted to dicts here, on the writer thread
+    if hasattr(value, "as_dict"):
+        return value.as_dict()
+    return str(value)
+
+
+def compress_file(path, compression):
+    if compression == "gzip":
+        with open(path, "rb") as source, gzip.open(path + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+    else:
+        # zstandard is optional, only needed when log_compression is zstd
+        import zstandard
+        with open(path, "rb") as source, open(path + ".zst", "wb") as target:
+            zstandard.ZstdCompressor().copy_stream(source, target)
+    os.remove(path)
+
+
+_default_logger = None
+_default_logger_lock = threading.Lock()
+
+
+def get_logger(logs_folder="logs", project_data=None):
+    '''
+    Returns the process wide logger, the first caller's settings win.
+    '''
+    global _default_logger
+    with _default_logger_lock:
+        if _default_logger is None:
+            project_data = project_data or {}
+            _default_logger = structured_logger(logs_folder,
+                                                level=project_data.get("log_level") or "payload",
+                                                max_bytes=project_data.get("log_max_bytes") or 100 * 1024 * 1024,
+                                                compression=project_data.get("log_compression") or None)
+        return _default_logger
+
+
+def close_logger():
+    global _default_logger
+    with _default_logger_lock:
+        if _default_logger is not None:
+            _default_logger.close()
+            _default_logger = None
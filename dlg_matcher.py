@@ -0,0 +1,125 @@
+import re
+from functools import lru_cache
+from dlg_response import dict_prompts
+
+'''
+Expectation matcher used by assert_dlg.
+Each YAML expectation is normalized (lower case, non word characters removed, {*} turned into .*)
+and compiled once, then kept in an LRU cache so repeated steps across a suite reuse the same pattern.
+Two match modes are supported through the "match_mode" config value:
+- fields: the expectation is searched in the prompt texts of the response only (default), read from the same
+  fields whether the response is a protobuf message or a dict
+- compat: the expectation is searched in the whole stringified response, the original behaviour
+A step can also check specific fields of the response with a dict expectation, e.g.
+    {"visual": "What size {*}?", "action": "qaAction"}
+prompt/nlg/visual/audio are matched like a text expectation, action and intent must be equal.
+Responses of audio steps (ExecuteStream) can also be checked on the recognized text, matched like a text
+expectation, and on the TTS audio: tts true/false for its presence, tts_min_ms/tts_max_ms for its length.
+'''
+
+MATCH_MODES = ("fields", "compat")
+WILDCARD = re.compile(r'\{\*\}')
+NON_WORD = re.compile(r'[\W]')
+# dict expectation key -> prompt kind passed to dialog_response.prompts (None is every kind)
+PROMPT_FIELDS = {"prompt": None, "nlg": "nlg", "visual": "visual", "audio": "audio"}
+VALUE_FIELDS = ("action", "intent", "recognized", "tts", "tts_min_ms", "tts_max_ms")
+TRUE_VALUES = ("true", "yes", "on", "1")
+
+
+@lru_cache(maxsize=4096)
+def compile_expectation(expected_text):
+    parts = WILDCARD.split(str(expected_text))
+    return re.compile(".*".join(re.escape(NON_WORD.sub('', part.lower())) for part in parts))
+
+
+def normalize(text):
+    return NON_WORD.sub('', text.lower())
+
+
+def prompts(response, kind=None):
+    'prompt texts of a dialog_response or of a response in dict form, None for anything else'
+    if hasattr(response, "prompts"):
+        return response.prompts(kind)
+    if isinstance(response, dict):
+        return dict_prompts(response, kind)
+    return None
+
+
+def prompt_texts(response):
+    'prompt texts of a response in dict form, or the message of an error response'
+    if "errorMessage" in response:
+        return [str(response["errorMessage"])]
+    return dict_prompts(response)
+
+
+def normalized_response(response, match_mode="fields"):
+    if match_mode == "compat":
+        return normalize(str(response))
+    if hasattr(response, "prompt_texts"):
+        return normalize("".join(response.prompt_texts()))
+    if isinstance(response, dict):
+        return normalize("".join(prompt_texts(response)))
+    return normalize(str(response))
+
+
+def matches_fields(expected, response):
+    for field, value in expected.items():
+        if field in PROMPT_FIELDS:
+            texts = prompts(response, PROMPT_FIELDS[field])
+            if texts is None:
+                return False
+            texts = normalize("".join(texts))
+            if compile_expectation(str(value)).search(texts) is None:
+                return False
+        elif field == "action":
+            if getattr(response, "action_type", None) != str(value):
+                return False
+        elif field == "intent":
+            if getattr(response, "intent", None) != str(value):
+                return False
+        elif field == "recognized":
+            recognized = normalize(getattr(response, "recognized_text", None) or "")
+            if compile_expectation(str(value)).search(recognized) is None:
+                return False
+        elif field == "tts":
+            # YAML booleans are loaded as strings, see dlg_cases
+            if (getattr(response, "tts_bytes", 0) > 0) != (str(value).lower() in TRUE_VALUES):
+                return False
+        elif field == "tts_min_ms":
+            if getattr(response, "tts_ms", 0) < float(value):
+                return False
+        elif field == "tts_max_ms":
+            if getattr(response, "tts_ms", 0) > float(value):
+                return False
+        else:
+            raise ValueError(f"Unknown expectation field '{field}', "
+                             f"expected one of {list(PROMPT_FIELDS) + list(VALUE_FIELDS)}")
+    return True
+
+
+def matches(expected_text, response, match_mode="fields"):
+    if isinstance(expected_text, dict):
+        return matches_fields(expected_text, response)
+    return compile_expectation(str(expected_text)).search(normalized_response(response, match_mode)) is not None
+
+
+def compile_expectation_fields(expected):
+    if isinstance(expected, dict):
+        for field, value in expected.items():
+            if field in PROMPT_FIELDS or field == "recognized":
+                compile_expectation(str(value))
+    else:
+        compile_expectation(str(expected))
+
+
+def compile_steps(steps):
+    '''
+    Compiles every expectation of a YAML test case up front, called while collecting the test cases.
+    '''
+    for step in steps:
+        if isinstance(step, dict) and "expect" in step:
+            compile_expectation_fields(step["expect"])
+        elif isinstance(step, dict):
+            compile_expectation(str(next(iter(step))))
+        else:
+            compile_expectation(str(step))
@@ -0,0 +1,58 @@
+import itertools
+import json
+import re
+
+'''
+Matrix runs.
+A "matrix" entry in config.json runs the YAML suite once per cell, every cell overriding some of the
+config values (modelUrn, channel, language, model_version, ...). It is either a dict of lists, expanded
+to every combination:
+    "matrix": {"modelUrn": ["urn:nuance-mix:tag:model/A/mix.dialog", "urn:nuance-mix:tag:model/B/mix.dialog"],
+               "language": ["en-US", "fr-CA"]}
+or a list of cells, each with an optional name:
+    "matrix": [{"name": "v1 web", "modelUrn": "urn:...v1"}, {"name": "v2 ivr", "modelUrn": "urn:...v2", "channel": "IVR"}]
+The other config values, and the tokens and channels built from them, are shared by all cells.
+'''
+
+# never part of a cell name
+HIDDEN_KEYS = ("client_id", "secret")
+MODEL_URN_PREFIX = re.compile(r'^urn:nuance-mix:tag:model/')
+MODEL_URN_SUFFIX = re.compile(r'/mix\.dialog$')
+
+
+def short_value(key, value):
+    if key == "modelUrn":
+        return MODEL_URN_SUFFIX.sub('', MODEL_URN_PREFIX.sub('', str(value)))
+    return str(value)
+
+
+def cell_name(overrides):
+    return "/".join(short_value(key, value) for key, value in overrides.items() if key not in HIDDEN_KEYS)
+
+
+def matrix_cells(config):
+    '''
+    Returns the cells of the matrix in config.json as [{"name", "overrides"}], [] when there is no matrix.
+    '''
+    try:
+        with open(config) as f:
+            matrix = json.load(f).get("matrix")
+    except (OSError, ValueError, AttributeError):
+        return []
+    if not matrix:
+        return []
+    if isinstance(matrix, dict):
+        keys = list(matrix)
+        values = [value if isinstance(value, list) else [value] for value in matrix.values()]
+        overrides_list = [dict(zip(keys, combination)) for combination in itertools.product(*values)]
+    else:
+        overrides_list = [dict(cell) for cell in matrix]
+    cells = []
+    for overrides in overrides_list:
+        name = overrides.pop("name", None) or cell_name(overrides)
+        cells.append({"name": str(name), "overrides": overrides})
+    return cells
+
+
+def cell_overrides(cell):
+    return cell["overrides"] if cell else None
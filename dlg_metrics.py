@@ -0,0 +1,240 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+'''
+Live metrics of the dialog sessions of this process, for long test and load runs.
+session_start updates the registry on every call: requests by RPC and gRPC status, a latency histogram
+per RPC (token and connect included), the number of active sessions and the number of token fetches.
+Every thread writes to its own shard of the registry, so an update takes no lock; the shards are only
+summed when the metrics are read. The metrics can be read while the run is going:
+- metrics_port: OpenMetrics/Prometheus text on http://127.0.0.1:<port>/metrics
+- metrics_file: a JSON snapshot rewritten every metrics_interval_s seconds and at the end of the run
+The exporter is started by the entry points (pytest_configure, dlg_load.py) with start_metrics, never by a
+session. Worker i (from 1) of a distributed run serves on metrics_port + i - 1 and writes its own snapshot file.
+'''
+
+log = logging.getLogger(__name__)
+
+# latency buckets in seconds, the last one is +Inf
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class metrics_shard:
+    'the metrics written by one thread'
+    def __init__(self):
+        self.requests = {}
+        self.latency = {}
+        self.active_sessions = 0
+        self.token_refreshes = 0
+
+
+class metrics_registry:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def _shard(self):
+        shard = getattr(self.local, "shard", None)
+        if shard is None:
+            # once per thread
+            shard = self.local.shard = metrics_shard()
+            with self.lock:
+                self.shards.append(shard)
+        return shard
+
+    def observe(self, rpc, ms, code=None):
+        'one call of rpc that took ms, code is its gRPC status (None for token and connect)'
+        shard = self._shard()
+        histogram = shard.latency.get(rpc)
+        if histogram is None:
+            # bucket counts, then the sum of the latencies in seconds
+            histogram = shard.latency[rpc] = [0] * (len(self.buckets) + 2)
+        seconds = ms / 1000
+        histogram[bisect.bisect_left(self.buckets, seconds)] += 1
+        histogram[-1] += seconds
+        if code is not None:
+            key = (rpc, getattr(code, "name", str(code)))
+            shard.requests[key] = shard.requests.get(key, 0) + 1
+
+    def session_opened(self):
+        self._shard().active_sessions += 1
+
+    def session_closed(self):
+        # may be another thread than the one that opened it, only the sum of the shards is meaningful
+        self._shard().active_sessions -= 1
+
+    def token_refreshed(self):
+        self._shard().token_refreshes += 1
+
+    def snapshot(self):
+        '''
+        Returns the sum of the shards:
+            {"time", "active_sessions", "token_refreshes", "requests": {rpc: {status: count}},
+             "latency": {rpc: {"buckets": [cumulative count per bucket, +Inf last], "count", "sum_s"}}}
+        '''
+        with self.lock:
+            shards = list(self.shards)
+        requests = {}
+        latency = {}
+        active_sessions = 0
+        token_refreshes = 0
+        for shard in shards:
+            active_sessions += shard.active_sessions
+            token_refreshes += shard.token_refreshes
+            for (rpc, code), count in list(shard.requests.items()):
+                codes = requests.setdefault(rpc, {})
+                codes[code] = codes.get(code, 0) + count
+            for rpc, histogram in list(shard.latency.items()):
+                total = latency.setdefault(rpc, [0] * (len(self.buckets) + 2))
+                for index, value in enumerate(list(histogram)):
+                    total[index] += value
+        histograms = {}
+        for rpc, total in latency.items():
+            cumulative = []
+            count = 0
+            for value in total[:-1]:
+                count += value
+                cumulative.append(count)
+            histograms[rpc] = {"buckets": cumulative, "count": count, "sum_s": total[-1]}
+        return {"time": time.time(), "active_sessions": active_sessions, "token_refreshes": token_refreshes,
+                "requests": requests, "latency": histograms}
+
+    def openmetrics(self):
+        'the snapshot in the OpenMetrics text format'
+        snapshot = self.snapshot()
+        lines = ["# TYPE dlg_rpc_requests counter", "# HELP dlg_rpc_requests Dialog RPCs by gRPC status."]
+        for rpc, codes in sorted(snapshot["requests"].items()):
+            for code, count in sorted(codes.items()):
+                lines.append(f'dlg_rpc_requests_total{{rpc="{rpc}",code="{code}"}} {count}')
+        lines += ["# TYPE dlg_rpc_latency_seconds histogram",
+                  "# HELP dlg_rpc_latency_seconds Time of the token fetch, connect and dialog RPCs, retries included."]
+        for rpc, histogram in sorted(snapshot["latency"].items()):
+            for le, count in zip([str(bucket) for bucket in self.buckets] + ["+Inf"], histogram["buckets"]):
+                lines.append(f'dlg_rpc_latency_seconds_bucket{{rpc="{rpc}",le="{le}"}} {count}')
+            lines.append(f'dlg_rpc_latency_seconds_count{{rpc="{rpc}"}} {histogram["count"]}')
+            lines.append(f'dlg_rpc_latency_seconds_sum{{rpc="{rpc}"}} {histogram["sum_s"]:.6f}')
+        lines += ["# TYPE dlg_active_sessions gauge", "# HELP dlg_active_sessions Dialog sessions started and not stopped.",
+                  f'dlg_active_sessions {snapshot["active_sessions"]}',
+                  "# TYPE dlg_token_refreshes counter", "# HELP dlg_token_refreshes Access tokens fetched.",
+                  f'dlg_token_refreshes_total {snapshot["token_refreshes"]}',
+                  "# EOF"]
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, path):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}"
+        with open(temp_path, "w") as f:
+            json.dump(self.snapshot(), f, indent=1)
+        os.replace(temp_path, path)
+
+
+class metrics_exporter:
+    '''
+    Serves the registry on 127.0.0.1:port and/or rewrites a snapshot file every interval seconds,
+    both on daemon threads.
+    '''
+    def __init__(self, registry, port=None, path=None, interval=15):
+        self.registry = registry
+        self.path = path
+        self.interval = float(interval)
+        self.server = None
+        self.stopped = threading.Event()
+        if port is not None:
+            try:
+                self.server = ThreadingHTTPServer(("127.0.0.1", int(port)), self._handler())
+            except OSError as e:
+                log.warning(f'metrics endpoint not started on port {port}: {e}')
+        if self.server is not None:
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="dlg-metrics-http", daemon=True).start()
+        if path:
+            threading.Thread(target=self._write_snapshots, name="dlg-metrics-file", daemon=True).start()
+
+    def _handler(self):
+        registry = self.registry
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.openmetrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return handler
+
+    def _write_snapshots(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.registry.write_snapshot(self.path)
+            except OSError:
+                pass
+
+    def close(self):
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        if self.path:
+            self.registry.write_snapshot(self.path)
+
+
+# the registry of the process, always updated; the exporter only exists when metrics_port or metrics_file is set
+registry = metrics_registry()
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_metrics():
+    return registry
+
+
+def worker_file(path, worker):
+    'metrics.json of worker 2 is metrics-worker-2.json'
+    root, extension = os.path.splitext(path)
+    return f"{root}-worker-{worker + 1}{extension}"
+
+
+def start_metrics(project_data, worker=None):
+    '''
+    Starts the exporter when the config has metrics_port or metrics_file, once per process. worker is the
+    index from 0 of a shard worker, so the local workers of one config do not share a port or a file.
+    '''
+    global _exporter
+    port = project_data.get("metrics_port")
+    path = project_data.get("metrics_file")
+    if not port and not path:
+        return
+    if worker is not None:
+        port = int(port) + worker if port else None
+        path = worker_file(path, worker) if path else None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = metrics_exporter(registry, port or None, path,
+                                         project_data.get("metrics_interval_s") or 15)
+
+
+def close_metrics():
+    'stops the endpoint and writes the last snapshot, the registry itself keeps its values'
+    global _exporter
+    with _exporter_lock:
+        exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.close()
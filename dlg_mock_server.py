@@ -0,0 +1,196 @@
+import argparse
+import json
+import logging
+import random
+import time
+import uuid
+from concurrent import futures
+import grpc
+import yaml
+from google.protobuf.json_format import MessageToDict, ParseDict
+from nuance.dlg.v1.dlg_messages_pb2 import *
+from nuance.dlg.v1.dlg_interface_pb2 import *
+from nuance.dlg.v1.dlg_interface_pb2_grpc import *
+
+log = logging.getLogger(__name__)
+
+'''
+Local stand-in for the Mix DialogService.
+It implements Start, Execute, Update, Status, Stop and ExecuteStream from nuance.dlg.v1 and answers
+from a script instead of a dialog model, with optional latency and error injection. Point a project
+at it with "serverUrl": "localhost:<port>" and "insecure": true in config.json (no TLS, no token).
+
+The script is a JSON or YAML file with ExecuteResponse payloads in the same camelCase form as the logs:
+    initial: {...}                  # response to the first Execute, sent without user input
+    responses:
+      order coffee: {...}           # response when the user text matches (case insensitive)
+    default: {...}                  # any other input
+    recognized: order coffee        # optional text "recognized" from the audio of ExecuteStream
+    tts_bytes: 32000                # optional size of the TTS audio returned by ExecuteStream
+
+Alternatively --recorded logs/dlg.jsonl replays the Execute responses logged during a real run.
+
+    python dlg_mock_server.py --port 50051 --script mock_script.yml --latency-ms 20 --error-rate 0.01
+'''
+
+DEFAULT_RESPONSE = {"payload": {"qaAction": {"message": {"visual": [{"text": "mock response"}]}}}}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="dlg_mock_server.py",
+        usage="%(prog)s [-options]",
+        add_help=False,
+        formatter_class=lambda prog: argparse.HelpFormatter(
+            prog, max_help_position=45, width=100)
+    )
+
+    options = parser.add_argument_group("options")
+    options.add_argument("-h", "--help", action="help",
+                         help="Show this help message and exit")
+    options.add_argument("--port", type=int, default=50051, help="port to listen on")
+    options.add_argument("--script", help="JSON or YAML file with the scripted responses")
+    options.add_argument("--recorded", help="logs/dlg.jsonl file of a real run to replay the responses from")
+    options.add_argument("--latency-ms", type=float, default=0, help="mean latency added to every RPC")
+    options.add_argument("--jitter-ms", type=float, default=0, help="random +/- latency added to every RPC")
+    options.add_argument("--error-rate", type=float, default=0, help="fraction of RPCs that fail")
+    options.add_argument("--error-code", default="UNAVAILABLE", help="gRPC status code of injected errors")
+    options.add_argument("--workers", type=int, default=32, help="server worker threads")
+    return parser.parse_args()
+
+
+def load_script(path):
+    if not path:
+        return {}
+    with open(path) as f:
+        if path.lower().endswith((".yml", ".yaml")):
+            return yaml.safe_load(f) or {}
+        return json.load(f)
+
+
+def script_from_log(path):
+    'builds a script from the execute_request records written by dlg_logger with log_level payload'
+    script = {"responses": {}}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("rpc") != "execute_request" or not isinstance(record.get("response"), dict) \
+                    or "payload" not in record["response"]:
+                continue
+            user_text = ((record.get("request") or {}).get("payload_dict") or {}).get("user_input", {}).get("userText")
+            if user_text:
+                script["responses"].setdefault(user_text, record["response"])
+            else:
+                script.setdefault("initial", record["response"])
+    return script
+
+
+class mock_dialog_service(DialogServiceServicer):
+    def __init__(self, script=None, latency_ms=0, jitter_ms=0, error_rate=0, error_code="UNAVAILABLE"):
+        script = script or {}
+        self.initial = script.get("initial") or script.get("default") or DEFAULT_RESPONSE
+        self.responses = {str(text).lower(): response for text, response in (script.get("responses") or {}).items()}
+        self.default = script.get("default") or DEFAULT_RESPONSE
+        self.recognized = script.get("recognized")
+        self.tts_bytes = int(script.get("tts_bytes") or 0)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.error_code = getattr(grpc.StatusCode, error_code)
+        self.sessions = {}
+        self.calls = {}
+
+    def _simulate(self, rpc, context):
+        self.calls[rpc] = self.calls.get(rpc, 0) + 1
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            context.abort(self.error_code, f"injected {self.error_code.name} error")
+
+    def _session(self, session_id, context):
+        if session_id not in self.sessions:
+            context.abort(grpc.StatusCode.NOT_FOUND, f"session {session_id} not found")
+        return self.sessions[session_id]
+
+    def _execute_response(self, execute_request, user_text=None):
+        if user_text is None:
+            user_text = execute_request.payload.user_input.user_text if execute_request.HasField("payload") else ""
+        if not user_text:
+            response = self.initial
+        else:
+            response = self.responses.get(user_text.lower(), self.default)
+        return ParseDict(response, ExecuteResponse(), ignore_unknown_fields=True)
+
+    def Start(self, request, context):
+        self._simulate("Start", context)
+        session_id = request.session_id or str(uuid.uuid4())
+        self.sessions[session_id] = {"started": time.time(), "data": {}}
+        return StartResponse(payload=StartResponsePayload(session_id=session_id))
+
+    def Execute(self, request, context):
+        self._simulate("Execute", context)
+        self._session(request.session_id, context)
+        return self._execute_response(request)
+
+    def ExecuteStream(self, request_iterator, context):
+        self._simulate("ExecuteStream", context)
+        execute_request = None
+        audio_bytes = 0
+        for stream_input in request_iterator:
+            if stream_input.HasField("request"):
+                execute_request = stream_input.request
+            audio_bytes += len(stream_input.audio)
+        self._session(execute_request.session_id, context)
+        if audio_bytes and self.recognized:
+            # answer as if the audio had been recognized as the scripted text
+            stream_output = ParseDict({"asrResult": {"hypotheses": [{"formattedText": self.recognized}]}},
+                                      StreamOutput(), ignore_unknown_fields=True)
+            stream_output.response.CopyFrom(self._execute_response(execute_request, self.recognized))
+        else:
+            stream_output = StreamOutput(response=self._execute_response(execute_request))
+        if self.tts_bytes:
+            stream_output.audio.audio = bytes(self.tts_bytes)
+        yield stream_output
+
+    def Update(self, request, context):
+        self._simulate("Update", context)
+        session = self._session(request.session_id, context)
+        session["data"].update(MessageToDict(request.payload.data))
+        return UpdateResponse()
+
+    def Status(self, request, context):
+        self._simulate("Status", context)
+        self._session(request.session_id, context)
+        return StatusResponse(payload=StatusResponsePayload(session_remaining_sec=900))
+
+    def Stop(self, request, context):
+        self._simulate("Stop", context)
+        self._session(request.session_id, context)
+        del self.sessions[request.session_id]
+        return StopResponse()
+
+
+def serve(port=50051, servicer=None, workers=32):
+    'starts the mock server in the background and returns (server, servicer), stop it with server.stop(0)'
+    servicer = servicer or mock_dialog_service()
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers))
+    add_DialogServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f"localhost:{port}")
+    server.start()
+    return server, servicer
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(format='%(asctime)s %(levelname)-5s: %(message)s', level=logging.INFO)
+    script = script_from_log(args.recorded) if args.recorded else load_script(args.script)
+    servicer = mock_dialog_service(script, args.latency_ms, args.jitter_ms,
+                                   args.error_rate, args.error_code)
+    server, servicer = serve(args.port, servicer, args.workers)
+    log.info(f'Mock DialogService listening on localhost:{args.port}')
+    server.wait_for_termination()
+
+
+if __name__ == '__main__':
+    main()
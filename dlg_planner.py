@@ -0,0 +1,171 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dlg_runner import *
+
+'''
+Shared-prefix execution planner.
+The test cases are merged into a prefix tree of steps. The userData of a test case is a step of its own,
+an Update sent where the YAML puts it (before or after the steps), so cases with different userData only
+share the steps before it. DLGaaS cannot clone a session and Update only restores session data, not the
+position in the dialog, so branches cannot be forked from a shared point. Instead the planner:
+- runs one session per leaf of the tree; a test case whose steps are a prefix of a longer case is
+  reported from the longer run when it reaches the end of its steps, without a session of its own
+- remembers where a run failed; the other runs that share the failing prefix are reported with that
+  failure instead of replaying it. Their cases that end before the failing step are reported as passed
+  with "inherited_from" set to the test case whose run went through those steps (and its session id),
+  the cases behind it fail with a shared_step_failure naming that test case
+Each test case still gets its own result (session id, timings, error) for the report.
+'''
+
+
+class shared_step_failure(Exception):
+    'error of a test case whose steps failed in the run of another test case sharing them'
+    def __init__(self, origin, step, error):
+        where = f"at step {step}" if step else "before its first step"
+        super().__init__(f"the run of test case '{origin}' failed {where}: {error}")
+        self.origin = origin
+        self.step = step
+        self.__cause__ = error
+
+
+def step_key(pair):
+    return json.dumps(pair, sort_keys=True, default=str)
+
+
+def case_pairs(test_case):
+    'the (action, expectation) pairs of a test case in YAML order, userData is an ({"update": ...}, None) pair'
+    pairs = []
+    for item, value in test_case.items():
+        if item == "userData":
+            pairs.append(({"update": {"userData": value}}, None))
+        if item == "steps":
+            pairs.extend(build_steps(value or []))
+    return pairs
+
+
+class plan_node:
+    def __init__(self):
+        self.children = {}
+        self.case_indexes = []
+        # set by the first run failing on this step: the error, the case it is reported for and its session
+        self.failure = None
+        self.origin_index = None
+        self.origin_session_id = None
+
+
+class plan_run:
+    def __init__(self, pairs, nodes):
+        self.pairs = pairs
+        self.nodes = nodes
+        # (case index, number of steps after which the case is complete)
+        self.cases = []
+
+
+def build_plan(test_cases):
+    root = plan_node()
+    for index, test_case in enumerate(test_cases):
+        node = root
+        for pair in case_pairs(test_case):
+            node = node.children.setdefault(step_key(pair), (pair, plan_node()))[1]
+        node.case_indexes.append(index)
+
+    runs = []
+    _collect_runs(root, [], [], [], runs)
+    return runs
+
+
+def _collect_runs(node, pairs, nodes, pending, runs):
+    'depth first, cases ending on an inner node are given to the first run that goes through it'
+    pending = pending + [(index, len(pairs)) for index in node.case_indexes]
+    if not node.children:
+        run = plan_run(pairs, nodes)
+        run.cases = pending
+        runs.append(run)
+        return
+    for pair, child in node.children.values():
+        _collect_runs(child, pairs + [pair], nodes + [child], pending, runs)
+        pending = []
+
+
+def new_result(test_case):
+    return {"name": test_case.get("name"),
+            "description": test_case.get("description"),
+            "session_id": None,
+            "modelUrn": None,
+            "timings": [],
+            "inherited_from": None,
+            "error": None}
+
+
+def run_plan_step(session, action, text):
+    if isinstance(action, dict) and "update" in action:
+        session.update_request(action["update"])
+    else:
+        run_step(session, action, text)
+
+
+def execute_run(config, run, results, overrides=None):
+    remaining = sorted(run.cases, key=lambda case: case[1])
+
+    def finish(upto):
+        'every case that ends within the first upto steps has passed'
+        while remaining and remaining[0][1] <= upto:
+            remaining.pop(0)
+
+    def fail(error, origin_index, step):
+        'the case the error happened in gets it, every other remaining case a shared_step_failure of its own'
+        for index, end in remaining:
+            if index == origin_index:
+                results[index]["error"] = error
+            else:
+                results[index]["error"] = shared_step_failure(results[origin_index]["name"], step, error)
+        remaining.clear()
+
+    for depth, node in enumerate(run.nodes):
+        if node.failure is not None:
+            # the shared prefix already failed in another run, which went through the steps before it
+            for index, end in remaining:
+                if end <= depth:
+                    results[index]["session_id"] = node.origin_session_id
+                    results[index]["inherited_from"] = results[node.origin_index]["name"]
+            finish(depth)
+            fail(node.failure, node.origin_index, depth + 1)
+            return
+
+    try:
+        with session_start(config, overrides) as session:
+            for index, end in run.cases:
+                results[index]["session_id"] = session.session_id
+                results[index]["timings"] = session.timings
+                if session.project_data:
+                    results[index]["modelUrn"] = session.project_data["modelUrn"]
+            if not session.session_started:
+                raise RuntimeError(f"Failed to start Mix session: {session.response}")
+            finish(0)
+            for depth, (action, text) in enumerate(run.pairs):
+                node = run.nodes[depth]
+                if node.failure is not None:
+                    fail(node.failure, node.origin_index, depth + 1)
+                    return
+                try:
+                    run_plan_step(session, action, text)
+                except Exception as e:
+                    if node.failure is None:
+                        node.origin_index = remaining[0][0]
+                        node.origin_session_id = session.session_id
+                        node.failure = e
+                    fail(e, remaining[0][0], depth + 1)
+                    return
+                finish(depth + 1)
+    except Exception as e:
+        if remaining:
+            fail(e, remaining[0][0], 0)
+
+
+def run_plan(config, test_cases, workers=1, overrides=None):
+    'each test case belongs to exactly one run, so runs can fill in their results concurrently'
+    results = [new_result(test_case) for test_case in test_cases]
+    runs = build_plan(test_cases)
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="dlg-plan") as executor:
+        list(executor.map(lambda run: execute_run(config, run, results, overrides), runs))
+    return results
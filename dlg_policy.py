@@ -0,0 +1,116 @@
+import asyncio
+import json
+import queue
+import random
+import grpc
+
+'''
+RPC policy of session_start: deadlines, retries and hedged requests.
+- every RPC gets a deadline, rpc_deadlines is a number of seconds for all methods or a dict per method
+  merged over DEFAULT_DEADLINES, so a hung call fails the step instead of stalling the suite
+- idempotent calls (Status, and Execute steps marked idempotent) that fail with a transient status are
+  retried up to rpc_retries times with exponential backoff and full jitter
+- with hedge_after_ms set, an idempotent call that has not answered after that many ms is sent a second
+  time and the first answer wins, which cuts the long tail of the latency distribution
+Start creates a session on the server, a copy that the client gave up on would leak one until it times out.
+It is never hedged, and only retried when the server rejected it (UNAVAILABLE, RESOURCE_EXHAUSTED), not
+after DEADLINE_EXCEEDED when it may have been created. Execute changes the state of the dialog, so it is
+never retried or hedged unless the step is marked idempotent in the YAML (e.g. a turn that only reads data).
+The retries of every call are in its timing.
+'''
+
+DEFAULT_DEADLINES = {"Start": 15, "Execute": 30, "Update": 15, "Status": 10, "Stop": 10, "ExecuteStream": 120}
+IDEMPOTENT_RPCS = ("Status",)
+RETRY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED, grpc.StatusCode.RESOURCE_EXHAUSTED)
+# codes after which a Start did not create a session
+START_RETRY_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED)
+
+
+class rpc_policy:
+    def __init__(self, project_data):
+        deadlines = project_data.get("rpc_deadlines")
+        if isinstance(deadlines, str):
+            deadlines = json.loads(deadlines) if deadlines.strip().startswith("{") else float(deadlines)
+        if isinstance(deadlines, dict):
+            self.deadlines = dict(DEFAULT_DEADLINES, **deadlines)
+        elif deadlines is not None:
+            self.deadlines = {rpc: float(deadlines) for rpc in DEFAULT_DEADLINES}
+        else:
+            self.deadlines = dict(DEFAULT_DEADLINES)
+        self.retries = int(project_data.get("rpc_retries") or 0)
+        self.backoff_ms = float(project_data.get("retry_backoff_ms") or 100)
+        self.max_backoff_ms = float(project_data.get("retry_max_backoff_ms") or 2000)
+        hedge_after_ms = project_data.get("hedge_after_ms")
+        self.hedge_after = float(hedge_after_ms) / 1000 if hedge_after_ms else None
+
+    def deadline(self, rpc):
+        deadline = self.deadlines.get(rpc)
+        return float(deadline) if deadline else None
+
+    def should_retry(self, rpc, code, attempt, idempotent=False):
+        if attempt >= self.retries:
+            return False
+        if rpc == "Start":
+            return code in START_RETRY_CODES
+        return (rpc in IDEMPOTENT_RPCS or idempotent) and code in RETRY_CODES
+
+    def backoff(self, attempt):
+        'full jitter: a random delay up to the exponential backoff of the attempt, in seconds'
+        return random.uniform(0, min(self.backoff_ms * 2 ** (attempt - 1), self.max_backoff_ms)) / 1000
+
+    def hedge_delay(self, rpc, idempotent=False):
+        if self.hedge_after is None or rpc == "Start" or not (rpc in IDEMPOTENT_RPCS or idempotent):
+            return None
+        return self.hedge_after
+
+    def invoke(self, method, rpc_request, rpc, idempotent=False):
+        'one attempt of a unary call, returns (response, call, hedged)'
+        deadline = self.deadline(rpc)
+        delay = self.hedge_delay(rpc, idempotent)
+        if delay is None:
+            rpc_response, call = method.with_call(rpc_request, timeout=deadline)
+            return rpc_response, call, False
+        primary = method.future(rpc_request, timeout=deadline)
+        try:
+            return primary.result(timeout=delay), primary, False
+        except grpc.FutureTimeoutError:
+            pass
+        hedge = method.future(rpc_request, timeout=deadline)
+        finished = queue.Queue()
+        primary.add_done_callback(finished.put)
+        hedge.add_done_callback(finished.put)
+        error = None
+        for _ in range(2):
+            call = finished.get()
+            if call.exception() is None:
+                (hedge if call is primary else primary).cancel()
+                return call.result(), call, True
+            error = call.exception()
+        raise error
+
+    async def invoke_async(self, method, rpc_request, rpc, idempotent=False):
+        'same as invoke for grpc.aio, returns (response, status code, hedged)'
+        deadline = self.deadline(rpc)
+        delay = self.hedge_delay(rpc, idempotent)
+
+        async def attempt():
+            call = method(rpc_request, timeout=deadline)
+            return await call, await call.code()
+
+        primary = asyncio.ensure_future(attempt())
+        if delay is None:
+            return (*await primary, False)
+        done, pending = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return (*primary.result(), False)
+        pending = {primary, asyncio.ensure_future(attempt())}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return (*task.result(), True)
+                error = task.exception()
+        raise error
@@ -0,0 +1,122 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dlg import *
+
+'''
+Pool of pre-started dialog sessions.
+A session_pool keeps session_pool_size sessions of one (modelUrn, selector) started ahead of time:
+the token fetch, connect and Start of the next sessions run on background threads while the
+current test case executes, and every session handed out is replaced right away. When the number
+of sessions still needed is known (demand), no more sessions than that are started.
+Sessions idle in the pool for longer than session_pool_max_age_s are not handed out, so a test
+never gets a session the server already timed out. A session handed out belongs to the caller, which stops
+it (session_start.__exit__ hands it to the teardown manager); the sessions never handed out and the stale ones
+are stopped together, concurrently, when the pool is closed at the end of the run.
+'''
+
+
+class session_pool:
+    def __init__(self, config, size=2, max_age=600, demand=None, overrides=None):
+        self.config = config
+        self.overrides = overrides
+        self.size = max(int(size), 0)
+        self.max_age = float(max_age)
+        # sessions still to be handed out, None when not known
+        self.demand = demand
+        self.ready = queue.Queue()
+        # sessions being started or waiting in ready
+        self.pending = 0
+        # stale sessions that were not handed out
+        self.unused = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(self.size, 1), thread_name_prefix="dlg-pool")
+        self.fill()
+
+    def _start(self):
+        session = session_start(self.config, self.overrides)
+        try:
+            session.__enter__()
+        except Exception as e:
+            session.response = {"errorMessage": f"session pool failed to start a session: {e}"}
+        session.pooled_at = time.monotonic()
+        self.ready.put(session)
+
+    def _submit(self):
+        self.pending += 1
+        self.executor.submit(self._start)
+
+    def fill(self):
+        with self.lock:
+            wanted = self.size if self.demand is None else min(self.size, self.demand)
+            while not self.closed and self.pending < wanted:
+                self._submit()
+
+    def acquire(self):
+        'returns a started session (session_started is False when the Start failed, as with session_start)'
+        while True:
+            with self.lock:
+                if self.pending == 0:
+                    # pool disabled or demand underestimated, start one for this caller
+                    self._submit()
+            session = self.ready.get()
+            with self.lock:
+                self.pending -= 1
+                if not session.session_started or time.monotonic() - session.pooled_at <= self.max_age:
+                    if self.demand is not None:
+                        self.demand = max(self.demand - 1, 0)
+                    break
+                # stale, it is stopped with the other unused sessions when the pool is closed
+                self.unused.append(session)
+        self.fill()
+        return session
+
+    def close(self):
+        'stops the sessions that were never handed out concurrently, returns the number of sessions stopped'
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=True)
+        while not self.ready.empty():
+            self.unused.append(self.ready.get())
+        sessions = [session for session in self.unused if session.session_started]
+        self.unused = []
+        if sessions:
+            with ThreadPoolExecutor(max_workers=min(len(sessions), 32), thread_name_prefix="dlg-stop") as executor:
+                list(executor.map(lambda session: session.__exit__(None, None, None), sessions))
+        return len(sessions)
+
+
+_pools = {}
+_pool_keys = {}
+_pools_lock = threading.Lock()
+
+
+def pool_key(project_data):
+    return (project_data["modelUrn"], project_data["channel"], project_data["language"], "default")
+
+
+def get_session_pool(config, demand=None, overrides=None):
+    'one pool per modelUrn and selector, the config sizes it when it is first used'
+    config_key = (config, json.dumps(overrides, sort_keys=True))
+    with _pools_lock:
+        if config_key not in _pool_keys:
+            setup = session_start(config, overrides)
+            setup.get_setup_data()
+            project_data = setup.project_data or setup.project_config
+            key = pool_key(project_data)
+            if key not in _pools:
+                _pools[key] = session_pool(config, project_data["session_pool_size"],
+                                           project_data["session_pool_max_age_s"], demand, overrides)
+            _pool_keys[config_key] = key
+        return _pools[_pool_keys[config_key]]
+
+
+def close_session_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+        _pool_keys.clear()
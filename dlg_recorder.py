@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from grpc import RpcError, StatusCode
+from nuance.dlg.v1.dlg_messages_pb2 import *
+
+'''
+Record and replay of dialog RPC exchanges.
+With "record_mode": "record" every Start/Execute/Update/Stop/Status exchange of session_start is stored
+in an indexed SQLite file (record_file) as serialized protobuf, keyed by modelUrn, selector, RPC and the
+normalized conversation path (the user inputs and data updates of the session so far).
+With "record_mode": "replay" the same keys are looked up and the stored responses are served without
+a token, a channel or any network call, so a suite can be rerun in seconds against a pinned model snapshot.
+'''
+
+RECORD_MODES = ("off", "record", "replay")
+RESPONSE_TYPES = {"Start": StartResponse, "Execute": ExecuteResponse, "Update": UpdateResponse,
+                  "Stop": StopResponse, "Status": StatusResponse}
+COMMIT_EVERY = 100
+
+
+class replay_miss(RpcError):
+    def __init__(self, rpc, path):
+        super().__init__(f"no recording for {rpc} after {path}")
+        self.rpc = rpc
+        self.path = path
+
+    def code(self):
+        return StatusCode.FAILED_PRECONDITION
+
+    def details(self):
+        return str(self)
+
+
+class replay_call:
+    def code(self):
+        return StatusCode.OK
+
+
+class replay_stub:
+    'stands in for DialogServiceStub in replay mode, call_rpc only looks at the request'
+    def __getattr__(self, rpc):
+        return rpc
+
+
+def normalize_input(value):
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def exchange_key(project_data, rpc, path):
+    key = json.dumps([project_data.get("modelUrn"), project_data.get("channel"), project_data.get("language"),
+                      "default", rpc, path], separators=(",", ":"))
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class recording_store:
+    def __init__(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS exchanges "
+                                "(key TEXT PRIMARY KEY, rpc TEXT, path TEXT, request BLOB, response BLOB)")
+
+    def record(self, project_data, rpc, path, rpc_request, rpc_response):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO exchanges VALUES (?, ?, ?, ?, ?)",
+                                    (exchange_key(project_data, rpc, path), rpc, json.dumps(path),
+                                     rpc_request.SerializeToString(), rpc_response.SerializeToString()))
+            self.pending += 1
+            if self.pending >= COMMIT_EVERY:
+                self.connection.commit()
+                self.pending = 0
+
+    def replay(self, project_data, rpc, path):
+        with self.lock:
+            row = self.connection.execute("SELECT response FROM exchanges WHERE key = ?",
+                                          (exchange_key(project_data, rpc, path),)).fetchone()
+        if row is None:
+            raise replay_miss(rpc, path)
+        return RESPONSE_TYPES[rpc].FromString(row[0])
+
+    def close(self):
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_recording_store(path):
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = recording_store(path)
+        return _stores[path]
+
+
+def close_recording_stores():
+    with _stores_lock:
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
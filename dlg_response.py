@@ -0,0 +1,149 @@
+from collections.abc import Mapping
+from google.protobuf.json_format import MessageToDict
+
+'''
+Read only view over a DialogService response message.
+The prompts, the action type (qaAction, daAction, endAction, ...), the action data and the session id
+are read straight from the protobuf fields, which is what the assertions and the sample client need
+on every turn. The full MessageToDict conversion is only done, once, when something asks for the
+dict form (logging, str(), ["payload"]), so verbose channel responses are not converted per turn.
+dict_prompts reads the same prompt fields from a response already in dict form (MessageToDict, logs), so an
+expectation gives the same result on both forms.
+'''
+
+PROMPT_KINDS = ("nlg", "visual", "audio")
+# fields of a prompt message holding its text
+PROMPT_KEYS = ("text", "ssml")
+
+
+class dialog_response(Mapping):
+    def __init__(self, message):
+        self.message = message
+        self._dict = None
+
+    def as_dict(self):
+        if self._dict is None:
+            self._dict = MessageToDict(self.message)
+        return self._dict
+
+    def __getitem__(self, key):
+        return self.as_dict()[key]
+
+    def __iter__(self):
+        return iter(self.as_dict())
+
+    def __len__(self):
+        return len(self.as_dict())
+
+    def __str__(self):
+        return str(self.as_dict())
+
+    __repr__ = __str__
+
+    @property
+    def payload(self):
+        return self.message.payload if hasattr(self.message, "payload") else None
+
+    @property
+    def session_id(self):
+        return getattr(self.payload, "session_id", None) or None
+
+    def action(self):
+        'returns (json name, message) of the action set in the payload, e.g. ("qaAction", QAAction)'
+        if self.payload is None:
+            return None, None
+        for field, value in self.payload.ListFields():
+            if field.name.endswith("_action"):
+                return field.json_name, value
+        return None, None
+
+    @property
+    def action_type(self):
+        return self.action()[0]
+
+    def action_data(self):
+        action_type, action = self.action()
+        if action is None or "data" not in action.DESCRIPTOR.fields_by_name or not action.HasField("data"):
+            return {}
+        return MessageToDict(action.data)
+
+    @property
+    def intent(self):
+        'NLU intent when the dialog passes it to the client in the action data (e.g. a data access node)'
+        data = self.action_data()
+        return data.get("intent") or data.get("nluIntent")
+
+    def messages(self):
+        if self.payload is None:
+            return []
+        messages = list(getattr(self.payload, "messages", []))
+        action_type, action = self.action()
+        if action is not None and "message" in action.DESCRIPTOR.fields_by_name and action.HasField("message"):
+            messages.append(action.message)
+        return messages
+
+    def prompts(self, kind=None):
+        kinds = (kind,) if kind else PROMPT_KINDS
+        texts = []
+        for message in self.messages():
+            for prompt_kind in kinds:
+                for prompt in getattr(message, prompt_kind, []):
+                    for key in PROMPT_KEYS:
+                        text = getattr(prompt, key, None)
+                        if text:
+                            texts.append(text)
+        return texts
+
+    def prompt_texts(self):
+        return self.prompts()
+
+
+class stream_response(dialog_response):
+    '''
+    Last execute response of an ExecuteStream call, with what the stream added to it: the recognized
+    text of the ASR result and the amount of TTS audio returned (tts_ms assumes 16 bit mono PCM).
+    '''
+    def __init__(self, message, recognized_text=None, tts_bytes=0, tts_sample_rate=16000):
+        super().__init__(message)
+        self.recognized_text = recognized_text
+        self.tts_bytes = tts_bytes
+        self.tts_ms = tts_bytes * 1000 / (int(tts_sample_rate) * 2)
+
+    def as_dict(self):
+        if self._dict is None:
+            self._dict = dict(MessageToDict(self.message), recognizedText=self.recognized_text,
+                              ttsBytes=self.tts_bytes)
+        return self._dict
+
+
+def dict_prompts(response, kind=None):
+    'same as dialog_response.prompts for a response in dict form'
+    payload = response.get("payload") if isinstance(response, dict) else None
+    if not isinstance(payload, dict):
+        return []
+    messages = list(payload.get("messages") or [])
+    for key, action in payload.items():
+        if key.endswith("Action") and isinstance(action, dict) and isinstance(action.get("message"), dict):
+            messages.append(action["message"])
+            break
+    kinds = (kind,) if kind else PROMPT_KINDS
+    texts = []
+    for message in messages:
+        for prompt_kind in kinds:
+            for prompt in message.get(prompt_kind) or []:
+                for key in PROMPT_KEYS:
+                    text = prompt.get(key)
+                    if isinstance(text, str) and text:
+                        texts.append(text)
+    return texts
+
+
+def is_error(response):
+    'error responses are the plain dicts/sets built in the except blocks of session_start'
+    if isinstance(response, dialog_response):
+        return False
+    if isinstance(response, dict):
+        return "errorMessage" in response
+    if isinstance(response, set):
+        return any("errorMessage" in str(item) for item in response)
+    return "errorMessage" in str(response)
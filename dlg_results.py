@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+'''
+Results store used for incremental runs.
+For every test case it records the hash of the test case content, the modelUrn (plus the optional
+model_version config value), the selector (channel, language, library) and the outcome of the last run.
+A case can be skipped when none of those inputs changed since it last passed, and the time it took is
+used to balance the shards of a distributed run.
+'''
+
+RESULTS_FILE = os.path.join(".dlg_cache", "results.json")
+
+
+def test_case_hash(test_case):
+    content = json.dumps(test_case, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def result_key(test_case, cell=None):
+    'matrix runs keep one result per test case and cell'
+    name = str(test_case.get("name"))
+    return name if cell is None else f"{name} [{cell}]"
+
+
+def run_inputs(project_data):
+    'the model and selector part of the key, taken from the project config built by session_start.get_setup_data'
+    return {"modelUrn": project_data.get("modelUrn"),
+            "model_version": project_data.get("model_version"),
+            "selector": {"channel": project_data.get("channel"),
+                         "language": project_data.get("language"),
+                         "library": "default"}}
+
+
+class results_store:
+    def __init__(self, path=RESULTS_FILE):
+        self.path = path
+        self.results = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.results = json.load(f)
+            except (OSError, ValueError):
+                self.results = {}
+
+    def is_unchanged(self, test_case, inputs, cell=None):
+        'true when the test case passed last time with the same content, model and selector'
+        previous = self.results.get(result_key(test_case, cell))
+        return bool(previous) and previous["outcome"] == "passed" \
+            and previous["hash"] == test_case_hash(test_case) \
+            and previous["inputs"] == inputs
+
+    def record(self, test_case, inputs, outcome, session_id=None, cell=None, ms=None):
+        'ms is the time spent in the RPCs of the test case, used to balance shards (see dlg_shard)'
+        with self.lock:
+            self.results[result_key(test_case, cell)] = {"hash": test_case_hash(test_case),
+                                                         "inputs": inputs,
+                                                         "outcome": outcome,
+                                                         "session_id": session_id,
+                                                         "ms": ms,
+                                                         "time": time.time()}
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            temp_path = self.path + f".{os.getpid()}"
+            with open(temp_path, "w") as f:
+                json.dump(self.results, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
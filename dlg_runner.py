@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+from dlg import *
+
+'''
+Shared YAML test case runner.
+run_test_case holds the step semantics used by tests/run_test.py, and run_parallel executes
+many test cases at once, each in its own dialog session, with a bounded number of worker threads,
+optionally each against its own matrix cell (see dlg_matrix).
+'''
+
+
+def build_steps(steps):
+    '''
+    Turns the YAML steps into (expected, text) pairs.
+    "prompt : input" steps expect the prompt and then send the input, a plain "prompt" step is
+    checked against the last response. A step with an "expect" key (a prompt or a dict of response
+    fields, see dlg_matcher) and an optional "input" key does the same with field expectations,
+    or with an "audio" key (a file in audio_folder) the input is sent as audio through ExecuteStream;
+    the action of such a step is {"audio": file}. A step with "idempotent: true" can be retried and
+    hedged by the rpc policy (see dlg_policy), its action is {"input": text, "idempotent": True}.
+    The first pair has no expectation, it sends the first input.
+    '''
+    test_text = []
+    test_action = []
+    start_node = True
+    for step in steps:
+        if isinstance(step, dict) and "expect" in step:
+            text = step["expect"]
+            if "audio" in step:
+                action = {"audio": str(step["audio"])}
+            elif "input" in step and str(step.get("idempotent")).lower() in ("true", "yes"):
+                action = {"input": str(step["input"]), "idempotent": True}
+            elif "input" in step:
+                action = str(step["input"])
+            else:
+                action = str("empty_combine_with_next_step")
+        elif isinstance(step, dict):
+            text, action = next(iter(step.items()))
+            action = str(action)
+        else:
+            text = str(step)
+            action = str("empty_combine_with_next_step")
+        if start_node == True:
+            start_node = False
+            test_text.append(text)
+            test_action.append(None)
+            test_action.append(action)
+        else:
+            test_text.append(text)
+            test_action.append(action)
+    return list(zip(test_action, test_text))
+
+
+def run_step(session, action, text):
+    if isinstance(action, dict) and "audio" in action:
+        session.execute_stream_request(action["audio"], text)
+    elif isinstance(action, dict):
+        session.execute_request(action["input"], text, idempotent=True)
+    elif action != "empty_combine_with_next_step":
+        session.execute_request(action, text)
+    else:
+        assert_dlg(text, session.response, session.match_mode)
+
+
+def run_test_case(session, test_case):
+    for item, value in test_case.items():
+        'loop through each test case item'
+        if item == "userData":
+            data = {}
+            data["userData"] = value
+            session.update_request(data)
+        if item == "steps":
+            for action, text in build_steps(value):
+                run_step(session, action, text)
+
+
+def run_case_in_session(config, test_case, overrides=None):
+    result = {"name": test_case.get("name"),
+              "description": test_case.get("description"),
+              "session_id": None,
+              "modelUrn": None,
+              "timings": [],
+              "error": None}
+    try:
+        with session_start(config, overrides) as session:
+            result["session_id"] = session.session_id
+            result["timings"] = session.timings
+            if session.project_data:
+                result["modelUrn"] = session.project_data["modelUrn"]
+            if not session.session_started:
+                raise RuntimeError(f"Failed to start Mix session: {session.response}")
+            run_test_case(session, test_case)
+    except Exception as e:
+        result["error"] = e
+    return result
+
+
+def run_parallel(config, test_cases, workers, overrides=None):
+    'overrides, when given, holds the config overrides (matrix cell) of each test case'
+    overrides = overrides or [None] * len(test_cases)
+    with ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="dlg-case") as executor:
+        return list(executor.map(lambda case: run_case_in_session(config, *case), zip(test_cases, overrides)))
@@ -0,0 +1,220 @@
+import argparse
+import glob
+import heapq
+import json
+import os
+import subprocess
+import sys
+import time
+import zlib
+from dlg_cases import get_test_case_repository
+from dlg_results import results_store
+
+'''
+Distributed runs: one coordinator, N workers, a shared directory.
+The coordinator assigns every YAML test case to a shard and writes the assignment to <shard-dir>/plan.json.
+The assignment is deterministic and balanced on the time each case took in earlier runs (results.json of
+--incremental): cases are taken longest first, ties by name, and given to the least loaded shard.
+Cases without history count as the median known time.
+
+Each worker is a normal pytest run limited to its shard:
+    python -m pytest tests/run_test.py --shard 2/4 --shard-dir /mnt/shared/shards
+It writes its results (outcome, error, session id, timings, stop outcome) to <shard-dir>/worker-2.json and
+its dialog log to <shard-dir>/logs-worker-2/. The coordinator then runs pytest once more with --shard-merge,
+which reports the stored results through the same conftest hooks, so the merged HTML report looks like the
+report of a single run, and merges the worker logs into logs/dlg.jsonl in timestamp order.
+
+    python dlg_shard.py --workers 4                       # plan, run 4 local workers, merge
+    python dlg_shard.py --workers 4 --shard-dir /mnt/shared/shards --no-spawn   # workers started on other hosts
+Arguments after -- are passed to every worker, e.g. -- --parallel 8
+'''
+
+PLAN_FILE = "plan.json"
+# the YAML test cases only, without it pytest would also collect the unit tests under tests/
+TEST_PATH = os.path.join("tests", "run_test.py")
+DEFAULT_SHARD_DIR = os.path.join(".dlg_cache", "shards")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        prog="dlg_shard.py",
+        usage="%(prog)s [-options] [-- pytest options]",
+        add_help=False,
+        formatter_class=lambda prog: argparse.HelpFormatter(
+            prog, max_help_position=45, width=100)
+    )
+
+    options = parser.add_argument_group("options")
+    options.add_argument("-h", "--help", action="help",
+                         help="Show this help message and exit")
+    options.add_argument("--workers", type=int, default=2, help="number of shards")
+    options.add_argument("--shard-dir", default=DEFAULT_SHARD_DIR, help="directory shared with the workers")
+    options.add_argument("--test-cases", default="tests/test_cases", help="folder with the YAML test cases")
+    options.add_argument("--no-spawn", action="store_true",
+                         help="do not start local workers, wait for the results of workers started elsewhere")
+    options.add_argument("--timeout", type=float, default=3600, help="seconds to wait for the workers")
+    options.add_argument("pytest_args", nargs="*", help="options passed to every worker after --")
+    return parser.parse_args()
+
+
+def case_durations(results):
+    'ms per test case name from the results store, summed over the matrix cells of the case'
+    durations = {}
+    for key, result in results.items():
+        if result.get("ms") is None:
+            continue
+        name = key.split(" [", 1)[0] if key.endswith("]") else key
+        durations[name] = durations.get(name, 0) + result["ms"]
+    return durations
+
+
+def shard_plan(test_cases, shards, durations):
+    'returns {test case name: shard index}, the same input always gives the same plan'
+    known = sorted(durations.values())
+    default = known[len(known) // 2] if known else 1.0
+    names = sorted({str(test_case.get("name")) for test_case in test_cases},
+                   key=lambda name: (-durations.get(name, default), name))
+    loads = [(0.0, shard) for shard in range(shards)]
+    plan = {}
+    for name in names:
+        load, shard = heapq.heappop(loads)
+        plan[name] = shard
+        heapq.heappush(loads, (load + durations.get(name, default), shard))
+    return plan
+
+
+def case_shard(plan, name, shards):
+    'shard of a test case, a case added after the plan was written goes to a shard picked from its name'
+    name = str(name)
+    if name in plan:
+        return plan[name]
+    return zlib.crc32(name.encode("utf-8")) % shards
+
+
+def parse_shard(value):
+    'the --shard option, "i/N" with i from 1 to N, returns (index from 0, N)'
+    index, shards = (int(part) for part in str(value).split("/"))
+    if not 1 <= index <= shards:
+        raise ValueError(f"--shard must be i/N with 1 <= i <= N, got {value}")
+    return index - 1, shards
+
+
+def write_plan(shard_dir, plan, shards):
+    os.makedirs(shard_dir, exist_ok=True)
+    with open(os.path.join(shard_dir, PLAN_FILE), "w") as f:
+        json.dump({"shards": shards, "plan": plan}, f, indent=1, sort_keys=True)
+
+
+def load_plan(shard_dir, shards, test_folder="tests/test_cases"):
+    'the coordinator plan when there is one for this number of shards, otherwise computed the same way here'
+    path = os.path.join(shard_dir, PLAN_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("shards") == shards:
+            return data["plan"]
+    test_cases = get_test_case_repository(test_folder).test_cases()
+    return shard_plan(test_cases, shards, case_durations(results_store().results))
+
+
+def worker_path(shard_dir, index):
+    return os.path.join(shard_dir, f"worker-{index + 1}.json")
+
+
+def worker_logs_folder(shard_dir, index):
+    return os.path.join(shard_dir, f"logs-worker-{index + 1}")
+
+
+def write_worker_results(shard_dir, index, results, teardown=None):
+    os.makedirs(shard_dir, exist_ok=True)
+    temp_path = worker_path(shard_dir, index) + f".{os.getpid()}"
+    with open(temp_path, "w") as f:
+        json.dump({"results": results, "teardown": teardown}, f)
+    os.replace(temp_path, worker_path(shard_dir, index))
+
+
+def load_worker_results(shard_dir):
+    'merged results of every worker keyed by test node id, and the summed stop outcome'
+    results = {}
+    teardown = {"stopped": 0, "already_ended": 0, "failed": []}
+    for path in sorted(glob.glob(os.path.join(shard_dir, "worker-*.json"))):
+        with open(path) as f:
+            data = json.load(f)
+        results.update(data["results"])
+        worker_teardown = data.get("teardown") or {}
+        teardown["stopped"] += worker_teardown.get("stopped", 0)
+        teardown["already_ended"] += worker_teardown.get("already_ended", 0)
+        teardown["failed"] += worker_teardown.get("failed", [])
+    return results, teardown
+
+
+def merge_logs(shard_dir, logs_folder="logs"):
+    'appends the worker logs to logs/dlg.jsonl, interleaved by timestamp'
+    files = [open(path, encoding="utf-8") for path in
+             sorted(glob.glob(os.path.join(shard_dir, "logs-worker-*", "dlg.jsonl")))]
+    try:
+        os.makedirs(logs_folder, exist_ok=True)
+        with open(os.path.join(logs_folder, "dlg.jsonl"), "a", encoding="utf-8") as target:
+            lines = heapq.merge(*files, key=lambda line: json.loads(line).get("ts") or 0)
+            target.writelines(lines)
+    finally:
+        for f in files:
+            f.close()
+
+
+def clean_shard_dir(shard_dir):
+    for path in glob.glob(os.path.join(shard_dir, "worker-*.json")) + \
+            glob.glob(os.path.join(shard_dir, "logs-worker-*", "dlg*.jsonl*")):
+        os.remove(path)
+
+
+def wait_for_workers(shard_dir, shards, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        if all(os.path.exists(worker_path(shard_dir, index)) for index in range(shards)):
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(1)
+
+
+def worker_command(index, shards, shard_dir, pytest_args=()):
+    return [sys.executable, "-m", "pytest", TEST_PATH, f"--shard={index + 1}/{shards}", f"--shard-dir={shard_dir}",
+            *pytest_args]
+
+
+def merge_command(shard_dir):
+    return [sys.executable, "-m", "pytest", TEST_PATH, "--shard-merge", f"--shard-dir={shard_dir}"]
+
+
+def main():
+    args = parse_args()
+    test_cases = get_test_case_repository(args.test_cases).test_cases()
+    if not test_cases:
+        raise SystemExit(f"No test cases found in {args.test_cases}")
+    plan = shard_plan(test_cases, args.workers, case_durations(results_store().results))
+    clean_shard_dir(args.shard_dir)
+    write_plan(args.shard_dir, plan, args.workers)
+    print(f'{len(plan)} test cases in {args.workers} shards, plan in {os.path.join(args.shard_dir, PLAN_FILE)}')
+
+    if not args.no_spawn:
+        workers = []
+        for index in range(args.workers):
+            output = open(os.path.join(args.shard_dir, f"worker-{index + 1}.out"), "w")
+            workers.append((subprocess.Popen(worker_command(index, args.workers, args.shard_dir, args.pytest_args),
+                                             stdout=output, stderr=subprocess.STDOUT), output))
+        for worker, output in workers:
+            worker.wait()
+            output.close()
+    if not wait_for_workers(args.shard_dir, args.workers, args.timeout if args.no_spawn else 0):
+        missing = [index + 1 for index in range(args.workers)
+                   if not os.path.exists(worker_path(args.shard_dir, index))]
+        print(f'No results from worker(s) {missing}, their test cases are reported as failed')
+
+    merge_logs(args.shard_dir)
+    merged = subprocess.run(merge_command(args.shard_dir))
+    sys.exit(merged.returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from dlg_response import is_error
+
+'''
+Background teardown of dialog sessions.
+session_start.__exit__ hands the session to the teardown manager instead of stopping it in line, so a
+test is done as soon as its last assertion is. The manager sends the Stop requests on teardown_workers
+threads (Status is no longer called first, a session the server already ended answers NOT_FOUND and
+counts as ended). drain() waits for every pending Stop and returns the outcome in aggregate:
+    {"stopped": 120, "already_ended": 2, "failed": [{"session_id": ..., "error": ...}]}
+'''
+
+
+class teardown_manager:
+    def __init__(self, workers=8):
+        self.executor = ThreadPoolExecutor(max_workers=max(int(workers), 1), thread_name_prefix="dlg-stop")
+        self.futures = []
+        self.stopped = 0
+        self.already_ended = 0
+        self.failed = []
+        self.lock = threading.Lock()
+
+    def submit(self, session):
+        future = self.executor.submit(self._stop, session)
+        with self.lock:
+            self.futures = [pending for pending in self.futures if not pending.done()]
+            self.futures.append(future)
+
+    def _stop(self, session):
+        try:
+            session.stop_request()
+            response = session.response
+        except Exception as e:
+            response = {"errorMessage": f"stop failed: {e}"}
+        with self.lock:
+            if not is_error(response):
+                self.stopped += 1
+            elif "NOT_FOUND" in str(response.get("errorMessage", "")):
+                self.already_ended += 1
+            else:
+                self.failed.append({"session_id": session.session_id, "error": str(response)})
+
+    def drain(self):
+        with self.lock:
+            futures = list(self.futures)
+        wait(futures)
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            return {"stopped": self.stopped, "already_ended": self.already_ended, "failed": list(self.failed)}
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_teardown_manager(project_data=None):
+    '''
+    Returns the process wide teardown manager, the first caller's teardown_workers wins.
+    '''
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = teardown_manager((project_data or {}).get("teardown_workers") or 8)
+        return _default_manager
+
+
+def close_teardown_manager():
+    'drains the pending stops, returns their aggregate outcome or None when no session was handed off'
+    global _default_manager
+    with _default_manager_lock:
+        manager, _default_manager = _default_manager, None
+    if manager is None:
+        return None
+    return manager.drain()
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import threading
+import time
+from grpc import StatusCode
+
+'''
+Token bucket rate limiter shared by every session that talks to the same server with the same credentials.
+rate_limit is the number of requests per second, unset or 0 means unlimited: requests are only throttled
+once the service pushes back. burst is how many requests can go out back to back before the limiter
+starts spacing them. When the service answers RESOURCE_EXHAUSTED or UNAVAILABLE the rate is halved and every
+caller waits for an exponential backoff; the rate then recovers gradually as calls succeed again.
+Stop does not go through the limiter, the background teardown of finished sessions frees server
+capacity and must not take the tokens of the test steps.
+sleep is a pause of one session before each of its turns (Start, Execute, ExecuteStream), 0 by default.
+'''
+
+PUSHBACK_CODES = (StatusCode.RESOURCE_EXHAUSTED, StatusCode.UNAVAILABLE)
+MIN_RATE = 0.2
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+RECOVERY_FACTOR = 1.05
+# an adaptive rate above this is treated as unlimited again when no limit was configured
+UNLIMITED_RECOVERY_RATE = 1000.0
+UNTHROTTLED_RPCS = ("Stop",)
+PACED_RPCS = ("Start", "Execute", "ExecuteStream")
+
+log = logging.getLogger(__name__)
+
+
+def configured_rate(project_data):
+    rate_limit = project_data.get("rate_limit")
+    if rate_limit is not None and str(rate_limit).strip() != "":
+        return max(float(rate_limit), 0)
+    return 0
+
+
+def session_pause(project_data, rpc):
+    'seconds a session waits before rpc, the sleep setting before each turn'
+    if rpc not in PACED_RPCS:
+        return 0
+    return max(float(project_data.get("sleep") or 0), 0)
+
+
+class rate_limiter:
+    def __init__(self, rate=0, burst=1):
+        self.max_rate = float(rate)
+        self.rate = self.max_rate
+        self.burst = max(float(burst), 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.failures = 0
+        self.interval = None
+        self.last_acquire = None
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        now = time.monotonic()
+        if self.last_acquire is not None:
+            interval = now - self.last_acquire
+            self.interval = interval if self.interval is None else 0.8 * self.interval + 0.2 * interval
+        self.last_acquire = now
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.rate <= 0:
+            return 0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+    def acquire(self):
+        with self.lock:
+            wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self):
+        with self.lock:
+            wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def report(self, code):
+        with self.lock:
+            if code in PUSHBACK_CODES:
+                self.failures += 1
+                if self.rate > 0:
+                    self.rate = max(self.rate / 2, MIN_RATE)
+                else:
+                    observed = 1 / self.interval if self.interval else UNLIMITED_RECOVERY_RATE
+                    self.rate = max(observed / 2, MIN_RATE)
+                    self.tokens = min(self.tokens, 1)
+                    self.updated = time.monotonic()
+                backoff = min(BACKOFF_BASE * (2 ** (self.failures - 1)), BACKOFF_MAX)
+                self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+            elif code == StatusCode.OK:
+                self.failures = 0
+                if self.rate != self.max_rate:
+                    self.rate *= RECOVERY_FACTOR
+                    if self.max_rate > 0 and self.rate >= self.max_rate:
+                        self.rate = self.max_rate
+                    elif self.max_rate <= 0 and self.rate >= UNLIMITED_RECOVERY_RATE:
+                        self.rate = 0
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(project_data):
+    '''
+    Returns the limiter shared by the sessions of the same server and credentials, the first caller's
+    rate_limit and burst win.
+    '''
+    key = (project_data["serverUrl"], project_data["client_id"])
+    rate = configured_rate(project_data)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = rate_limiter(rate, project_data.get("burst") or 1)
+        elif _limiters[key].max_rate != rate:
+            log.warning("rate_limit %g ignored for %s, the shared rate limiter was created with %g",
+                        rate, key[0], _limiters[key].max_rate)
+        return _limiters[key]
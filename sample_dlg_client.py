@@ -1,16 +1,35 @@
 import argparse
 import logging
-import requests
-from google.protobuf.json_format import MessageToJson, MessageToDict
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from google.protobuf.json_format import MessageToDict
 import grpc
 import json
 from nuance.dlg.v1.common.dlg_common_messages_pb2 import *
 from nuance.dlg.v1.dlg_messages_pb2 import *
 from nuance.dlg.v1.dlg_interface_pb2 import *
 from nuance.dlg.v1.dlg_interface_pb2_grpc import *
+from dlg_auth import get_token as get_cached_token
+from dlg_channels import get_channel, close_channel_pool
+from dlg_response import dialog_response
+from dlg_audio import get_audio_source, read_stream_outputs, stream_inputs
 
 log = logging.getLogger(__name__)
 
+'''
+Sample DialogService client.
+Interactive by default: it starts a session, prints the prompts at debug level and asks for the next user
+input while the dialog answers with a question. With --batch it runs scripted conversations headless instead,
+one JSON line per conversation, from a file or from stdin (-):
+    {"id": "coffee-1", "turns": ["order coffee", "large"]}
+    ["order coffee", "small"]
+The conversations run --concurrency at a time over the pooled channels of dlg_channels, which attach the cached
+token per call so a long run survives token refreshes, and the transcript of each one is written as a JSON line
+to --output (stdout by default) as soon as it is complete.
+'''
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -25,13 +44,23 @@ def parse_args():
     options.add_argument("-h", "--help", action="help",
                          help="Show this help message and exit")
     options.add_argument("--config", nargs="?", help="configure your mix project (required)")
+    options.add_argument("--audioFile", help="audio file (WAV or raw 16 kHz PCM) sent through ExecuteStream "
+                                             "as the first user turn")
+    options.add_argument("--textInput", help="text sent through ExecuteStream as the first user turn")
+    options.add_argument("--ttsFile", help="file the TTS audio returned by ExecuteStream is written to")
+    options.add_argument("--realtime", type=float, default=0,
+                         help="pace audio at this multiple of real time (1 is real time, 0 sends it as fast as possible)")
+    options.add_argument("--batch", help="JSONL file of scripted conversations to run headless, - for stdin")
+    options.add_argument("--concurrency", type=int, default=8, help="conversations run at the same time with --batch")
+    options.add_argument("--output", help="JSONL file the transcripts of --batch are written to (default stdout)")
     return parser.parse_args()
 
 
 def setup_project_config(config):
     project_config = {"auth_url": "https://auth.crt.nuance.com/oauth2/token", "serverUrl": "dlg.api.nuance.com:443",
                       "nlu_uri": "nlu.api.nuance.com:443", "client_id": None, "secret": None, "modelUrn": None,
-                      "scope": "dlg"}
+                      "scope": "dlg", "insecure": False, "channel_pool_size": "2",
+                      "keepalive_time_ms": "30000", "keepalive_timeout_ms": "10000"}
 
     if config:
         config_file_contents = open(config)
@@ -58,20 +87,23 @@ def setup_project_config(config):
 
 
 def get_token(project_data):
-    payload = {"grant_type": "client_credentials", "scope": project_data["scope"]}
+    if project_data["insecure"]:
+        return None
     try:
-        response = requests.post(project_data["auth_url"], auth=(project_data["client_id"], project_data["secret"]),
-                                 data=payload)
-        response.json()["access_token"]
+        return get_cached_token(project_data)
     except Exception as e:
         print(f'get_token failed for:')
         print(f'client_id={project_data["client_id"]}')
         print(f'secret={project_data["secret"]}')
-        print(f'with response={response}')
-    return response.json()["access_token"]
+        print(f'with error={e}')
+        raise
 
 
 def create_channel(project_data, token):
+    if project_data["insecure"]:
+        log.debug("Creating insecure gRPC channel")
+        return grpc.insecure_channel(project_data["serverUrl"])
+
     log.debug("Adding CallCredentials with token %s" % token)
     call_credentials = grpc.access_token_call_credentials(token)
 
@@ -85,7 +117,7 @@ def create_channel(project_data, token):
 
 def read_session_id_from_response(response_obj):
     try:
-        session_id = response_obj.get('payload').get('sessionId', None)
+        session_id = response_obj.session_id
     except Exception as e:
         raise Exception("Invalid JSON Object or response object")
     if session_id:
@@ -104,8 +136,9 @@ def start_request(stub, model_ref_dict, session_id, selector_dict={}):
                              payload=start_payload)
     log.debug(f'Start Request: {start_req}')
     start_response, call = stub.Start.with_call(start_req)
-    response = MessageToDict(start_response)
-    log.debug(f'Start Request Response: {json.dumps(response, ensure_ascii=False, indent=4)}')
+    response = dialog_response(start_response)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f'Start Request Response: {json.dumps(response.as_dict(), ensure_ascii=False, indent=4)}')
     return response, call
 
 
@@ -121,26 +154,24 @@ def execute_request(stub, session_id, selector_dict={}, payload_dict={}):
                                      payload=execute_payload)
     log.debug(f'Execute Request: {execute_payload}')
     execute_response, call = stub.Execute.with_call(execute_request)
-    response = MessageToDict(execute_response)
-    log.debug(f'Execute Response: {json.dumps(response, ensure_ascii=False, indent=4)}')
+    response = dialog_response(execute_response)
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f'Execute Response: {json.dumps(response.as_dict(), ensure_ascii=False, indent=4)}')
     return response, call
 
 
 def execute_stream_request(args, stub, session_id, selector_dict={}):
-    # Receive stream outputs from Dialog
+    # Receive stream outputs from Dialog, TTS audio is written to args.ttsFile as it arrives
     stream_outputs = stub.ExecuteStream(build_stream_input(args, session_id, selector_dict))
     log.debug(f'execute_responses: {stream_outputs}')
-    responses = []
-    audio = bytearray(b'')
-
-    for stream_output in stream_outputs:
-        if stream_output:
-            # Extract execute response from the stream output
-            response = MessageToDict(stream_output.response)
-            if response:
-                responses.append(response)
-            audio += stream_output.audio.audio
-    return responses, audio
+    sink = open(args.ttsFile, "wb") if getattr(args, "ttsFile", None) else None
+    try:
+        collector = read_stream_outputs(stream_outputs, sink)
+    finally:
+        if sink:
+            sink.close()
+    log.debug(f'Recognized text: {collector.recognized_text}')
+    return [dialog_response(response) for response in collector.responses], collector.audio_bytes
 
 
 def build_stream_input(args, session_id, selector_dict):
@@ -148,23 +179,13 @@ def build_stream_input(args, session_id, selector_dict):
                         library=selector_dict.get('library'),
                         language=selector_dict.get('language'))
 
-    try:
-        with open(args.audioFile, mode='rb') as file:
-            audio_buffer = file.read()
-
-        # Hard code packet_size_byte for simplicity sake (approximately 100ms of 16KHz mono audio)
-        packet_size_byte = 3217
-        audio_size = sys.getsizeof(audio_buffer)
-        audio_packets = [audio_buffer[x:x + packet_size_byte] for x in range(0, audio_size, packet_size_byte)]
-
-        # For simplicity sake, let's assume the audio file is PCM 16KHz
+    if getattr(args, "audioFile", None):
+        # sample rate, encoding and packet size come from the WAV header
+        source = get_audio_source(args.audioFile)
         user_input = None
-        asr_control_v1 = {'audio_format': {'pcm': {'sample_rate_hz': 16000}}}
-
-    except:
+    else:
         # Text interpretation as normal
-        asr_control_v1 = None
-        audio_packets = [b'']
+        source = None
         user_input = UserInput(user_text=args.textInput)
 
     # Build execute request object
@@ -172,26 +193,7 @@ def build_stream_input(args, session_id, selector_dict):
     execute_request = ExecuteRequest(session_id=session_id,
                                      selector=selector,
                                      payload=execute_payload)
-
-    # For simplicity sake, let's assume the audio file is PCM 16KHz
-    tts_control_v1 = {'audio_params': {'audio_format': {'pcm': {'sample_rate_hz': 16000}}}}
-    first_packet = True
-    for audio_packet in audio_packets:
-        if first_packet:
-            first_packet = False
-
-            # Only first packet should include the request header
-            stream_input = StreamInput(
-                request=execute_request,
-                asr_control_v1=asr_control_v1,
-                tts_control_v1=tts_control_v1,
-                audio=audio_packet
-            )
-            log.debug(f'Stream input initial: {stream_input}')
-        else:
-            stream_input = StreamInput(audio=audio_packet)
-
-        yield stream_input
+    return stream_inputs(execute_request, source, getattr(args, "realtime", 0))
 
 
 def stop_request(stub, session_id=None):
@@ -203,10 +205,134 @@ def stop_request(stub, session_id=None):
     return response, call
 
 
+def read_conversations(lines):
+    'yields (id, turns) per JSON line, a line is a list of user texts or an object with "turns" and an optional "id"'
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            conversation = json.loads(line)
+        except ValueError as e:
+            yield str(number), None, f"line {number} is not valid JSON: {e}"
+            continue
+        if isinstance(conversation, dict):
+            turns = conversation.get("turns")
+            conversation_id = str(conversation.get("id", number))
+        else:
+            turns = conversation
+            conversation_id = str(number)
+        if not isinstance(turns, list):
+            yield conversation_id, None, f'line {number} has no list of turns'
+            continue
+        yield conversation_id, [str(turn) for turn in turns], None
+
+
+def turn_prompts(response):
+    'the visual prompts of a response, or the nlg/audio ones when a channel has no visual prompts'
+    for kind in ("visual", "nlg", "audio"):
+        prompts = response.prompts(kind)
+        if prompts:
+            return prompts
+    return []
+
+
+def run_conversation(project_data, model_ref_dict, selector_dict, conversation_id, turns):
+    '''
+    Runs one scripted conversation: the initial prompt, then one Execute per turn while the dialog asks
+    a question. Returns its transcript, errors are part of the transcript.
+    '''
+    started = time.perf_counter()
+    transcript = {"id": conversation_id, "session_id": None, "turns": [], "ended": False, "error": None}
+    try:
+        stub = DialogServiceStub(get_channel(project_data))
+        response, call = start_request(stub, model_ref_dict=model_ref_dict, session_id=None,
+                                       selector_dict=selector_dict)
+        session_id = read_session_id_from_response(response)
+        transcript["session_id"] = session_id
+        try:
+            for user_text in [None] + turns:
+                if user_text is not None and response.action_type != "qaAction":
+                    # the dialog stopped asking, the remaining turns are not sent
+                    break
+                turn_started = time.perf_counter()
+                response, call = execute_request(stub, session_id=session_id, selector_dict=selector_dict,
+                                                 payload_dict={"user_input": {"userText": user_text}})
+                transcript["turns"].append({"input": user_text, "prompts": turn_prompts(response),
+                                            "action": response.action_type,
+                                            "ms": round((time.perf_counter() - turn_started) * 1000, 3)})
+            transcript["ended"] = response.action_type != "qaAction"
+        finally:
+            try:
+                stop_request(stub, session_id)
+            except grpc.RpcError as e:
+                log.debug(f'Stop failed for {session_id}: {e.code()}')
+    except grpc.RpcError as e:
+        transcript["error"] = f'{e.code().name}: {e.details()}'
+    except Exception as e:
+        transcript["error"] = str(e)
+    transcript["ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return transcript
+
+
+def run_batch(args, project_data):
+    '''
+    Runs the conversations of args.batch over the pooled channels, args.concurrency at a time. Conversations are
+    read as they are needed, so a long stdin stream is not held in memory, and each transcript is written by the
+    thread that completed it, while the main thread may still be waiting on input. Returns the number of
+    conversations with an error.
+    '''
+    model_ref_dict = {"uri": project_data["modelUrn"], "type": 0}
+    selector_dict = {"channel": "default", "language": "en-US", "library": "default"}
+    source = sys.stdin if args.batch == "-" else open(args.batch, encoding="utf-8")
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    concurrency = max(args.concurrency, 1)
+    # conversations submitted and not written yet, bounds what is read ahead of the workers
+    slots = threading.BoundedSemaphore(concurrency)
+    lock = threading.Lock()
+    failed = 0
+
+    def write(transcript):
+        nonlocal failed
+        with lock:
+            output.write(json.dumps(transcript, ensure_ascii=False) + "\n")
+            output.flush()
+            if transcript["error"] is not None:
+                failed += 1
+
+    def done(future):
+        try:
+            write(future.result())
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="dlg-batch") as executor:
+            for conversation_id, turns, error in read_conversations(source):
+                if error is not None:
+                    write({"id": conversation_id, "session_id": None, "turns": [], "ended": False,
+                           "error": error, "ms": 0})
+                    continue
+                slots.acquire()
+                executor.submit(run_conversation, project_data, model_ref_dict, selector_dict,
+                                conversation_id, turns).add_done_callback(done)
+    finally:
+        close_channel_pool()
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+    return failed
+
+
 def main():
     args = parse_args()
     project_data = setup_project_config(args.config)
     token = get_token(project_data)
+    if args.batch:
+        # stdout carries the transcripts, only warnings are logged (to stderr)
+        logging.basicConfig(format='%(asctime)s %(levelname)-5s: %(message)s', level=logging.WARNING)
+        failed = run_batch(args, project_data)
+        sys.exit(1 if failed else 0)
     log_level = logging.DEBUG
     logging.basicConfig(
         format='%(asctime)s %(levelname)-5s: %(message)s', level=log_level)
@@ -242,7 +368,15 @@ def main():
                                          )
         assert call.code() == grpc.StatusCode.OK
 
-        while "qaAction" in str(response):
+        if args.audioFile or args.textInput:
+            log.debug('request, streaming user input')
+            responses, audio_bytes = execute_stream_request(args, stub, session_id, selector_dict)
+            log.debug(f'Stream responses: {[str(stream_response) for stream_response in responses]}, '
+                      f'TTS audio: {audio_bytes} bytes')
+            if responses:
+                response = responses[-1]
+
+        while response.action_type == "qaAction":
 
             next_input = ""
             while next_input == "":
@@ -1,22 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from py.xml import html
 import pytest
 from dlg import *
-import jsonschema
+from dlg_auth import close_token_cache
+from dlg_channels import close_channel_pool
+from dlg_logger import close_logger, get_logger
+from dlg_metrics import close_metrics, start_metrics
+from dlg_recorder import close_recording_stores
+from dlg_audio import close_audio_sources
+from dlg_runner import run_parallel
+from dlg_planner import run_plan
+from dlg_pool import get_session_pool, close_session_pools
+from dlg_teardown import close_teardown_manager
+from dlg_cases import get_test_case_repository
+from dlg_results import results_store, run_inputs
+from dlg_matrix import matrix_cells, cell_overrides
+from dlg_shard import DEFAULT_SHARD_DIR, case_shard, load_plan, load_worker_results, parse_shard, \
+    worker_logs_folder, write_worker_results
 import json
-import yaml
 
+# timings of every test case, collected for the summary section of the HTML report
+all_timings = []
+# outcome of every test case with its model and selector, used by --incremental
+case_results = None
+case_inputs = None
+# number of test cases that will draw a session from the session pool
+session_demand = None
+# cells of the matrix in config.json, their run inputs and their outcomes and timings for the report
+matrix = []
+cell_inputs = {}
+cell_summary = {}
+# aggregate outcome of the Stop requests sent in the background, see dlg_teardown
+teardown_summary = None
+# (index, number of shards) when this run is a worker of a distributed run (--shard), and the results it hands over
+shard = None
+shard_results = {}
+
+'''
+This function is a hook function that is called to register command line options.
+It takes one argument:
+- parser: the pytest command line parser.
+This is being used to add --parallel, the number of test cases that are run at the same time,
+--share-prefix to merge test cases with common opening steps,
+--incremental/--force-full to only rerun the test cases that changed since they last passed,
+and --shard/--shard-dir/--shard-merge to run the suite across worker processes or hosts (see dlg_shard)
+'''
+def pytest_addoption(parser):
+    parser.addoption("--parallel", action="store", type=int, default=0,
+                     help="run the YAML test cases concurrently with this many dialog sessions")
+    parser.addoption("--share-prefix", action="store_true", default=False,
+                     help="merge test cases with common opening steps into a prefix tree of runs")
+    parser.addoption("--incremental", action="store_true", default=False,
+                     help="skip test cases that passed last time with the same content, modelUrn and selector")
+    parser.addoption("--force-full", action="store_true", default=False,
+                     help="run every test case even when --incremental is set")
+    parser.addoption("--shard", action="store", default=None,
+                     help="i/N, only run the test cases of shard i of N and hand the results over in --shard-dir")
+    parser.addoption("--shard-dir", action="store", default=DEFAULT_SHARD_DIR,
+                     help="directory shared by the coordinator and the workers of a distributed run")
+    parser.addoption("--shard-merge", action="store_true", default=False,
+                     help="report the results the workers left in --shard-dir instead of running the test cases")
+
+'''
+This is a function that is used to get the path of the config.json file next to this conftest
+'''
+def config_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
 
 '''
 This function is a hook function that is called after collecting tests in pytest.
 It modifies the test items collected by pytest, however for the purpose of this script we are only
 checking that the user is running pytest from the correct folder.
+With --incremental, test cases whose content, modelUrn and selector did not change since they last passed are skipped.
+With --shard i/N, the test cases the plan of the coordinator gives to other shards are deselected.
 '''
-def pytest_collection_modifyitems(items):
+def pytest_collection_modifyitems(config, items):
     ini_file = os.path.join(os.getcwd(), 'pytest.ini')
     if not os.path.isfile(ini_file):
         pytest.exit('pytest.ini file not found, tests will not run')
 
+    if shard is not None:
+        index, shards = shard
+        plan = load_plan(config.getoption("--shard-dir"), shards)
+        kept, deselected = [], []
+        for item in items:
+            test_case = test_case_of(item)
+            if test_case is None or case_shard(plan, test_case.get("name"), shards) == index:
+                kept.append(item)
+            else:
+                deselected.append(item)
+        if deselected:
+            config.hook.pytest_deselected(items=deselected)
+            items[:] = kept
+
+    if config.getoption("--incremental") and not config.getoption("--force-full") and case_inputs \
+            and not config.getoption("--shard-merge"):
+        skip_unchanged = pytest.mark.skip(reason="unchanged since last pass (--incremental)")
+        for item in items:
+            test_case = test_case_of(item)
+            if test_case is not None and case_results.is_unchanged(test_case, inputs_of(item), cell_name_of(item)):
+                item.add_marker(skip_unchanged)
+
+'''
+This function is a hook function that is called when collecting a test function to parametrize it.
+It takes one argument:
+- metafunc: the object describing the test function being collected.
+This is being used to run every YAML test case once per cell when config.json has a matrix
+'''
+def pytest_generate_tests(metafunc):
+    if "cell" in metafunc.fixturenames and matrix:
+        metafunc.parametrize("cell", matrix, ids=[cell["name"] for cell in matrix])
+
+'''
+This function is a hook function that is called after collection has been performed and modified.
+It takes one argument:
+- session: the pytest session object, session.items are the tests that will run.
+This is being used to count the test cases that will run serially, so the session pool does not start more
+sessions than needed
+'''
+def pytest_collection_finish(session):
+    global session_demand
+    if session.config.getoption("--parallel") or session.config.getoption("--share-prefix") or matrix \
+            or session.config.getoption("--shard-merge"):
+        session_demand = 0
+    else:
+        session_demand = len([item for item in session.items
+                              if test_case_of(item) is not None and not item.get_closest_marker("skip")])
+
+'''
+This is a function that returns the YAML test case of a parametrized test item, or None for other tests
+'''
+def test_case_of(item):
+    callspec = getattr(item, "callspec", None)
+    if callspec is None:
+        return None
+    return callspec.params.get("test_cases")
+
+'''
+These are functions that return the matrix cell of a test item (None without a matrix), its name,
+and the model/selector inputs used by --incremental for it
+'''
+def cell_of(item):
+    callspec = getattr(item, "callspec", None)
+    return callspec.params.get("cell") if callspec is not None else None
+
+def cell_name_of(item):
+    cell = cell_of(item)
+    return cell["name"] if cell else None
+
+def inputs_of(item):
+    cell = cell_of(item)
+    return cell_inputs.get(cell["name"]) if cell else case_inputs
+
 '''
 Link to more notes around this: https://pytest-html.readthedocs.io/en/latest/user_guide.html
 This function is a hook function that is called to add content to the summary section of the HTML report.
@@ -24,10 +160,41 @@ It takes three arguments:
 - prefix: a list of HTML elements that appear before the summary content.
 - summary: the summary content to be added to the report.
 - postfix: a list of HTML elements that appear after the summary content.
-This is just a placholder for today and is not being used.
+This is being used to add a table with the time spent per RPC type (token, connect, Start, Execute, ...)
+across all test cases, including the time spent waiting on the rate limiter and the retried and hedged calls
 '''
 def pytest_html_results_summary(prefix, summary, postfix):
-    prefix.extend([html.p("TBD")])
+    rows = [html.tr([html.th("RPC"), html.th("Count"), html.th("Total (s)"), html.th("Mean (ms)"),
+                     html.th("Max (ms)"), html.th("Throttle wait (s)"), html.th("Retries"), html.th("Hedged")])]
+    for rpc, row in timing_summary(all_timings).items():
+        rows.append(html.tr([html.td(rpc), html.td(row["count"]), html.td(f'{row["total_ms"] / 1000:.2f}'),
+                             html.td(f'{row["mean_ms"]:.1f}'), html.td(f'{row["max_ms"]:.1f}'),
+                             html.td(f'{row["wait_ms"] / 1000:.2f}'), html.td(row["retries"]),
+                             html.td(row["hedged"])]))
+    prefix.extend([html.h2("Timings"), html.table(rows)])
+    if teardown_summary:
+        prefix.append(html.p(teardown_text(teardown_summary)))
+    if cell_summary:
+        prefix.extend([html.h2("Matrix"), matrix_table()])
+
+'''
+This is a function that builds the side by side table of the matrix cells for the summary section:
+outcomes, mean Start and Execute time and the total time of the dialog RPCs of each cell
+'''
+def matrix_table():
+    rows = [html.tr([html.th("Cell"), html.th("Passed"), html.th("Failed"), html.th("Skipped"),
+                     html.th("Start mean (ms)"), html.th("Execute mean (ms)"), html.th("Execute max (ms)"),
+                     html.th("Total (s)")])]
+    for name, cell in cell_summary.items():
+        rpcs = timing_summary(cell["timings"])
+        start = rpcs.get("Start", {})
+        execute = rpcs.get("Execute", {})
+        total_ms = sum(row["total_ms"] for row in rpcs.values())
+        rows.append(html.tr([html.td(name), html.td(cell["passed"]), html.td(cell["failed"]),
+                             html.td(cell["skipped"]), html.td(f'{start.get("mean_ms", 0):.1f}'),
+                             html.td(f'{execute.get("mean_ms", 0):.1f}'), html.td(f'{execute.get("max_ms", 0):.1f}'),
+                             html.td(f'{total_ms / 1000:.2f}')]))
+    return html.table(rows)
 
 '''
 This function is a hook function that is called to set the title of the HTML report.
@@ -41,7 +208,9 @@ def pytest_html_report_title(report):
 This function is a hook function that is called at the beginning of the pytest run to configure options and plugins.
 It takes one argument:
 - config: the configuration object that is used to configure pytest.
-This is being used to set the report directory and to rename the report file with a timestamp
+This is being used to set the report directory and to rename the report file with a timestamp,
+a worker of a distributed run writes its report and its dialog log to the shard directory instead.
+It also starts the metrics endpoint and snapshot file when the config asks for them
 '''
 def pytest_configure(config):
     # create logs folder
@@ -54,6 +223,84 @@ def pytest_configure(config):
     report_path = os.path.join(report_dir, report_name)
     config.option.htmlpath = report_path
 
+    # load the results of the previous runs and the model/selector of this one, and of each matrix cell
+    global case_results, case_inputs, matrix, shard
+    case_results = results_store()
+    if config.getoption("--shard"):
+        shard = parse_shard(config.getoption("--shard"))
+        config.option.htmlpath = os.path.join(config.getoption("--shard-dir"), f"worker-{shard[0] + 1}.html")
+    if os.path.exists(config_path()):
+        setup = session_start(config_path())
+        setup.get_setup_data()
+        if setup.project_data:
+            case_inputs = run_inputs(setup.project_data)
+        if shard is not None:
+            # the logger is created once, by its first caller
+            get_logger(worker_logs_folder(config.getoption("--shard-dir"), shard[0]), setup.project_data)
+        if setup.project_data:
+            start_metrics(setup.project_data, shard[0] if shard is not None else None)
+        matrix = matrix_cells(config_path())
+        for cell in matrix:
+            setup = session_start(config_path(), cell["overrides"])
+            setup.get_setup_data()
+            if setup.project_data:
+                cell_inputs[cell["name"]] = run_inputs(setup.project_data)
+
+'''
+This function is a hook function that is called after the whole test run finished, before the reports are written.
+It takes two arguments:
+- session: the pytest session object.
+- exitstatus: the status pytest will return to the system.
+This is being used to stop the sessions of the session pool and to wait for every Stop request still running in the
+background, so no session is left open on the server and the stop failures can be reported.
+A worker of a distributed run then hands its results over to the coordinator in the shard directory
+'''
+@pytest.hookimpl(tryfirst=True)
+def pytest_sessionfinish(session, exitstatus):
+    global teardown_summary
+    close_session_pools()
+    teardown_summary = close_teardown_manager() or teardown_summary
+    if shard is not None:
+        write_worker_results(session.config.getoption("--shard-dir"), shard[0], shard_results, teardown_summary)
+
+'''
+This is a function that describes the aggregate outcome of the background Stop requests in one line
+'''
+def teardown_text(summary):
+    return (f'Sessions stopped: {summary["stopped"]}, already ended: {summary["already_ended"]}, '
+            f'failed to stop: {len(summary["failed"])}')
+
+'''
+This function is a hook function that is called to add a section to the terminal summary.
+It takes three arguments:
+- terminalreporter: the internal terminal reporter object.
+- exitstatus: the exit status that will be reported back to the OS.
+- config: the pytest config object.
+This is being used to report the sessions that could not be stopped, in aggregate
+'''
+def pytest_terminal_summary(terminalreporter, exitstatus, config):
+    if teardown_summary:
+        terminalreporter.write_line(teardown_text(teardown_summary))
+        for failure in teardown_summary["failed"][:10]:
+            terminalreporter.write_line(f'  {failure["session_id"]}: {failure["error"]}')
+
+'''
+This function is a hook function that is called once at the end of the pytest run.
+It takes one argument:
+- config: the configuration object that is used to configure pytest.
+This is being used to save the test case results (a worker leaves that to the merge run), close the pooled gRPC channels, stop the background token refresh,
+close the shared auth connection pool, the recording stores, write the last metrics snapshot and flush the background logger
+'''
+def pytest_unconfigure(config):
+    if case_results is not None and shard is None:
+        case_results.save()
+    close_channel_pool()
+    close_token_cache()
+    close_recording_stores()
+    close_audio_sources()
+    close_metrics()
+    close_logger()
+
 '''
 This function is a hook function that is called to add content to the table header of the HTML report.
 It takes one argument:
@@ -71,31 +318,81 @@ This function is a hook function that is called to add content to a row in the r
 It takes two arguments:
 - report: the report object that represents the test report for the current item.
 - cells: a list of HTML elements that represent the cells in the current row.
-This is being used to update the Session ID & Time col
+This is being used to update the Session ID & Time col, Time is the total time in seconds spent in
+the token fetch, connect and dialog RPCs of the test case
 '''
 def pytest_html_results_table_row(report, cells):
     cells.insert(2, html.td(report.test_description))
     cells.insert(3, html.td(report.session_id))
-    cells.insert(4, html.td(datetime.utcnow(), class_="col-time"))
+    total_ms = sum(timing["ms"] for timing in report.timings)
+    cells.insert(4, html.td(f'{total_ms / 1000:.3f}', class_="col-time"))
     cells.pop()
 
+'''
+This function is a hook function that is called to add content to the collapsible details of a row in the HTML report.
+It takes two arguments:
+- report: the report object that represents the test report for the current item.
+- data: a list of HTML elements shown when the row is expanded.
+This is being used to add the per step timing breakdown of the test case
+'''
+def pytest_html_results_table_html(report, data):
+    if report.timings:
+        rows = [html.tr([html.th("Step"), html.th("RPC"), html.th("Time (ms)"), html.th("Throttle wait (ms)"),
+                         html.th("Retries")])]
+        for timing in report.timings:
+            retries = timing.get("retries", 0)
+            rows.append(html.tr([html.td(timing["step"]), html.td(timing["rpc"]),
+                                 html.td(f'{timing["ms"]:.1f}'), html.td(f'{timing["wait_ms"]:.1f}'),
+                                 html.td(f'{retries} (hedged)' if timing.get("hedged") else retries)]))
+        data.append(html.table(rows))
+
 '''
 This function is a hook function that is called to create a report object for each test item and its call.
 It takes two arguments:
 - item: the test item object that represents the item being tested.
 - call: the call object that represents the call to the test item.
-This is being used to retrieve the Session ID & modelUrn 
+This is being used to retrieve the Session ID, modelUrn & timings, and to record the outcome of each test case,
+a worker of a distributed run also keeps them for the merge run. They are attributes of the test item, set by the
+session fixture or by test_, so a skipped item has none of them
 '''
 @pytest.hookimpl(hookwrapper=True)
 def pytest_runtest_makereport(item, call):
     outcome = yield
     report = outcome.get_result()
-    session = getattr(item.function, 'session', None)
+    session = getattr(item, 'dlg_session_id', None)
     report.session_id = str(session)
-    modelUrn = getattr(item.function, 'modelUrn', None)
+    modelUrn = getattr(item, 'dlg_modelUrn', None)
     report.modelUrn = str(modelUrn)
-    test_description = getattr(item.function, 'test_description', None)
+    test_description = getattr(item, 'dlg_description', None)
     report.test_description = str(test_description)
+    report.timings = list(getattr(item, 'dlg_timings', None) or [])
+    cell = cell_name_of(item)
+    if cell is not None:
+        summary = cell_summary.setdefault(cell, {"passed": 0, "failed": 0, "skipped": 0, "timings": []})
+    if report.when == "teardown":
+        # sessions are stopped in the background, their Stop is not part of the test case
+        all_timings.extend(report.timings)
+        if cell is not None:
+            summary["timings"].extend(report.timings)
+    if cell is not None and (report.when == "call" or (report.when == "setup" and not report.passed)):
+        summary[report.outcome] += 1
+
+    test_case = test_case_of(item)
+    if test_case is not None and inputs_of(item) and not report.skipped \
+            and (report.when == "call" or (report.when == "setup" and report.failed)):
+        case_results.record(test_case, inputs_of(item), report.outcome, report.session_id, cell,
+                            sum(timing["ms"] for timing in report.timings))
+
+    if shard is not None and test_case is not None \
+            and (report.when == "call" or (report.when == "setup" and not report.passed)):
+        skipped = report.skipped and isinstance(report.longrepr, tuple)
+        shard_results[item.nodeid] = {"outcome": report.outcome,
+                                      "error": report.longreprtext if report.failed else None,
+                                      "skip_reason": report.longrepr[2] if skipped else None,
+                                      "description": test_description,
+                                      "session_id": session,
+                                      "modelUrn": modelUrn,
+                                      "timings": report.timings}
 
 '''
 This fixture function returns a session object that is used to run tests.
@@ -104,56 +401,71 @@ It takes two arguments:
 - setup_config: a fixture function that sets up the test configuration and returns a tuple with two elements:
      - config: the test configuration object.
      - json_valid: a boolean flag that indicates whether the test configuration is valid or not.
-This function is being used to start the Mix session and yield the session to the test case being run 
+This function is being used to take a started Mix session from the session pool (see dlg_pool) and yield it
+to the test case being run, the pool starts the next sessions in the background. Once the test case is done the
+session is handed to the teardown manager, so its Stop overlaps with the next test case
 '''
 @pytest.fixture(scope='function')
-def session(request, setup_config):
+def session(request, setup_config, cell):
     config, json_valid = setup_config
-    with session_start(config) as session:
-        setattr(request.function, 'session', session.session_id)
-        setattr(request.function, 'modelUrn', session.project_data["modelUrn"])
-        yield session
+    session = get_session_pool(config, session_demand, cell_overrides(cell)).acquire()
+    setattr(request.node, 'dlg_session_id', session.session_id)
+    setattr(request.node, 'dlg_modelUrn', session.project_data["modelUrn"] if session.project_data else None)
+    setattr(request.node, 'dlg_timings', session.timings)
+    yield session
+    # the Stop runs in the background, it is not part of the timings of the test case
+    setattr(request.node, 'dlg_timings', list(session.timings))
+    session.__exit__(None, None, None)
 
 '''
-This is a function that is used to validate yaml test case
-It takes two arguments:
-- file_path: the pat to the test case
-This function returns true if the test case has a valid test case schema
-'''
-def validate_test_cases_yaml_schema(file_path):
-    # Read YAML data from file
-    with open(file_path, 'r') as f:
-        yaml_data = yaml.safe_load(f)
-        json_data = json.dumps(yaml_data)
-
-    # Test Case format JSON schema
-    schema = {
-        "type": "object",
-        "properties": {
-            "test_cases": {
-                "type": "array",
-                "minItems": 1,
-                "items": {
-                    "type": "object",
-                    "properties": {
-                        "name": {"type": "string"},
-                        "description": {"type": "string"},
-                        "steps": {"type": "array", "minItems": 1}
-                    },
-                    "required": ["name", "description", "steps"]
-                }
-            }
-        },
-        "required": ["test_cases"]
-    }
-
-    # Validate YAML test cases against expected schema
-    try:
-        jsonschema.validate(json.loads(json_data), schema)
-        valid_test_file = True
-    except yaml.YAMLError as e:
-        valid_test_file = False
-    return valid_test_file
+This fixture function returns the matrix cell ({"name", "overrides"}) a test case is run against.
+Without a matrix in config.json it is None, with one the test cases are parametrized by pytest_generate_tests
+'''
+@pytest.fixture(scope='function')
+def cell():
+    return None
+
+'''
+This fixture function runs every collected YAML test case up front when pytest is started with --parallel N
+(concurrently, N dialog sessions at a time) or --share-prefix (test cases merged into a prefix tree of steps,
+see dlg_planner), and always when config.json has a matrix, so the cells run side by side (one session per cell
+at a time unless --parallel is given). It returns a dict of results keyed by test node id (description,
+session id, modelUrn, timings and the error if the case failed), or None when running serially.
+With --shard-merge nothing is run, the results are the ones the workers left in the shard directory.
+'''
+@pytest.fixture(scope='session')
+def parallel_results(request, setup_config):
+    if request.config.getoption("--shard-merge"):
+        global teardown_summary
+        results, teardown_summary = load_worker_results(request.config.getoption("--shard-dir"))
+        missing = {"outcome": "failed", "error": "no result from any worker", "description": None,
+                   "session_id": None, "modelUrn": None, "timings": []}
+        return {item.nodeid: results.get(item.nodeid, missing)
+                for item in request.session.items if test_case_of(item) is not None}
+    workers = request.config.getoption("--parallel")
+    share_prefix = request.config.getoption("--share-prefix")
+    if not workers and not share_prefix and not matrix:
+        return None
+    config, json_valid = setup_config
+    items = [item for item in request.session.items
+             if test_case_of(item) is not None and not item.get_closest_marker("skip")]
+    if share_prefix:
+        # one plan per cell, the cells are planned and run concurrently
+        groups = {}
+        for item in items:
+            groups.setdefault(cell_name_of(item), []).append(item)
+
+        def run_group(group):
+            return run_plan(config, [test_case_of(item) for item in group], workers or 1,
+                            cell_overrides(cell_of(group[0])))
+
+        with ThreadPoolExecutor(max_workers=max(len(groups), 1), thread_name_prefix="dlg-cell") as executor:
+            group_results = list(executor.map(run_group, groups.values()))
+        return {item.nodeid: result for group, results in zip(groups.values(), group_results)
+                for item, result in zip(group, results)}
+    results = run_parallel(config, [test_case_of(item) for item in items], workers or len(matrix),
+                           [cell_overrides(cell_of(item)) for item in items])
+    return {item.nodeid: result for item, result in zip(items, results)}
 
 '''
 This fixture function sets up the test configuration and returns a tuple with two elements:
@@ -162,8 +474,7 @@ This fixture function sets up the test configuration and returns a tuple with tw
 '''
 @pytest.fixture(scope='session')
 def setup_config():
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    config = os.path.join(current_dir, "config.json")
+    config = config_path()
     json_valid = False
     if not os.path.exists(config):
         raise ValueError(f"Config file {config} does not exist")
@@ -187,24 +498,9 @@ def check_setup():
     if not os.path.exists(folder_path_config):
         pytest.exit(f"Config not found: {folder_path_config}")
 
-    yaml_files = []
-    valid_test_file = False
-    error_msg = ""
-    file_with_error = ""
-    for file_name in os.listdir(folder_path_test_cases):
-        if file_name.lower().endswith(".yaml") or file_name.lower().endswith(".yml"):
-            file_path = os.path.join(folder_path_test_cases, file_name)
-            try:
-                with open(file_path) as f:
-                    yaml.safe_load(f)
-                    valid_test_file = validate_test_cases_yaml_schema(file_path)
-            except Exception as e:
-                error_msg = e
-                file_with_error = file_path
-                valid_test_file = False
-                break
-            yaml_files.append(file_path)
-
-    if valid_test_file == False:
+    repository = get_test_case_repository(folder_path_test_cases)
+    errors = repository.errors()
+    if not repository.load() or errors:
+        file_with_error, error_msg = errors[0] if errors else ("", "")
         pytest.exit(
             f"Invalid test case file(s) \n Searched folder: {folder_path_test_cases} \n File with issue: {file_with_error} \n Exiting with error: {error_msg}")
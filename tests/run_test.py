@@ -1,6 +1,8 @@
 from dlg import *
+from dlg_runner import run_test_case
+from dlg_matcher import compile_steps
+from dlg_cases import get_test_case_repository
 import pytest
-import yaml
 
 '''
 Base test case that is used to validate the project setup before running any test cases
@@ -9,32 +11,21 @@ Base test case that is used to validate the project setup before running any tes
 def test_check_project_setup(setup_config, check_setup):
     pass
 
-''' 
-Fucntion is required to process safe_load() without converting certain string values like "true", "false", "yes", "no", etc. to boolean type
-This custom constructor function removes the conversion of "true", "false", "yes", "no" to boolean and returns the actual string
-'''
-def boolean_as_string_constructor(loader, node):
-    value = loader.construct_scalar(node)
-    return value
-
 '''
 Function that retrieves all test cases from the ./tests/test_cases/ folder.
 If the function is called with the argument "tests", it returns a list of all test cases.
 If the function is called with any other argument, it returns a list of strings containing the names of all test cases.
+The files are parsed once by the test case repository and shared by both calls and the setup check.
 '''
 def get_test_items(type):
     test_cases = []
     test_cases_names = []
     test_folder = "./tests/test_cases/"
     try:
-        for filename in os.listdir(test_folder):
-            if filename.lower().endswith(".yaml") or filename.lower().endswith(".yml"):
-                yaml.SafeLoader.add_constructor('tag:yaml.org,2002:bool', boolean_as_string_constructor)
-                with open(os.path.join(test_folder, filename)) as f:
-                    data = yaml.safe_load(f)
-                    for test_case in data['test_cases']:
-                        test_cases.append(test_case)
-                        test_cases_names.append(str(test_case['name']) + ".")
+        for test_case in get_test_case_repository(test_folder).test_cases():
+            compile_steps(test_case.get('steps') or [])
+            test_cases.append(test_case)
+            test_cases_names.append(str(test_case['name']) + ".")
     except:
         pass
     if type == "tests":
@@ -43,44 +34,38 @@ def get_test_items(type):
         return test_cases_names
 
 '''
-Main test case that is used to read all test cases and run them one by one
+Main test case that is used to read all test cases and run them one by one.
+When pytest is started with --parallel N or --share-prefix, or config.json has a matrix (the test cases are
+then run once per cell), the test cases were already run by the parallel_results fixture and this only
+reports the stored outcome of the current case, for --share-prefix also the test case whose run it passed in
+when its steps were not replayed. With --shard-merge the stored outcomes are the ones of the
+workers of a distributed run (see dlg_shard), their errors are the text of the worker report.
 '''
 @pytest.mark.dependency(depends=["test_check_project_setup"])
 @pytest.mark.parametrize("test_cases", get_test_items("tests"), ids=get_test_items("names"))
-def test_(session, test_cases):
-    if session.session_started:
-        for item, value in test_cases.items():
-            'loop through each test case item'
-            if item  =="description":
-                setattr(test_, 'test_description', value)
-            if item == "userData":
-                data = {}
-                data["userData"] = value
-                session.update_request(data)
-            if item == "steps":
-                test_text = []
-                test_action = []
-                start_node = True
-                for step in value:
-                    if isinstance(step, dict):
-                        text, action = next(iter(step.items()))
-                        action = str(action)
-                    else:
-                        text = str(step)
-                        action = str("empty_combine_with_next_step")
-                    if start_node == True:
-                        start_node = False
-                        test_text.append(text)
-                        test_action.append(None)
-                        test_action.append(action)
-                    else:
-                        test_text.append(text)
-                        test_action.append(action)
+def test_(request, test_cases, cell, parallel_results):
+    if parallel_results is not None:
+        result = parallel_results[request.node.nodeid]
+        description = result["description"]
+        if result.get("inherited_from"):
+            # --share-prefix: the steps of this case passed in the run of a longer one
+            description = f'{description} (passed in the run of "{result["inherited_from"]}")'
+        setattr(request.node, 'dlg_description', description)
+        setattr(request.node, 'dlg_session_id', result["session_id"])
+        setattr(request.node, 'dlg_modelUrn', result["modelUrn"])
+        setattr(request.node, 'dlg_timings', result["timings"])
+        if result.get("outcome") == "skipped":
+            pytest.skip(result.get("skip_reason") or "skipped by the shard worker")
+        if isinstance(result["error"], str):
+            pytest.fail(result["error"], pytrace=False)
+        if result["error"] is not None:
+            raise result["error"]
+        return
 
-                for action, text in zip(test_action, test_text):
-                    if action != "empty_combine_with_next_step":
-                        session.execute_request(action, text)
-                    else:
-                        assert_dlg(text,session.response)
+    session = request.getfixturevalue("session")
+    if session.session_started:
+        if "description" in test_cases:
+            setattr(request.node, 'dlg_description', test_cases["description"])
+        run_test_case(session, test_cases)
     else:
         pytest.exit(f"Failed to start Mix session: {session.response}")
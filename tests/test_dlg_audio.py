@@ -0,0 +1,84 @@
+import struct
+import time
+import pytest
+from dlg_audio import WAVE_FORMAT_ALAW, WAVE_FORMAT_PCM, audio_source
+
+'''
+Unit tests of the memory mapped audio source: WAV header parsing and the size and pacing of the packets.
+'''
+
+
+def wav_bytes(data, sample_rate=16000, channels=1, bits=16, format_tag=WAVE_FORMAT_PCM, extra_chunk=b""):
+    block_align = channels * bits // 8
+    fmt = struct.pack("<HHIIHH", format_tag, channels, sample_rate, sample_rate * block_align, block_align, bits)
+    chunks = b"fmt " + struct.pack("<I", len(fmt)) + fmt
+    if extra_chunk:
+        chunks += b"LIST" + struct.pack("<I", len(extra_chunk)) + extra_chunk + b"\0" * (len(extra_chunk) & 1)
+    chunks += b"data" + struct.pack("<I", len(data)) + data
+    return b"RIFF" + struct.pack("<I", 4 + len(chunks)) + b"WAVE" + chunks
+
+
+@pytest.fixture
+def write_audio(tmp_path):
+    sources = []
+
+    def write(content, packet_ms=100, name="audio.wav"):
+        path = tmp_path / name
+        path.write_bytes(content)
+        source = audio_source(str(path), packet_ms)
+        sources.append(source)
+        return source
+
+    yield write
+    for source in sources:
+        source.close()
+
+
+def test_pcm_header(write_audio):
+    data = bytes(range(256)) * 25
+    source = write_audio(wav_bytes(data, sample_rate=8000))
+    assert source.encoding == "pcm"
+    assert source.sample_rate == 8000
+    assert source.audio_format() == {"pcm": {"sample_rate_hz": 8000}}
+    # 100 ms of 8 kHz 16 bit mono
+    assert source.packet_size == 1600
+    assert source.duration == pytest.approx(len(data) / 16000)
+    assert b"".join(source.packets()) == data
+
+
+def test_chunks_before_data_are_skipped(write_audio):
+    data = b"\x01\x02" * 4000
+    source = write_audio(wav_bytes(data, extra_chunk=b"odd"))
+    assert source.data_end - source.data_start == len(data)
+    assert b"".join(source.packets()) == data
+
+
+def test_alaw_and_stereo_packet_sizes(write_audio):
+    alaw = write_audio(wav_bytes(b"\x55" * 8000, sample_rate=8000, bits=8, format_tag=WAVE_FORMAT_ALAW),
+                       name="alaw.wav")
+    assert alaw.audio_format() == {"alaw": {}}
+    assert alaw.packet_size == 800
+    stereo = write_audio(wav_bytes(b"\0" * 64000, channels=2), packet_ms=20, name="stereo.wav")
+    assert stereo.packet_size == 16000 * 4 * 20 // 1000
+    assert all(len(packet) % 4 == 0 for packet in stereo.packets())
+
+
+def test_headerless_file_is_16k_pcm(write_audio):
+    source = write_audio(b"\0" * 10000, name="audio.raw")
+    assert (source.encoding, source.sample_rate, source.sample_width) == ("pcm", 16000, 2)
+    packets = list(source.packets())
+    assert [len(packet) for packet in packets] == [3200, 3200, 3200, 400]
+
+
+def test_truncated_data_chunk_ends_with_the_file(write_audio):
+    content = wav_bytes(b"\0" * 3200)[:-1000]
+    source = write_audio(content)
+    assert source.data_end == len(content)
+
+
+def test_realtime_pacing(write_audio):
+    # 0.5 s of audio paced at 5 times real time
+    source = write_audio(wav_bytes(b"\0" * 16000))
+    started = time.monotonic()
+    assert len(list(source.packets(5))) == 5
+    assert 0.07 <= time.monotonic() - started < 0.5
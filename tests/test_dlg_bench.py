@@ -0,0 +1,50 @@
+import argparse
+import json
+from dlg_bench import bench_end_to_end, compare, measure, write_suite
+from dlg_cases import test_case_repository
+
+'''
+Unit tests of the benchmark harness: the shape of the results, the baseline comparison and the generated suites.
+'''
+
+
+def write_baseline(tmp_path, results):
+    path = tmp_path / "baseline.json"
+    path.write_text(json.dumps({"commit": "abc", "results": results}))
+    return str(path)
+
+
+def test_measure_result():
+    calls = []
+    result = measure("append", lambda: calls.append(1), 10, 3, ops=2)
+    # one warm up call before the timed repetitions
+    assert len(calls) == 31
+    assert result["name"] == "append"
+    assert result["unit"] == "us/op"
+    assert (result["number"], result["repeat"]) == (20, 3)
+    assert result["min"] <= result["median"] <= result["max"]
+
+
+def test_compare_flags_slowdowns_above_threshold(tmp_path):
+    baseline = write_baseline(tmp_path, [{"name": "fast", "median": 10.0}, {"name": "slow", "median": 10.0},
+                                         {"name": "end_to_end", "median": None}])
+    results = [{"name": "fast", "median": 11.0}, {"name": "slow", "median": 13.0},
+               {"name": "end_to_end", "median": 50.0}, {"name": "new", "median": 1.0}]
+    assert compare(results, baseline, 0.2) == ["slow"]
+    assert compare(results, baseline, 0.05) == ["fast", "slow"]
+    assert compare(results, baseline, 0.5) == []
+
+
+def test_generated_suite_is_loaded(tmp_path):
+    write_suite(str(tmp_path / "cases"), 250)
+    test_cases = test_case_repository(str(tmp_path / "cases"), cache_folder=None).test_cases()
+    assert len(test_cases) == 250
+    assert len({test_case["name"] for test_case in test_cases}) == 250
+
+
+def test_generated_cases_pass_against_the_mock_server(tmp_path):
+    args = argparse.Namespace(e2e_cases=4, workers=2, prompts=3)
+    result, = bench_end_to_end(args, str(tmp_path))
+    assert result["errors"] == 0
+    assert result["number"] == 4 * 3
+    assert result["rpcs"]["Start"]["count"] == 4
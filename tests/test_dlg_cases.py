@@ -0,0 +1,144 @@
+import datetime
+import json
+import os
+import dlg_cases
+from dlg_cases import test_case_repository
+
+'''
+Unit tests of the test case repository: YAML parsing, schema errors and the on-disk cache.
+'''
+
+SUITE = '''test_cases:
+  - name: confirm order
+    description: yes and no stay strings
+    steps:
+      - "Do you want a coffee?": yes
+      - "Anything else?": no
+      - expect: {tts: true, visual: "Goodbye"}
+        input: "off"
+        idempotent: True
+'''
+
+INVALID = '''test_cases:
+  - name: no steps
+    description: steps are required
+'''
+
+
+def write(folder, name, content):
+    path = os.path.join(folder, name)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def repository(tmp_path):
+    return test_case_repository(str(tmp_path / "cases"), str(tmp_path / "cache"))
+
+
+def test_bool_looking_values_are_strings(tmp_path):
+    os.makedirs(tmp_path / "cases")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    steps = repository(tmp_path).test_cases()[0]["steps"]
+    assert steps[0] == {"Do you want a coffee?": "yes"}
+    assert steps[1] == {"Anything else?": "no"}
+    assert steps[2]["expect"]["tts"] == "true"
+    assert steps[2]["input"] == "off"
+    assert steps[2]["idempotent"] == "True"
+
+
+def test_schema_errors_are_reported_per_file(tmp_path):
+    os.makedirs(tmp_path / "cases")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    invalid = write(tmp_path / "cases", "invalid.yaml", INVALID)
+    write(tmp_path / "cases", "notes.txt", "not a test case")
+    cases = repository(tmp_path)
+    assert [path for path, error in cases.errors()] == [invalid]
+    assert len(cases.load()) == 2
+    assert [test_case["name"] for test_case in cases.test_cases()] == ["no steps", "confirm order"]
+
+
+def test_unchanged_files_are_not_parsed_again(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "cases")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    first = repository(tmp_path).test_cases()
+
+    def fail(content):
+        raise AssertionError("parsed although unchanged")
+
+    monkeypatch.setattr(dlg_cases, "parse_test_case_file", fail)
+    assert repository(tmp_path).test_cases() == first
+
+
+def test_touched_file_with_same_content_is_not_parsed_again(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "cases")
+    path = write(tmp_path / "cases", "suite.yml", SUITE)
+    first = repository(tmp_path).test_cases()
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    monkeypatch.setattr(dlg_cases, "parse_test_case_file", None)
+    assert repository(tmp_path).test_cases() == first
+
+
+def test_changed_file_invalidates_the_cache(tmp_path):
+    os.makedirs(tmp_path / "cases")
+    path = write(tmp_path / "cases", "suite.yml", SUITE)
+    repository(tmp_path).test_cases()
+    write(tmp_path / "cases", "suite.yml", SUITE.replace("confirm order", "confirm the order"))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert [test_case["name"] for test_case in repository(tmp_path).test_cases()] == ["confirm the order"]
+
+
+def test_removed_file_leaves_the_cache(tmp_path):
+    os.makedirs(tmp_path / "cases")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    other = write(tmp_path / "cases", "other.yml", SUITE.replace("confirm order", "other order"))
+    assert len(repository(tmp_path).test_cases()) == 2
+    os.remove(other)
+    assert [test_case["name"] for test_case in repository(tmp_path).test_cases()] == ["confirm order"]
+
+
+def test_cache_version_change_reparses(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "cases")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    repository(tmp_path).test_cases()
+    parsed = []
+    parse = dlg_cases.parse_test_case_file
+    monkeypatch.setattr(dlg_cases, "CACHE_VERSION", dlg_cases.CACHE_VERSION + 1)
+    monkeypatch.setattr(dlg_cases, "parse_test_case_file", lambda content: parsed.append(1) or parse(content))
+    repository(tmp_path).test_cases()
+    assert parsed == [1]
+
+
+def test_cache_is_json(tmp_path):
+    os.makedirs(tmp_path / "cases")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    repository(tmp_path).test_cases()
+    cache_files = os.listdir(tmp_path / "cache")
+    assert len(cache_files) == 1 and cache_files[0].endswith(".json")
+    with open(tmp_path / "cache" / cache_files[0]) as f:
+        cache = json.load(f)
+    assert cache["version"] == dlg_cases.CACHE_VERSION
+    assert list(cache["files"]) == [str(tmp_path / "cases" / "suite.yml")]
+
+
+def test_other_folder_keeps_its_own_cache(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / "cases")
+    os.makedirs(tmp_path / "other")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    write(tmp_path / "other", "other.yml", SUITE.replace("confirm order", "other order"))
+    first = repository(tmp_path).test_cases()
+    test_case_repository(str(tmp_path / "other"), str(tmp_path / "cache")).test_cases()
+    monkeypatch.setattr(dlg_cases, "parse_test_case_file", None)
+    assert repository(tmp_path).test_cases() == first
+
+
+def test_values_json_cannot_keep_are_parsed_again(tmp_path):
+    os.makedirs(tmp_path / "cases")
+    write(tmp_path / "cases", "suite.yml", SUITE)
+    write(tmp_path / "cases", "dated.yml", SUITE.replace("confirm order", "dated order").replace(
+        "input: \"off\"", "input: \"off\"\n        userData: {since: 2024-01-31, 7: seven}"))
+    first = repository(tmp_path).test_cases()
+    assert first[0]["steps"][2]["userData"] == {"since": datetime.date(2024, 1, 31), 7: "seven"}
+    assert repository(tmp_path).test_cases() == first
@@ -0,0 +1,44 @@
+import json
+import dlg_throttle
+from dlg import session_start
+from dlg_load import load_session, load_stats, metrics_config
+from dlg_throttle import session_pause
+
+'''
+Unit tests of the load mode: its sessions are neither paced nor throttled by the config of a test run.
+'''
+
+
+def write_config(tmp_path, **values):
+    path = tmp_path / "config.json"
+    config = {"modelUrn": "urn:nuance-mix:tag:model/coffee/mix.dialog", "serverUrl": "localhost:50051",
+              "insecure": True, "sleep": 1}
+    config.update(values)
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def test_load_session_after_session_start_is_not_throttled(tmp_path, monkeypatch):
+    monkeypatch.setattr(dlg_throttle, "_limiters", {})
+    config = write_config(tmp_path)
+    session_start(config).get_setup_data()
+    session = load_session(config, load_stats())
+    session.get_setup_data()
+    assert session_pause(session.project_data, "Execute") == 0
+    assert session.rate_limiter.rate == 0
+    assert all(session.rate_limiter.acquire() == 0 for _ in range(50))
+
+
+def test_explicit_rate_limit_still_applies(tmp_path, monkeypatch):
+    monkeypatch.setattr(dlg_throttle, "_limiters", {})
+    session = load_session(write_config(tmp_path, rate_limit=20), load_stats())
+    session.get_setup_data()
+    assert session.rate_limiter.rate == 20
+
+
+def test_metrics_config_creates_no_rate_limiter(tmp_path, monkeypatch):
+    monkeypatch.setattr(dlg_throttle, "_limiters", {})
+    config = write_config(tmp_path, metrics_port=9464)
+    assert metrics_config(config) == {"metrics_port": 9464, "metrics_file": None, "metrics_interval_s": None}
+    assert dlg_throttle._limiters == {}
+    assert metrics_config(str(tmp_path / "missing.json")) == {}
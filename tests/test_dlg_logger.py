@@ -0,0 +1,71 @@
+import glob
+import gzip
+import json
+import os
+import pytest
+from dlg_logger import LOG_FILE_NAME, structured_logger
+
+'''
+Unit tests of the background JSON Lines logger: log levels, rotation and compression of rotated files.
+'''
+
+
+def read_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_payload_and_meta_levels(tmp_path):
+    logger = structured_logger(str(tmp_path / "payload"))
+    logger.log("s1", "execute_request", {"text": "order coffee"}, {"payload": {}}, 1, {"ms": 12.5})
+    logger.close()
+    record, = read_lines(str(tmp_path / "payload" / LOG_FILE_NAME))
+    assert record["session_id"] == "s1"
+    assert record["step"] == 1
+    assert record["timing"] == {"ms": 12.5}
+    assert record["request"] == {"text": "order coffee"}
+
+    logger = structured_logger(str(tmp_path / "meta"), level="meta")
+    logger.log("s1", "execute_request", {"text": "order coffee"}, {"payload": {}})
+    logger.close()
+    record, = read_lines(str(tmp_path / "meta" / LOG_FILE_NAME))
+    assert "request" not in record and "response" not in record
+
+
+def test_off_writes_nothing(tmp_path):
+    logger = structured_logger(str(tmp_path), level="off")
+    logger.log("s1", "stop_request", {}, {})
+    logger.close()
+    assert not os.path.exists(tmp_path / LOG_FILE_NAME)
+
+
+def test_rotation_keeps_every_record(tmp_path):
+    logger = structured_logger(str(tmp_path), max_bytes=2000)
+    for index in range(100):
+        logger.log(f"s{index}", "execute_request", {"text": "x" * 50}, {}, index)
+    logger.close()
+    rotated = glob.glob(str(tmp_path / "dlg-*.jsonl"))
+    # the file is rotated after the batch that took it past max_bytes
+    assert rotated
+    steps = [record["step"] for path in rotated + [str(tmp_path / LOG_FILE_NAME)] for record in read_lines(path)]
+    assert sorted(steps) == list(range(100))
+
+
+def test_rotated_files_are_gzipped(tmp_path):
+    logger = structured_logger(str(tmp_path), max_bytes=1000, compression="gzip")
+    for index in range(50):
+        logger.log("s1", "execute_request", {"text": "y" * 50}, {}, index)
+    logger.close()
+    assert not glob.glob(str(tmp_path / "dlg-*.jsonl"))
+    compressed = glob.glob(str(tmp_path / "dlg-*.jsonl.gz"))
+    assert compressed
+    steps = [record["step"] for path in compressed + [str(tmp_path / LOG_FILE_NAME)] for record in read_lines(path)]
+    assert sorted(steps) == list(range(50))
+
+
+def test_invalid_settings():
+    with pytest.raises(ValueError):
+        structured_logger(level="verbose")
+    with pytest.raises(ValueError):
+        structured_logger(compression="lz4")
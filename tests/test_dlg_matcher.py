@@ -0,0 +1,59 @@
+import re
+import pytest
+from dlg import clean_text
+from dlg_matcher import compile_expectation, matches
+
+'''
+Unit tests of dlg_matcher. The compat match mode must give the same answer as the original assert_dlg,
+which searched clean_text(expected) in clean_text(str(response)).
+'''
+
+RESPONSE = {"payload": {"messages": [{"visual": [{"text": "Hello and welcome to the coffee app!"}]}],
+                        "qaAction": {"message": {"nlg": [{"text": "What size coffee would you like?"}]},
+                                     "data": {"menu": "espresso, latte"}}}}
+
+COMPAT_CASES = [
+    ("Hello and welcome to the coffee app", RESPONSE),
+    ("hello AND welcome, to the coffee-app!!", RESPONSE),
+    ("What size {*} would you like", RESPONSE),
+    ("{*}coffee{*}", RESPONSE),
+    ("qaAction", RESPONSE),
+    ("espresso", RESPONSE),
+    ("What colour coffee would you like", RESPONSE),
+    ("Goodbye", RESPONSE),
+    ("", RESPONSE),
+    ("Session ended", {"errorMessage": "Session ended: NOT_FOUND error"}),
+    ("price is $4.50 (tax incl.)", "The price is $4.50 (tax incl.) today"),
+    ("price is $5", "The price is $4.50 today"),
+]
+
+
+def baseline_match(expected, response):
+    return re.search(clean_text(str(expected)), clean_text(str(response))) is not None
+
+
+@pytest.mark.parametrize("expected, response", COMPAT_CASES)
+def test_compat_mode_matches_baseline(expected, response):
+    assert matches(expected, response, "compat") == baseline_match(expected, response)
+
+
+@pytest.mark.parametrize("expected", [case[0] for case in COMPAT_CASES])
+def test_compiled_pattern_is_clean_text(expected):
+    assert compile_expectation(expected).pattern.replace("\\", "") == clean_text(expected)
+
+
+def test_fields_mode_only_reads_prompts():
+    assert matches("What size {*} would you like", RESPONSE)
+    assert matches("Hello and welcome", RESPONSE)
+    assert not matches("qaAction", RESPONSE)
+    assert not matches("espresso", RESPONSE)
+    assert matches("qaAction", RESPONSE, "compat")
+
+
+def test_fields_mode_reads_error_messages():
+    assert matches("NOT_FOUND", {"errorMessage": "Session ended: NOT_FOUND error"})
+
+
+def test_unknown_expectation_field():
+    with pytest.raises(ValueError):
+        matches({"colour": "blue"}, RESPONSE)
@@ -0,0 +1,122 @@
+import json
+import logging
+import socket
+import threading
+import urllib.request
+from dlg_metrics import BUCKETS, metrics_exporter, metrics_registry, worker_file
+
+'''
+Unit tests of the metrics registry, its OpenMetrics rendering and its exporter.
+'''
+
+
+class status:
+    def __init__(self, name):
+        self.name = name
+
+
+OK = status("OK")
+UNAVAILABLE = status("UNAVAILABLE")
+
+
+def test_snapshot_sums_the_threads():
+    registry = metrics_registry()
+
+    def work():
+        for index in range(1000):
+            registry.observe("Execute", index % 100, OK)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    snapshot = registry.snapshot()
+    assert snapshot["requests"] == {"Execute": {"OK": 8000}}
+    assert snapshot["latency"]["Execute"]["count"] == 8000
+    assert abs(snapshot["latency"]["Execute"]["sum_s"] - 8 * 10 * sum(range(100)) / 1000) < 1e-6
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics_registry()
+    for ms in (1, 5, 7, 200, 90000):
+        registry.observe("Start", ms, OK)
+    buckets = registry.snapshot()["latency"]["Start"]["buckets"]
+    assert len(buckets) == len(BUCKETS) + 1
+    by_le = dict(zip(BUCKETS + ("+Inf",), buckets))
+    # a latency equal to a bound is counted in that bucket
+    assert by_le[0.005] == 2
+    assert by_le[0.01] == 3
+    assert by_le[0.25] == 4
+    assert by_le[60] == 4
+    assert by_le["+Inf"] == 5
+
+
+def test_token_and_connect_have_no_status():
+    registry = metrics_registry()
+    registry.observe("token", 30)
+    snapshot = registry.snapshot()
+    assert snapshot["requests"] == {}
+    assert snapshot["latency"]["token"]["count"] == 1
+
+
+def test_sessions_closed_on_another_thread():
+    registry = metrics_registry()
+    for _ in range(3):
+        registry.session_opened()
+    thread = threading.Thread(target=registry.session_closed)
+    thread.start()
+    thread.join()
+    registry.token_refreshed()
+    snapshot = registry.snapshot()
+    assert snapshot["active_sessions"] == 2
+    assert snapshot["token_refreshes"] == 1
+
+
+def test_openmetrics_text():
+    registry = metrics_registry()
+    registry.observe("Execute", 20, OK)
+    registry.observe("Execute", 2000, UNAVAILABLE)
+    registry.session_opened()
+    text = registry.openmetrics()
+    lines = text.splitlines()
+    assert 'dlg_rpc_requests_total{rpc="Execute",code="OK"} 1' in lines
+    assert 'dlg_rpc_requests_total{rpc="Execute",code="UNAVAILABLE"} 1' in lines
+    assert 'dlg_rpc_latency_seconds_bucket{rpc="Execute",le="0.025"} 1' in lines
+    assert 'dlg_rpc_latency_seconds_bucket{rpc="Execute",le="+Inf"} 2' in lines
+    assert 'dlg_rpc_latency_seconds_count{rpc="Execute"} 2' in lines
+    assert 'dlg_rpc_latency_seconds_sum{rpc="Execute"} 2.020000' in lines
+    assert "dlg_active_sessions 1" in lines
+    assert "dlg_token_refreshes_total 0" in lines
+    assert text.endswith("# EOF\n")
+
+
+def test_exporter_serves_and_writes_snapshot(tmp_path):
+    registry = metrics_registry()
+    registry.observe("Status", 3, OK)
+    path = str(tmp_path / "metrics.json")
+    exporter = metrics_exporter(registry, 0, path, 60)
+    try:
+        port = exporter.server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("application/openmetrics-text")
+            assert 'dlg_rpc_requests_total{rpc="Status",code="OK"} 1' in response.read().decode()
+    finally:
+        exporter.close()
+    with open(path) as f:
+        assert json.load(f)["requests"] == {"Status": {"OK": 1}}
+
+
+def test_busy_port_is_a_warning(caplog):
+    with socket.socket() as busy:
+        busy.bind(("127.0.0.1", 0))
+        busy.listen()
+        with caplog.at_level(logging.WARNING, logger="dlg_metrics"):
+            exporter = metrics_exporter(metrics_registry(), busy.getsockname()[1])
+        exporter.close()
+    assert exporter.server is None
+    assert "metrics endpoint not started" in caplog.text
+
+
+def test_worker_file():
+    assert worker_file("reports/metrics.json", 1) == "reports/metrics-worker-2.json"
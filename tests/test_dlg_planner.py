@@ -0,0 +1,171 @@
+import pytest
+import dlg_planner
+from dlg_planner import build_plan, execute_run, new_result, shared_step_failure
+
+'''
+Unit tests of the shared-prefix planner: which runs are made and which test cases each run reports.
+'''
+
+
+def case(name, steps, user_data=None):
+    test_case = {"name": name, "description": name}
+    if user_data is not None:
+        test_case["userData"] = user_data
+    test_case["steps"] = steps
+    return test_case
+
+
+def test_prefix_case_is_reported_by_the_longer_run():
+    short = case("short", [{"Welcome": "order coffee"}, "What size"])
+    long = case("long", [{"Welcome": "order coffee"}, {"What size": "large"}, "Perfect"])
+    runs = build_plan([short, long])
+    assert len(runs) == 1
+    assert runs[0].pairs == [(None, "Welcome"), ("order coffee", "What size"), ("large", "Perfect")]
+    assert sorted(runs[0].cases) == [(0, 2), (1, 3)]
+
+
+def test_diverging_cases_get_one_run_each():
+    small = case("small", [{"Welcome": "order coffee"}, {"What size": "small"}, "Perfect"])
+    large = case("large", [{"Welcome": "order coffee"}, {"What size": "large"}, "Perfect"])
+    runs = build_plan([small, large])
+    assert len(runs) == 2
+    assert [run.cases for run in runs] == [[(0, 3)], [(1, 3)]]
+    # the shared prefix is the same node in both runs, so a failure there is seen by both
+    assert runs[0].nodes[:2] == runs[1].nodes[:2]
+    assert runs[0].nodes[2] is not runs[1].nodes[2]
+
+
+def test_case_ending_on_a_branch_point_is_reported_once():
+    prefix = case("prefix", [{"Welcome": "order coffee"}, "What size"])
+    small = case("small", [{"Welcome": "order coffee"}, {"What size": "small"}, "Perfect"])
+    large = case("large", [{"Welcome": "order coffee"}, {"What size": "large"}, "Perfect"])
+    runs = build_plan([prefix, small, large])
+    reported = [index for run in runs for index, end in run.cases]
+    assert sorted(reported) == [0, 1, 2]
+
+
+def test_user_data_splits_the_tree():
+    steps = [{"Welcome": "order coffee"}, "What size"]
+    runs = build_plan([case("gold", steps, {"tier": "gold"}), case("basic", steps, {"tier": "basic"}),
+                       case("gold again", steps, {"tier": "gold"})])
+    assert len(runs) == 2
+    by_user_data = {run.pairs[0][0]["update"]["userData"]["tier"]: sorted(index for index, end in run.cases)
+                    for run in runs}
+    assert by_user_data == {"gold": [0, 2], "basic": [1]}
+
+
+def test_user_data_keeps_its_yaml_place():
+    steps = [{"Welcome": "order coffee"}, "What size"]
+    before = case("before", steps, {"tier": "gold"})
+    after = {"name": "after", "description": "after", "steps": steps, "userData": {"tier": "gold"}}
+    plain = case("plain", steps)
+    runs = build_plan([before, after, plain])
+    assert len(runs) == 2
+    update = ({"update": {"userData": {"tier": "gold"}}}, None)
+    assert [run.pairs for run in runs] == [[update, (None, "Welcome"), ("order coffee", "What size")],
+                                           [(None, "Welcome"), ("order coffee", "What size"), update]]
+    # the case without userData ends on the way to the update of the other one
+    assert sorted(runs[1].cases) == [(1, 3), (2, 2)]
+
+
+def test_identical_cases_share_a_run():
+    steps = [{"Welcome": "order coffee"}, "What size"]
+    runs = build_plan([case("a", steps), case("b", steps)])
+    assert len(runs) == 1
+    assert sorted(runs[0].cases) == [(0, 2), (1, 2)]
+
+
+class fake_session:
+    'stands in for session_start, a step fails when its input is "fail"'
+    count = 0
+
+    def __init__(self, config, overrides=None):
+        fake_session.count += 1
+        self.session_id = f"session {fake_session.count}"
+        self.timings = []
+        self.project_data = {"modelUrn": "urn:coffee"}
+        self.session_started = True
+        self.updates = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def update_request(self, data):
+        self.updates.append(data)
+
+
+def fake_step(session, action, text):
+    if action == "fail":
+        raise AssertionError(f"expected {text}")
+
+
+@pytest.fixture
+def planned(monkeypatch):
+    monkeypatch.setattr(dlg_planner, "session_start", fake_session)
+    monkeypatch.setattr(dlg_planner, "run_step", fake_step)
+
+    def run(test_cases, reverse=False):
+        results = [new_result(test_case) for test_case in test_cases]
+        runs = build_plan(test_cases)
+        for plan_run in reversed(runs) if reverse else runs:
+            execute_run(None, plan_run, results)
+        return results
+
+    return run
+
+
+def test_cases_behind_a_failed_step_get_their_own_error(planned):
+    short = case("short", [{"Welcome": "fail"}, "What size"])
+    long = case("long", [{"Welcome": "fail"}, {"What size": "large"}, "Perfect"])
+    other = case("other", [{"Welcome": "fail"}, {"What size": "small"}, "Perfect"])
+    results = planned([short, long, other])
+    assert isinstance(results[0]["error"], AssertionError)
+    errors = [results[1]["error"], results[2]["error"]]
+    assert all(isinstance(error, shared_step_failure) and error.origin == "short" for error in errors)
+    assert errors[0] is not errors[1]
+    assert all(error.__cause__ is results[0]["error"] for error in errors)
+
+
+def test_cases_before_a_failed_step_are_inherited(planned):
+    prefix = case("prefix", [{"Welcome": "order coffee"}, "What size"])
+    pay = case("pay", [{"Welcome": "order coffee"}, {"What size": "fail"}, {"Perfect": "pay"}, "Bye"])
+    cancel = case("cancel", [{"Welcome": "order coffee"}, {"What size": "fail"}, {"Perfect": "cancel"}, "Bye"])
+    # prefix belongs to the run of pay, which is run after cancel failed on the step both share
+    results = planned([pay, prefix, cancel], reverse=True)
+    failed = results[2]
+    assert isinstance(failed["error"], AssertionError)
+    assert results[1]["error"] is None
+    assert results[1]["inherited_from"] == "cancel"
+    assert results[1]["session_id"] == failed["session_id"]
+    assert isinstance(results[0]["error"], shared_step_failure)
+    assert results[0]["error"].origin == "cancel"
+    assert results[0]["inherited_from"] is None
+
+
+def test_cases_of_the_run_itself_are_not_inherited(planned):
+    prefix = case("prefix", [{"Welcome": "order coffee"}, "What size"])
+    pay = case("pay", [{"Welcome": "order coffee"}, {"What size": "fail"}, {"Perfect": "pay"}, "Bye"])
+    cancel = case("cancel", [{"Welcome": "order coffee"}, {"What size": "fail"}, {"Perfect": "cancel"}, "Bye"])
+    results = planned([pay, prefix, cancel])
+    assert results[1]["error"] is None
+    assert results[1]["inherited_from"] is None
+    assert results[1]["session_id"] == results[0]["session_id"]
+    assert isinstance(results[0]["error"], AssertionError)
+    assert isinstance(results[2]["error"], shared_step_failure)
+    assert results[2]["error"].origin == "pay"
+
+
+def test_user_data_is_sent_where_the_yaml_puts_it(planned, monkeypatch):
+    calls = []
+    monkeypatch.setattr(fake_session, "update_request", lambda session, data: calls.append(("update", data)))
+    monkeypatch.setattr(dlg_planner, "run_step", lambda session, action, text: calls.append((action, text)))
+    steps = [{"Welcome": "order coffee"}, "What size"]
+    after = {"name": "after", "description": "after", "steps": steps, "userData": {"tier": "gold"}}
+    planned([after])
+    assert calls == [(None, "Welcome"), ("order coffee", "What size"), ("update", {"userData": {"tier": "gold"}})]
+    calls.clear()
+    planned([case("before", steps, {"tier": "gold"})])
+    assert calls == [("update", {"userData": {"tier": "gold"}}), (None, "Welcome"), ("order coffee", "What size")]
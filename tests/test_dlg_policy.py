@@ -0,0 +1,98 @@
+import asyncio
+import grpc
+import pytest
+from dlg_policy import DEFAULT_DEADLINES, rpc_policy
+
+'''
+Unit tests of the RPC policy: which calls are retried and hedged, the backoff and the deadlines.
+'''
+
+UNAVAILABLE = grpc.StatusCode.UNAVAILABLE
+DEADLINE_EXCEEDED = grpc.StatusCode.DEADLINE_EXCEEDED
+RESOURCE_EXHAUSTED = grpc.StatusCode.RESOURCE_EXHAUSTED
+INVALID_ARGUMENT = grpc.StatusCode.INVALID_ARGUMENT
+
+
+@pytest.mark.parametrize("rpc, code, idempotent, retried", [
+    ("Start", UNAVAILABLE, False, True),
+    ("Start", RESOURCE_EXHAUSTED, False, True),
+    # the session may have been created
+    ("Start", DEADLINE_EXCEEDED, False, False),
+    ("Status", DEADLINE_EXCEEDED, False, True),
+    ("Status", INVALID_ARGUMENT, False, False),
+    ("Execute", UNAVAILABLE, False, False),
+    ("Execute", UNAVAILABLE, True, True),
+    ("Execute", DEADLINE_EXCEEDED, True, True),
+    ("Stop", UNAVAILABLE, False, False),
+])
+def test_should_retry(rpc, code, idempotent, retried):
+    policy = rpc_policy({"rpc_retries": "2"})
+    assert policy.should_retry(rpc, code, 0, idempotent) == retried
+
+
+def test_retries_are_limited():
+    policy = rpc_policy({"rpc_retries": "2"})
+    assert [policy.should_retry("Status", UNAVAILABLE, attempt) for attempt in range(3)] == [True, True, False]
+    assert not rpc_policy({}).should_retry("Status", UNAVAILABLE, 0)
+
+
+def test_backoff_is_bounded():
+    policy = rpc_policy({"retry_backoff_ms": "100", "retry_max_backoff_ms": "300"})
+    for attempt, limit in [(1, 0.1), (2, 0.2), (3, 0.3), (10, 0.3)]:
+        delays = [policy.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= limit for delay in delays)
+        assert max(delays) > limit / 2
+
+
+@pytest.mark.parametrize("rpc, idempotent, delay", [
+    ("Status", False, 0.05),
+    ("Execute", True, 0.05),
+    ("Execute", False, None),
+    ("Start", False, None),
+    ("Start", True, None),
+    ("Stop", False, None),
+])
+def test_hedge_delay(rpc, idempotent, delay):
+    policy = rpc_policy({"hedge_after_ms": "50"})
+    assert policy.hedge_delay(rpc, idempotent) == delay
+    assert rpc_policy({}).hedge_delay(rpc, idempotent) is None
+
+
+@pytest.mark.parametrize("deadlines, expected", [
+    (None, DEFAULT_DEADLINES),
+    ("5", {rpc: 5.0 for rpc in DEFAULT_DEADLINES}),
+    (7, {rpc: 7.0 for rpc in DEFAULT_DEADLINES}),
+    ('{"Execute": 3}', dict(DEFAULT_DEADLINES, Execute=3)),
+    ({"Stop": 1}, dict(DEFAULT_DEADLINES, Stop=1)),
+])
+def test_deadlines(deadlines, expected):
+    policy = rpc_policy({"rpc_deadlines": deadlines})
+    assert {rpc: policy.deadline(rpc) for rpc in DEFAULT_DEADLINES} == expected
+
+
+class fake_call:
+    def __init__(self, response, delay):
+        self.response = response
+        self.delay = delay
+
+    def __await__(self):
+        return self.wait().__await__()
+
+    async def wait(self):
+        await asyncio.sleep(self.delay)
+        return self.response
+
+    async def code(self):
+        return grpc.StatusCode.OK
+
+
+def test_hedged_call_takes_the_first_answer():
+    delays = [1.0, 0.01]
+
+    def method(rpc_request, timeout):
+        return fake_call(f"answer {len(delays)}", delays.pop(0))
+
+    policy = rpc_policy({"hedge_after_ms": "20"})
+    response, code, hedged = asyncio.run(policy.invoke_async(method, None, "Status"))
+    assert (response, code, hedged) == ("answer 1", grpc.StatusCode.OK, True)
+    assert not delays
@@ -0,0 +1,84 @@
+import json
+import socket
+import grpc
+import pytest
+from nuance.dlg.v1.dlg_messages_pb2 import ExecuteRequest, ExecuteResponse
+from google.protobuf.json_format import ParseDict
+from dlg import session_start
+from dlg_mock_server import mock_dialog_service, serve
+from dlg_recorder import exchange_key, normalize_input, recording_store, replay_miss
+
+'''
+Unit tests of record and replay: the keys of the recorded exchanges, replay misses and a replayed session.
+'''
+
+PROJECT = {"modelUrn": "urn:coffee", "channel": "default", "language": "en-US"}
+RESPONSE = {"payload": {"qaAction": {"message": {"visual": [{"text": "What size coffee would you like?"}]}}}}
+SCRIPT = {"initial": {"payload": {"qaAction": {"message": {"visual": [{"text": "Hello and welcome"}]}}}},
+          "responses": {"order coffee": RESPONSE}}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def test_inputs_are_normalized():
+    assert normalize_input("  Order   COFFEE ") == "order coffee"
+    assert normalize_input({"b": 1, "a": [2]}) == normalize_input({"a": [2], "b": 1})
+
+
+@pytest.mark.parametrize("changed", [{"modelUrn": "urn:tea"}, {"channel": "ivr"}, {"language": "fr-CA"}])
+def test_key_depends_on_model_and_selector(changed):
+    path = ["order coffee"]
+    assert exchange_key(PROJECT, "Execute", path) == exchange_key(dict(PROJECT), "Execute", list(path))
+    assert exchange_key(dict(PROJECT, **changed), "Execute", path) != exchange_key(PROJECT, "Execute", path)
+
+
+def test_key_depends_on_rpc_and_path():
+    assert exchange_key(PROJECT, "Execute", ["order coffee"]) != exchange_key(PROJECT, "Update", ["order coffee"])
+    assert exchange_key(PROJECT, "Execute", ["order coffee"]) != exchange_key(PROJECT, "Execute", ["order tea"])
+    assert exchange_key(PROJECT, "Execute", ["a", "b"]) != exchange_key(PROJECT, "Execute", ["b", "a"])
+
+
+def test_recorded_exchange_is_replayed_after_reopening(tmp_path):
+    path = str(tmp_path / "recordings.sqlite")
+    response = ParseDict(RESPONSE, ExecuteResponse())
+    store = recording_store(path)
+    store.record(PROJECT, "Execute", ["order coffee"], ExecuteRequest(session_id="s1"), response)
+    store.close()
+    store = recording_store(path)
+    try:
+        assert store.replay(PROJECT, "Execute", ["order coffee"]) == response
+        with pytest.raises(replay_miss) as miss:
+            store.replay(PROJECT, "Execute", ["order tea"])
+    finally:
+        store.close()
+    assert isinstance(miss.value, grpc.RpcError)
+    assert miss.value.code() == grpc.StatusCode.FAILED_PRECONDITION
+    assert miss.value.path == ["order tea"]
+
+
+def test_session_replays_without_the_server(tmp_path):
+    port = free_port()
+    server, servicer = serve(port, mock_dialog_service(SCRIPT), 4)
+    config = {"serverUrl": f"localhost:{port}", "insecure": True, "modelUrn": "urn:recorder",
+              "teardown_workers": 0, "log_level": "off", "record_file": str(tmp_path / "recordings.sqlite")}
+    config_path = tmp_path / "config.json"
+    try:
+        config_path.write_text(json.dumps(dict(config, record_mode="record")))
+        with session_start(str(config_path)) as session:
+            session.execute_request(None, "Hello and welcome")
+            session.execute_request("Order coffee", "What size coffee")
+    finally:
+        server.stop(0)
+    assert servicer.calls["Execute"] == 2
+
+    config_path.write_text(json.dumps(dict(config, record_mode="replay")))
+    with session_start(str(config_path)) as session:
+        session.execute_request(None, "Hello and welcome")
+        session.execute_request("order  coffee", "What size coffee")
+        with pytest.raises(AssertionError):
+            session.execute_request("order tea", "What size coffee")
+        assert "no recording for Execute" in session.response["RpcError"]
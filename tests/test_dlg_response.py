@@ -0,0 +1,48 @@
+import pytest
+from google.protobuf.json_format import MessageToDict, ParseDict
+from nuance.dlg.v1.dlg_messages_pb2 import ExecuteResponse
+from dlg_matcher import matches
+from dlg_response import dialog_response, dict_prompts
+
+'''
+Unit tests of dialog_response: prompts read from the protobuf message are the ones read from its dict form.
+'''
+
+RESPONSE = {"payload": {"messages": [{"nlg": [{"text": "Hello and welcome"}],
+                                      "audio": [{"text": "Welcome", "ssml": "<speak>Welcome back</speak>"}]}],
+                        "qaAction": {"message": {"visual": [{"text": "What size coffee would you like?"}]},
+                                     "data": {"text": "espresso"}}}}
+
+
+@pytest.fixture
+def responses():
+    message = ParseDict(RESPONSE, ExecuteResponse(), ignore_unknown_fields=True)
+    return dialog_response(message), MessageToDict(message)
+
+
+@pytest.mark.parametrize("kind", [None, "nlg", "visual", "audio"])
+def test_prompts_of_message_and_dict(responses, kind):
+    message, as_dict = responses
+    assert message.prompts(kind) == dict_prompts(as_dict, kind)
+
+
+@pytest.mark.parametrize("expected", [
+    "Hello and welcome",
+    "What size {*} would you like",
+    "Welcome back",
+    "espresso",
+    "qaAction",
+    {"visual": "What size coffee"},
+    {"audio": "Welcome back"},
+    {"nlg": "What size"},
+])
+def test_same_match_on_message_and_dict(responses, expected):
+    message, as_dict = responses
+    assert matches(expected, message) == matches(expected, as_dict)
+
+
+def test_action_data_is_not_a_prompt(responses):
+    message, as_dict = responses
+    assert "espresso" not in message.prompts()
+    assert "espresso" not in dict_prompts(as_dict)
+    assert message.action_type == "qaAction"
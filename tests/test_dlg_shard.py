@@ -0,0 +1,84 @@
+import pytest
+from dlg_shard import TEST_PATH, case_durations, case_shard, load_worker_results, merge_command, parse_shard, \
+    shard_plan, worker_command, write_worker_results
+
+'''
+Unit tests of the shard planning of distributed runs and of the results the workers hand over.
+'''
+
+
+def cases(*names):
+    return [{"name": name} for name in names]
+
+
+def shard_loads(plan, durations, shards):
+    loads = [0] * shards
+    for name, shard in plan.items():
+        loads[shard] += durations[name]
+    return loads
+
+
+def test_longest_cases_go_to_the_least_loaded_shard():
+    durations = {"a": 10, "b": 6, "c": 5, "d": 4, "e": 1}
+    plan = shard_plan(cases(*durations), 2, durations)
+    assert plan == {"a": 0, "b": 1, "c": 1, "d": 0, "e": 1}
+    assert shard_loads(plan, durations, 2) == [14, 12]
+
+
+def test_plan_is_deterministic():
+    durations = {"a": 3, "b": 3, "c": 3, "d": 1}
+    first = shard_plan(cases("d", "c", "b", "a"), 3, durations)
+    assert first == shard_plan(cases("a", "b", "c", "d"), 3, durations)
+    assert first == {"a": 0, "b": 1, "c": 2, "d": 0}
+
+
+def test_cases_without_history_count_as_the_median():
+    durations = {"a": 1, "b": 5, "c": 9}
+    plan = shard_plan(cases("a", "b", "c", "new"), 2, durations)
+    # c (9) on 0, then b and new (5 each) on 1, then a on 0
+    assert plan == {"c": 0, "b": 1, "new": 1, "a": 0}
+
+
+def test_every_case_is_planned_once_without_history():
+    names = [f"case {index}" for index in range(10)]
+    plan = shard_plan(cases(*names), 4, {})
+    assert sorted(plan) == sorted(names)
+    assert sorted(list(plan.values()).count(shard) for shard in range(4)) == [2, 2, 3, 3]
+
+
+def test_case_durations_sum_matrix_cells():
+    results = {"order coffee": {"ms": 100}, "order tea [A/en-US]": {"ms": 30}, "order tea [B/fr-CA]": {"ms": 20},
+               "old": {"outcome": "passed"}}
+    assert case_durations(results) == {"order coffee": 100, "order tea": 50}
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (1, 4)
+    with pytest.raises(ValueError):
+        parse_shard("5/4")
+    with pytest.raises(ValueError):
+        parse_shard("0/4")
+
+
+def test_case_missing_from_the_plan_has_a_stable_shard():
+    shard = case_shard({}, "added later", 3)
+    assert 0 <= shard < 3
+    assert case_shard({}, "added later", 3) == shard
+    assert case_shard({"added later": 2}, "added later", 3) == 2
+
+
+def test_worker_results_are_merged(tmp_path):
+    write_worker_results(str(tmp_path), 0, {"run_test.py::test_[a.]": {"outcome": "passed"}},
+                         {"stopped": 2, "already_ended": 1, "failed": []})
+    write_worker_results(str(tmp_path), 1, {"run_test.py::test_[b.]": {"outcome": "failed"}},
+                         {"stopped": 1, "already_ended": 0, "failed": [{"session_id": "s", "error": "e"}]})
+    write_worker_results(str(tmp_path), 2, {}, None)
+    results, teardown = load_worker_results(str(tmp_path))
+    assert sorted(results) == ["run_test.py::test_[a.]", "run_test.py::test_[b.]"]
+    assert teardown == {"stopped": 3, "already_ended": 1, "failed": [{"session_id": "s", "error": "e"}]}
+
+
+def test_workers_and_merge_only_collect_the_yaml_test_cases():
+    worker = worker_command(1, 4, "shards", ["--parallel", "8"])
+    assert worker[2:] == ["pytest", TEST_PATH, "--shard=2/4", "--shard-dir=shards", "--parallel", "8"]
+    assert merge_command("shards")[2:] == ["pytest", TEST_PATH, "--shard-merge", "--shard-dir=shards"]
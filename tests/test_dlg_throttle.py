@@ -0,0 +1,92 @@
+import logging
+import time
+import pytest
+from grpc import StatusCode
+import dlg_throttle
+from dlg_throttle import BACKOFF_BASE, MIN_RATE, configured_rate, get_rate_limiter, rate_limiter, session_pause
+
+'''
+Unit tests of the shared rate limiter: the configured rate and the token bucket with its adaptive backoff.
+'''
+
+
+@pytest.mark.parametrize("project_data, rate", [
+    ({"rate_limit": "0", "sleep": "1"}, 0),
+    ({"rate_limit": 0, "sleep": "1"}, 0),
+    ({"rate_limit": "10", "sleep": "1"}, 10),
+    ({"rate_limit": None, "sleep": "1"}, 0),
+    ({"rate_limit": "", "sleep": "0.2"}, 0),
+    ({}, 0),
+])
+def test_configured_rate(project_data, rate):
+    assert configured_rate(project_data) == pytest.approx(rate)
+
+
+def test_sleep_is_a_pause_before_turns_only():
+    project_data = {"sleep": "0.5"}
+    assert session_pause(project_data, "Execute") == 0.5
+    assert session_pause(project_data, "ExecuteStream") == 0.5
+    assert session_pause(project_data, "Stop") == 0
+    assert session_pause({}, "Start") == 0
+
+
+def test_limiter_is_shared_and_warns_on_another_rate(monkeypatch, caplog):
+    monkeypatch.setattr(dlg_throttle, "_limiters", {})
+    project_data = {"serverUrl": "dlg.example:443", "client_id": "a", "rate_limit": "10"}
+    limiter = get_rate_limiter(project_data)
+    with caplog.at_level(logging.WARNING, logger="dlg_throttle"):
+        assert get_rate_limiter(project_data) is limiter
+        assert caplog.text == ""
+        assert get_rate_limiter(dict(project_data, rate_limit="0")) is limiter
+    assert "rate_limit 0 ignored" in caplog.text
+    assert get_rate_limiter(dict(project_data, client_id="b")) is not limiter
+
+
+def test_unlimited_never_waits():
+    limiter = rate_limiter(0, 1)
+    assert all(limiter.acquire() == 0 for _ in range(100))
+
+
+def test_burst_then_spacing():
+    limiter = rate_limiter(100, 2)
+    assert limiter.acquire() == 0
+    assert limiter.acquire() == 0
+    wait = limiter.acquire()
+    assert 0 < wait <= 0.011
+
+
+def test_pushback_halves_rate_and_blocks():
+    limiter = rate_limiter(10, 5)
+    limiter.report(StatusCode.RESOURCE_EXHAUSTED)
+    assert limiter.rate == 5
+    assert limiter.blocked_until >= time.monotonic() + BACKOFF_BASE - 0.1
+    limiter.report(StatusCode.UNAVAILABLE)
+    assert limiter.rate == 2.5
+    assert limiter.failures == 2
+
+
+def test_rate_never_below_minimum():
+    limiter = rate_limiter(1, 1)
+    for _ in range(10):
+        limiter.report(StatusCode.RESOURCE_EXHAUSTED)
+    assert limiter.rate == MIN_RATE
+
+
+def test_rate_recovers_up_to_the_limit():
+    limiter = rate_limiter(10, 5)
+    limiter.report(StatusCode.RESOURCE_EXHAUSTED)
+    for _ in range(100):
+        limiter.report(StatusCode.OK)
+    assert limiter.rate == 10
+    assert limiter.failures == 0
+
+
+def test_unlimited_becomes_unlimited_again():
+    limiter = rate_limiter(0, 1)
+    limiter.acquire()
+    limiter.acquire()
+    limiter.report(StatusCode.RESOURCE_EXHAUSTED)
+    assert limiter.rate > 0
+    for _ in range(1000):
+        limiter.report(StatusCode.OK)
+    assert limiter.rate == 0
@@ -0,0 +1,66 @@
+import json
+import socket
+import pytest
+from dlg import session_start, timing_summary
+from dlg_mock_server import mock_dialog_service, serve
+
+'''
+Unit tests of the RPC timings of session_start, against the local stand-in server, and of their summary.
+'''
+
+SCRIPT = {"initial": {"payload": {"qaAction": {"message": {"visual": [{"text": "Hello and welcome"}]}}}},
+          "responses": {"order coffee": {"payload": {"qaAction": {"message": {
+              "visual": [{"text": "What size coffee would you like?"}]}}}}}}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def server_config(tmp_path):
+    port = free_port()
+    server, servicer = serve(port, mock_dialog_service(SCRIPT), 4)
+
+    def write(**values):
+        config = {"serverUrl": f"localhost:{port}", "insecure": True, "modelUrn": "urn:timings",
+                  "teardown_workers": 0, "log_level": "off"}
+        config.update(values)
+        path = tmp_path / "config.json"
+        path.write_text(json.dumps(config))
+        return str(path)
+
+    yield write
+    server.stop(0)
+
+
+def test_every_rpc_is_timed_per_step(server_config):
+    with session_start(server_config()) as session:
+        session.execute_request(None, "Hello and welcome")
+        session.execute_request("order coffee", "What size coffee")
+    timings = session.timings
+    assert [(timing["step"], timing["rpc"]) for timing in timings] == \
+        [(0, "connect"), (0, "Start"), (1, "Execute"), (2, "Execute"), (2, "Stop")]
+    assert all(timing["ms"] >= 0 and timing["retries"] == 0 and not timing["hedged"] for timing in timings)
+
+
+def test_throttling_is_reported_as_wait(server_config):
+    with session_start(server_config(rate_limit="5", burst="1")) as session:
+        session.execute_request(None, "Hello and welcome")
+    start, execute = [timing for timing in session.timings if timing["rpc"] in ("Start", "Execute")]
+    assert start["wait_ms"] < 50
+    assert execute["wait_ms"] > 100
+    assert execute["ms"] < execute["wait_ms"]
+
+
+def test_timing_summary():
+    timings = [{"rpc": "Execute", "ms": 10, "wait_ms": 0, "retries": 0, "hedged": False},
+               {"rpc": "Execute", "ms": 30, "wait_ms": 5, "retries": 2, "hedged": True},
+               {"rpc": "Start", "ms": 7, "wait_ms": 1}]
+    summary = timing_summary(timings)
+    assert summary["Execute"] == {"count": 2, "total_ms": 40, "max_ms": 30, "wait_ms": 5, "retries": 2,
+                                  "hedged": 1, "mean_ms": 20}
+    assert summary["Start"]["count"] == 1
+    assert summary["Start"]["mean_ms"] == 7